@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""Benchmark run-model-comparison.py against the local mock LLM server.
+
+Starts mock-llm-server.py in-process, drives ``run_all_models`` through a
+set of scenarios (serial, concurrent, streaming, cached) and times
+``compare_models`` over the results. Reports end-to-end throughput and the
+harness overhead per query, i.e. wall-clock cost beyond the latency the
+mock server injected. No network access or model quota is used.
+
+Usage:
+ # Run the default scenarios with 500 queries per model
+ python benchmark-model-comparison.py
+
+ # Record a baseline, then fail CI if a later run regresses by > 20%
+ python benchmark-model-comparison.py --save-baseline evaluation/bench-baseline.json
+ python benchmark-model-comparison.py --baseline evaluation/bench-baseline.json --max-regression-pct 20
+
+Requirements:
+ pip install agent-framework-azure-ai # client used by run-model-comparison.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+def load_script(file_name: str, module_name: str) -> ModuleType:
+    """Import a sibling script whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPTS_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+runner = load_script("run-model-comparison.py", "run_model_comparison")
+mock = load_script("mock-llm-server.py", "mock_llm_server")
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Scenario:
+    """One benchmark configuration."""
+    name: str
+    concurrency: int = 1
+    latency_ms: float = 0.0
+    latency_dist: str = "fixed"
+    stream: bool = False
+    cache: str = "off" # "warm" = fill the cache first, then time an all-hit pass
+
+DEFAULT_SCENARIOS = [
+    # Zero server latency isolates the harness + HTTP cost per query
+    Scenario("serial-zero-latency", concurrency=1),
+    Scenario("concurrent-16", concurrency=16, latency_ms=50, latency_dist="lognormal"),
+    Scenario("stream-8", concurrency=8, latency_ms=50, stream=True),
+    Scenario("cache-warm", concurrency=8, latency_ms=50, cache="warm"),
+]
+
+# Metrics where a higher value is a regression; everything else is higher-is-better
+LOWER_IS_BETTER = {"harness_overhead_ms_per_query", "aggregation_us_per_row"}
+
+def build_dataset(size: int) -> list[dict]:
+    return [{"id": f"bench-{i}", "input": f"Benchmark query number {i} about topic {i % 37}"} for i in range(size)]
+
+def build_models(count: int) -> list[Any]:
+    return [
+        runner.ModelSpec(name=f"bench-model-{i}", deployment=f"bench-deployment-{i}", role=f"bench-{i}")
+        for i in range(count)
+    ]
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+def run_scenario(
+    scenario: Scenario,
+    server: Any,
+    dataset: list[dict],
+    models: list[Any],
+    work_dir: Path,
+    verbose: bool = False,
+) -> dict[str, Any]:
+    """Run one scenario end to end and return its metrics."""
+    server.config.latency_ms = scenario.latency_ms
+    server.config.latency_dist = scenario.latency_dist
+    results_dir = work_dir / scenario.name / "results"
+    cache = None
+    if scenario.cache == "warm":
+        cache = runner.ResponseCache(work_dir / scenario.name / "cache.sqlite", mode="read")
+
+    def run_all() -> float:
+        start = time.perf_counter()
+        asyncio.run(runner.run_all_models(
+            models=models,
+            dataset=dataset,
+            output_dir=results_dir,
+            concurrency=scenario.concurrency,
+            fresh=True,
+            cache=cache,
+            stream=scenario.stream,
+        ))
+        return time.perf_counter() - start
+
+    output = None if verbose else io.StringIO()
+    with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+        if cache:
+            run_all() # fill the cache; the timed pass below is all hits
+        server.stats.reset()
+        wall_clock_s = run_all()
+
+    stats = server.stats.snapshot()
+    if cache:
+        cache.close()
+
+    start = time.perf_counter()
+    report = runner.compare_models(str(results_dir), runner.Thresholds())
+    aggregation_s = time.perf_counter() - start
+
+    total_queries = len(dataset) * len(models)
+    # Models run in parallel, each with `concurrency` requests in flight, so a
+    # zero-overhead harness finishes in len(dataset) * latency / concurrency.
+    per_query_ms = wall_clock_s * 1000 * scenario.concurrency / len(dataset)
+    overhead_ms = max(0.0, per_query_ms - stats["mean_injected_latency_ms"])
+
+    return {
+        "scenario": asdict(scenario),
+        "queries": total_queries,
+        "wall_clock_s": round(wall_clock_s, 3),
+        "throughput_qps": round(total_queries / wall_clock_s, 2) if wall_clock_s > 0 else 0.0,
+        "harness_overhead_ms_per_query": round(overhead_ms, 3),
+        "aggregation_us_per_row": round(aggregation_s * 1e6 / total_queries, 2),
+        "server": stats,
+        "task_completion": [m["task_completion"] for m in report["models"]],
+    }
+
+def check_baseline(results: list[dict], baseline: dict, max_regression_pct: float) -> list[str]:
+    """Compare scenario metrics with a saved baseline. Returns regressions."""
+    previous = {r["scenario"]["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        name = result["scenario"]["name"]
+        if name not in previous:
+            continue
+        for metric in ("throughput_qps", "harness_overhead_ms_per_query", "aggregation_us_per_row"):
+            old, new = previous[name].get(metric, 0), result[metric]
+            if not old:
+                continue
+            change_pct = (new - old) / old * 100
+            worse = change_pct if metric in LOWER_IS_BETTER else -change_pct
+            if worse > max_regression_pct:
+                regressions.append(f"{name}: {metric} {old} -> {new} ({worse:.1f}% worse)")
+    return regressions
+
+def print_results(results: list[dict]) -> None:
+    print("\n" + "=" * 60)
+    print(" HARNESS BENCHMARK")
+    print("=" * 60)
+    for r in results:
+        s = r["scenario"]
+        print(f"\n {s['name']} (concurrency={s['concurrency']}, latency={s['latency_ms']:.0f}ms "
+              f"{s['latency_dist']}, stream={s['stream']}, cache={s['cache']})")
+        print(f" Throughput: {r['throughput_qps']:.1f} queries/sec ({r['queries']} queries in {r['wall_clock_s']:.2f}s)")
+        print(f" Harness Overhead: {r['harness_overhead_ms_per_query']:.2f}ms/query")
+        print(f" Aggregation: {r['aggregation_us_per_row']:.1f}us/row")
+    print("\n" + "=" * 60 + "\n")
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the model comparison harness against a local mock LLM server",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--queries", type=int, default=500, help="Queries per model (default: 500)")
+    parser.add_argument("--models", type=int, default=2, help="Models evaluated in parallel (default: 2)")
+    parser.add_argument("--scenario", action="append",
+                        help="Run only the named scenario (repeatable)")
+    parser.add_argument("--output", default=None,
+                        help="Write the benchmark report JSON to this path")
+    parser.add_argument("--baseline", default=None,
+                        help="Benchmark report to compare against; exit 1 on regression")
+    parser.add_argument("--save-baseline", default=None,
+                        help="Write this run as the new baseline")
+    parser.add_argument("--max-regression-pct", type=float, default=20.0,
+                        help="Allowed regression per metric vs baseline (default: 20)")
+    parser.add_argument("--verbose", action="store_true", help="Show runner progress output")
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    scenarios = [s for s in DEFAULT_SCENARIOS if not args.scenario or s.name in args.scenario]
+    if not scenarios:
+        print(f"ERROR: No scenario matches {args.scenario}. "
+              f"Available: {', '.join(s.name for s in DEFAULT_SCENARIOS)}", file=sys.stderr)
+        return 1
+
+    server = mock.start_server(mock.MockConfig(seed=42))
+    os.environ["FOUNDRY_ENDPOINT"] = server.url
+    os.environ.setdefault("FOUNDRY_API_KEY", "mock")
+    print(f"Mock LLM server: {server.url}")
+
+    dataset = build_dataset(args.queries)
+    models = build_models(args.models)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="rmc-bench-") as tmp:
+            for scenario in scenarios:
+                print(f" Running scenario: {scenario.name}")
+                results.append(run_scenario(scenario, server, dataset, models, Path(tmp), args.verbose))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print_results(results)
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "queries_per_model": args.queries,
+        "models": args.models,
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_text(json.dumps(report, indent=2), encoding="utf-8")
+            print(f" Saved: {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = check_baseline(results, json.load(f), args.max_regression_pct)
+        if regressions:
+            print("BENCHMARK REGRESSION:")
+            for line in regressions:
+                print(f" - {line}")
+            return 1
+        print(f" No regressions beyond {args.max_regression_pct:.0f}% vs {args.baseline}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
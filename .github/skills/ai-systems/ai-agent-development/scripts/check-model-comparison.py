@@ -0,0 +1,733 @@
+#!/usr/bin/env python3
+"""Behaviour checks for run-model-comparison.py against the local mock LLM server.
+
+Starts mock-llm-server.py in-process and exercises the parts of the runner
+that are easy to break without noticing: resuming an interrupted run,
+streaming and parallel aggregation, adaptive concurrency, hedging, sharding
+plus merge, the work queue, early stopping, bootstrap statistics, the
+aggregate cache, de-duplication, batch mode (via mock-batch-service.py),
+load-test saturation, the LLM judge, cost and --max-spend accounting, the
+dataset index and report ids in the history warehouse. Each check works in
+its own temporary directory and counts the requests the mock server
+actually received; failures and throttling are injected by changing the
+mock's configuration for the duration of a check. No network access or
+model quota is used; exits 1 if any check fails.
+
+Usage:
+ # Run every check
+ python check-model-comparison.py
+
+ # Run selected checks with runner output shown
+ python check-model-comparison.py --check resume --check hedging --verbose
+
+Requirements:
+ pip install agent-framework-azure-ai # client used by run-model-comparison.py
+ pip install numpy # bootstrap check
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Any, Callable, Iterator
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+def load_script(file_name: str, module_name: str) -> ModuleType:
+    """Import a sibling script whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPTS_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+runner = load_script("run-model-comparison.py", "run_model_comparison")
+mock = load_script("mock-llm-server.py", "mock_llm_server")
+batch_service = load_script("mock-batch-service.py", "mock_batch_service")
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+class CheckFailed(Exception):
+    """An expectation of a behaviour check did not hold."""
+
+def expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise CheckFailed(message)
+
+def build_dataset(size: int, strata: int = 3) -> list[dict]:
+    return [
+        {"id": f"check-{i}", "input": f"Check query number {i}", "tags": [f"group-{i % strata}"]}
+        for i in range(size)
+    ]
+
+def build_model(name: str = "check-model", priced: bool = False) -> Any:
+    # Prices high enough that a handful of mock calls reach a small budget
+    prices = {"input_cost_per_1m": 1000.0, "output_cost_per_1m": 2000.0} if priced else {}
+    return runner.ModelSpec(name=name, deployment=f"{name}-deployment", role="primary", **prices)
+
+def run_models(server: Any, models: list[Any], dataset: list[dict], output_dir: Path, **kwargs: Any) -> int:
+    """Run ``run_all_models`` and return the number of requests the mock server received."""
+    server.stats.reset()
+    asyncio.run(runner.run_all_models(models=models, dataset=dataset, output_dir=output_dir, **kwargs))
+    return server.stats.snapshot()["requests"]
+
+@contextlib.contextmanager
+def mock_config(server: Any, **changes: Any) -> Iterator[None]:
+    """Change the mock server's behaviour (``MockConfig`` fields) for the duration of a block."""
+    saved = {key: getattr(server.config, key) for key in changes}
+    for key, value in changes.items():
+        setattr(server.config, key, value)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(server.config, key, value)
+
+def read_results(path: Path) -> list[dict]:
+    results: list[dict] = []
+    runner.scan_result_file(path, results.append)
+    return results
+
+def result_indices(path: Path) -> list[int]:
+    return [r["index"] for r in read_results(path)]
+
+def run_summary(path: Path) -> dict:
+    return runner.scan_result_file(path, lambda r: None).get("run", {})
+
+def drop_results(path: Path, lost: set[int]) -> None:
+    """Rewrite a result file without the results of ``lost`` indices, as if a crash lost them."""
+    lines = path.read_text(encoding="utf-8").splitlines(keepends=True)
+    path.write_text("".join(line for line in lines if json.loads(line).get("index") not in lost), encoding="utf-8")
+
+def only_result_file(results_dir: Path) -> Path:
+    files = runner.find_result_files(results_dir)
+    expect(len(files) == 1, f"expected one result file in {results_dir}, found {len(files)}")
+    return files[0]
+
+# ---------------------------------------------------------------------------
+# Checks
+# ---------------------------------------------------------------------------
+
+def check_resume(server: Any, work_dir: Path) -> None:
+    """An interrupted run resumes where it stopped and keeps earlier run summaries."""
+    dataset = build_dataset(40)
+    model = build_model(priced=True)
+    results_dir = work_dir / "results"
+
+    sent = run_models(server, [model], dataset, results_dir, concurrency=4, fresh=True, warmup=1)
+    expect(sent == 41, f"first run sent {sent} requests, expected 40 queries + 1 warm-up")
+    path = only_result_file(results_dir)
+    first = run_summary(path)
+    # The warm-up is a one-token request, not a second payment for a dataset query
+    warmup_cost = first["warmup"].get("cost_usd", 0.0)
+    per_query = (first["spent_usd"] - warmup_cost) / len(dataset)
+    expect(warmup_cost < per_query / 10, f"the warm-up cost ${warmup_cost:.4f}, a query ${per_query:.4f}")
+
+    # Nothing left to do: no requests, and the first run's warm-up and spend survive the new summary
+    sent = run_models(server, [model], dataset, results_dir, concurrency=4, warmup=1)
+    expect(sent == 0, f"resuming a complete run sent {sent} requests")
+    combined = run_summary(path)
+    expect(combined.get("warmup") == first.get("warmup"), "resume replaced the first run's warm-up summary")
+    expect(abs(combined.get("spent_usd", 0) - first.get("spent_usd", 0)) < 1e-9,
+           f"resume changed spent_usd from {first.get('spent_usd')} to {combined.get('spent_usd')}")
+
+    # Simulate a crash after 25 results, with the last line half-written
+    lines = path.read_text(encoding="utf-8").splitlines(keepends=True)
+    kept = [line for line in lines if "index" not in json.loads(line)][:1]
+    kept += [line for line in lines if "index" in json.loads(line)][:25]
+    path.write_text("".join(kept) + '{"index": 99, "resp', encoding="utf-8")
+
+    sent = run_models(server, [model], dataset, results_dir, concurrency=4)
+    expect(sent == 15, f"resume sent {sent} requests, expected the 15 missing queries")
+    indices = result_indices(path)
+    expect(sorted(indices) == list(range(40)), "resumed file does not hold every index exactly once")
+
+    # Other queries of the same count, or another system prompt, must not resume these results
+    changed = [{**item, "input": item["input"] + " (changed)"} for item in dataset]
+    for label, kwargs in (("dataset", {"dataset": changed}), ("system prompt", {"system_prompt": "Be terse."})):
+        try:
+            run_models(server, [model], kwargs.pop("dataset", dataset), results_dir, **kwargs)
+        except SystemExit:
+            continue
+        raise CheckFailed(f"a run with a different {label} resumed the existing results")
+
+    # A legacy <model>.json from before streaming results must not report the model twice
+    path.with_suffix(".json").write_text(json.dumps({"model": model.name, "results": []}), encoding="utf-8")
+    files = runner.find_result_files(results_dir)
+    expect(files == [path], f"legacy result file listed beside {path.name}: {[f.name for f in files]}")
+
+def check_budget(server: Any, work_dir: Path) -> None:
+    """--max-spend caps the spend; cached results cost nothing but keep the model's unit cost."""
+    dataset = build_dataset(60)
+    model = build_model(priced=True)
+    thresholds = runner.Thresholds()
+
+    # At $0.20 one call fits, whatever the concurrency, and no hedge sent before its cost is known;
+    # at $2.00 hedges fire once the cost per call is known and must be charged
+    for limit_usd, concurrency in ((0.2, 1), (0.2, 8), (0.2, 32), (2.0, 4)):
+        budget = runner.SpendBudget(limit_usd)
+        results_dir = work_dir / f"budget-{limit_usd:g}-{concurrency}"
+        sent = run_models(server, [model], dataset, results_dir, concurrency=concurrency, fresh=True,
+                          budget=budget, hedge={"delay_ms": 0, "budget": 0.5})
+        expect(budget.spent_usd <= limit_usd, f"spent ${budget.spent_usd:.4f} over the ${limit_usd:.2f} cap")
+        scores = runner.compare_models(str(results_dir), thresholds, use_cache=False)["models"][0]
+        expect(scores["budget_stop"] is not None, "a run stopped by the budget records no budget_stop")
+        expect(scores["dataset_size"] < len(dataset), "the budget did not stop the run early")
+        expect(abs(scores["total_cost_usd"] - budget.spent_usd) < 1e-4,
+               f"report spent ${scores['total_cost_usd']} but the budget charged ${budget.spent_usd:.6f}")
+        expect(sent >= scores["dataset_size"], f"{sent} requests cannot answer {scores['dataset_size']} queries")
+    expect(scores["hedged_queries"] > 0, "no hedge fired, so hedge spend went unchecked")
+
+    cache = runner.ResponseCache(work_dir / "cache.sqlite", mode="read")
+    try:
+        paid_dir, cached_dir = work_dir / "paid", work_dir / "cached"
+        sent = run_models(server, [model], dataset, paid_dir, concurrency=4, fresh=True, cache=cache)
+        expect(sent == len(dataset), f"filling the cache sent {sent} requests for {len(dataset)} queries")
+        sent = run_models(server, [model], dataset, cached_dir, concurrency=4, fresh=True, cache=cache, warmup=2)
+        expect(sent == 0, f"an all-hit cached run sent {sent} requests (including warm-up)")
+    finally:
+        cache.close()
+    paid = runner.compare_models(str(paid_dir), thresholds, use_cache=False)["models"][0]
+    cached = runner.compare_models(str(cached_dir), thresholds, use_cache=False)["models"][0]
+    expect(paid["total_cost_usd"] > 0, "a priced run reports no spend")
+    expect(cached["total_cost_usd"] == 0, f"cache hits reported ${cached['total_cost_usd']} spent")
+    expect(cached["estimated_cost_per_1k"] == paid["estimated_cost_per_1k"],
+           "cache hits changed the model's cost per 1k queries")
+
+def check_dataset_index(server: Any, work_dir: Path) -> None:
+    """Malformed lines are skipped and reported; strata come from each row's top-level tags."""
+    rows = [
+        '{"input": "a", "tags": ["x"]}',
+        '{"input": "broken", "tags": ["x"]',
+        '["not", "an", "object"]',
+        '{"input": "b", "tags": ["a]b"], "meta": {"tags": ["nested"]}}',
+        '{"input": "c", "meta": {"tags": ["nested"]}}',
+        '',
+        '{"input": "d", "tags": "x"}',
+    ]
+    path = work_dir / "dataset.jsonl"
+    path.write_text("\n".join(rows) + "\n", encoding="utf-8")
+    index_dir = work_dir / "index"
+
+    for attempt in ("cold", "indexed"):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            dataset = runner.load_dataset(str(path), index_dir=index_dir)
+        expect([row["input"] for row in dataset] == ["a", "b", "c", "d"],
+               f"{attempt} load returned {[row.get('input') for row in dataset]}")
+        expect("Skipped 2 dataset line(s)" in stderr.getvalue() and "line 2, 3" in stderr.getvalue(),
+               f"{attempt} load did not report the two malformed lines: {stderr.getvalue().strip()!r}")
+        keys = list(dataset.tag_keys())
+        expected = [runner.tag_key(row.get("tags")) for row in dataset]
+        expect(keys == expected, f"{attempt} load indexed tags {keys}, expected {expected}")
+
+def check_shard_merge(server: Any, work_dir: Path) -> None:
+    """Shards split every stratum evenly and merge back into one complete result file."""
+    dataset = build_dataset(50, strata=4)
+    model = build_model(priced=True)
+    shards_dir, merged_dir = work_dir / "shards", work_dir / "merged"
+
+    owners: dict[int, int] = {}
+    for i in range(1, 4):
+        part = runner.shard_indices(dataset, i, 3)
+        expect(not owners.keys() & set(part), f"shard {i}/3 repeats indices of another shard")
+        owners.update(dict.fromkeys(part, i))
+        for stratum in range(4):
+            size = sum(dataset[n]["tags"] == [f"group-{stratum}"] for n in part)
+            total = sum(row["tags"] == [f"group-{stratum}"] for row in dataset)
+            expect(abs(size - total / 3) < 1, f"shard {i}/3 holds {size} of the {total} rows of group-{stratum}")
+    expect(sorted(owners) == list(range(len(dataset))), "shards do not cover the whole dataset")
+
+    sent = 0
+    for i in range(1, 4):
+        sent += run_models(server, [model], dataset, shards_dir, concurrency=4, fresh=True, shard=(i, 3), warmup=1)
+    expect(sent == len(dataset) + 3, f"three shards sent {sent} requests for {len(dataset)} queries + 3 warm-ups")
+
+    written = runner.merge_result_files([shards_dir], merged_dir)
+    expect(len(written) == 1, f"merge wrote {len(written)} files for one model")
+    expect(sorted(result_indices(written[0])) == list(range(len(dataset))),
+           "merged file does not hold every index exactly once")
+    report = runner.compare_models(str(merged_dir), runner.Thresholds(), use_cache=False)
+    expect(report["models"][0]["dataset_size"] == len(dataset),
+           f"merged report covers {report['models'][0]['dataset_size']} queries")
+
+    # The shards' spend adds up and the cold start survives the merge
+    shard_runs = [run_summary(path) for path in runner.find_result_files(shards_dir)]
+    merged_run = run_summary(written[0])
+    shard_spend = sum(run["spent_usd"] for run in shard_runs)
+    expect(abs(merged_run.get("spent_usd", 0) - shard_spend) < 1e-6,
+           f"merged spent_usd {merged_run.get('spent_usd')} != shard total {shard_spend:.6f}")
+    expect(merged_run.get("warmup") == shard_runs[0]["warmup"], "merge dropped the shards' warm-up summary")
+
+    # A shard stopped by --max-spend leaves the merged results incomplete
+    capped_dir = work_dir / "capped"
+    for i in range(1, 4):
+        budget = runner.SpendBudget(0.2) if i == 2 else None
+        run_models(server, [model], dataset, capped_dir, concurrency=4, fresh=True, shard=(i, 3), budget=budget)
+    written = runner.merge_result_files([capped_dir], work_dir / "capped-merged")
+    scores = runner.compare_models(str(written[0].parent), runner.Thresholds(), use_cache=False)["models"][0]
+    expect(scores["budget_stop"] is not None, "merge dropped a shard's budget_stop")
+    expect(not scores["passed"] and any("incomplete" in f for f in scores["failures"]),
+           "a merged run with a capped shard passed the gates")
+
+def check_warehouse(server: Any, work_dir: Path) -> None:
+    """Reports generated within the same second are all recorded; re-ingesting one is refused."""
+    results_dir = work_dir / "results"
+    run_models(server, [build_model()], build_dataset(5), results_dir, fresh=True)
+    reports = [runner.compare_models(str(results_dir), runner.Thresholds()) for _ in range(3)]
+    expect(len({r["report_id"] for r in reports}) == 3, "reports generated together share a report id")
+
+    warehouse = runner.RunWarehouse(work_dir / "history.sqlite")
+    try:
+        run_ids = [warehouse.ingest(report) for report in reports]
+        expect(None not in run_ids, f"warehouse dropped a report: run ids {run_ids}")
+        expect(warehouse.ingest(reports[0]) is None, "re-ingesting a stored report was not refused")
+    finally:
+        warehouse.close()
+
+def check_streaming_aggregation(server: Any, work_dir: Path) -> None:
+    """Streaming aggregation of JSONL and legacy JSON files matches aggregating the loaded result list."""
+    dataset = build_dataset(60)
+    model = build_model(priced=True)
+    results_dir = work_dir / "results"
+
+    # Mix cached, streamed and failed results in one file
+    cache = runner.ResponseCache(work_dir / "cache.sqlite")
+    try:
+        run_models(server, [model], dataset[:20], work_dir / "fill", concurrency=4, fresh=True, cache=cache)
+        with mock_config(server, throttle_rate=0.6, retry_after_s=0.01):
+            run_models(server, [model], dataset, results_dir, concurrency=8, fresh=True, cache=cache, stream=True)
+    finally:
+        cache.close()
+    path = only_result_file(results_dir)
+    legacy = work_dir / "legacy" / "check-model.json"
+    legacy.parent.mkdir()
+    legacy.write_text(json.dumps(runner.load_result_file(path)), encoding="utf-8")
+
+    expected = asdict(runner.aggregate_scores(runner.load_result_file(path)))
+    expect(expected["cache_hits"] == 20 and expected["streamed_queries"] and expected["task_completion"] < 1,
+           "the run did not mix cached, streamed and failed results")
+    for label, source in (("JSONL", path), ("legacy JSON", legacy)):
+        streamed = asdict(runner.aggregate_result_file(source))
+        differ = sorted(key for key in expected if streamed[key] != expected[key])
+        expect(not differ, f"streaming aggregation of the {label} file differs in {differ}")
+
+def check_parallel_aggregation(server: Any, work_dir: Path) -> None:
+    """Aggregating with --workers gives the same models, in the same order, as a serial pass."""
+    results_dir = work_dir / "results"
+    models = [build_model(f"check-model-{k}") for k in range(4)]
+    with mock_config(server, throttle_rate=0.5, retry_after_s=0.01):
+        run_models(server, models, build_dataset(30), results_dir, concurrency=4, fresh=True)
+
+    files = runner.find_result_files(results_dir)
+    serial = [asdict(r) for r in runner.aggregate_result_files(files, workers=1)]
+    parallel = [asdict(r) for r in runner.aggregate_result_files(files, workers=3)]
+    expect([r["name"] for r in serial] == [m.name for m in models], "serial aggregation reordered the models")
+    expect(parallel == serial, "aggregation across worker processes differs from the serial pass")
+    reports = [runner.compare_models(str(results_dir), runner.Thresholds(), workers=w, use_cache=False) for w in (1, 3)]
+    for key in ("models", "winner_by_metric", "alerts"):
+        expect(reports[0][key] == reports[1][key], f"--workers 3 changed the report's {key}")
+
+def check_adaptive_concurrency(server: Any, work_dir: Path) -> None:
+    """AIMD halves its limit once per burst of 429s, honours Retry-After and retries throttled queries."""
+    controller = runner.AdaptiveConcurrency(max_limit=8, initial=8)
+    throttled = {"error": "HTTP 429", "error_status": 429}
+
+    async def overload() -> bool:
+        for _ in range(2):
+            await controller.acquire()
+        for _ in range(2):
+            await controller.release(throttled, retry_after=30.0)
+        return controller.try_acquire()
+
+    expect(not asyncio.run(overload()), "a Retry-After did not pause new dispatches")
+    expect(controller.limit == 4, f"two 429s in one cooldown left the limit at {controller.limit:g}, expected 4")
+    expect(controller.backoff_seconds(1, 0.25) == 0.25, "backoff ignored Retry-After")
+    expect([controller.backoff_seconds(n, None) for n in (1, 2, 3)] == [0.5, 1.0, 2.0], "backoff is not exponential")
+
+    results_dir = work_dir / "results"
+    with mock_config(server, throttle_rate=0.5, retry_after_s=0.01):
+        run_models(server, [build_model()], build_dataset(80), results_dir, concurrency=16, fresh=True, adaptive=True)
+    path = only_result_file(results_dir)
+    timeline = run_summary(path)["concurrency_timeline"]
+    reasons = {entry["reason"] for entry in timeline}
+    expect({"healthy", "throttled"} <= reasons, f"the limit never both grew and backed off: {sorted(reasons)}")
+    expect(max(entry["limit"] for entry in timeline) <= 16, "the adaptive limit exceeded --concurrency")
+    results = read_results(path)
+    expect(any(r.get("attempts", 1) > 1 for r in results), "no throttled query was retried")
+    gave_up = [r["index"] for r in results if r["error"] and r.get("attempts") != 4]
+    expect(not gave_up, f"queries {gave_up} failed before using their retries")
+
+def check_hedging(server: Any, work_dir: Path) -> None:
+    """Slow requests are hedged within budget, and latency saved matches the attempts' latencies."""
+    dataset = build_dataset(60)
+    results_dir = work_dir / "results"
+    with mock_config(server, latency_dist="exponential", latency_ms=30):
+        sent = run_models(server, [build_model()], dataset, results_dir, concurrency=4, fresh=True,
+                          hedge={"delay_ms": 20, "budget": 0.3})
+    path = only_result_file(results_dir)
+    hedged = [r for r in read_results(path) if r.get("hedge")]
+    expect(hedged, "no slow request was hedged")
+    expect(len(hedged) == run_summary(path)["hedges_fired"], "hedged records do not match hedges_fired")
+    expect(len(hedged) <= 0.3 * len(dataset) + 1, f"{len(hedged)} hedges exceed the 30% hedge budget")
+    expect(sent == len(dataset) + len(hedged), f"{sent} requests for {len(dataset)} queries and {len(hedged)} hedges")
+
+    for r in hedged:
+        hedge = r["hedge"]
+        expect(r["latency_ms"] >= hedge["delay_ms"], f"query {r['index']} was hedged before the hedge delay")
+        if hedge["primary_latency_ms"] is not None:
+            saved = max(0, hedge["primary_latency_ms"] - r["latency_ms"])
+            expect(hedge["latency_saved_ms"] == saved,
+                   f"query {r['index']} saved {hedge['latency_saved_ms']}ms, attempts say {saved}ms")
+    scores = runner.compare_models(str(results_dir), runner.Thresholds(), use_cache=False)["models"][0]
+    wins = sum(r["hedge"]["winner"] == "hedge" for r in hedged)
+    expect(wins, "no hedge beat its original request")
+    expect((scores["hedged_queries"], scores["hedge_wins"]) == (len(hedged), wins),
+           f"report counts {scores['hedged_queries']} hedges / {scores['hedge_wins']} wins, "
+           f"files hold {len(hedged)} / {wins}")
+    expect(scores["avg_latency_saved_ms"] > 0, "hedges that won saved no latency")
+
+def check_queue(server: Any, work_dir: Path) -> None:
+    """A crashed worker's lease expires and is handed out again; late duplicates are dropped at merge."""
+    dataset = build_dataset(20)
+    model = build_model()
+    results_dir = work_dir / "results"
+    queue = runner.WorkQueue(work_dir / "queue.sqlite", lease_seconds=0.5)
+    try:
+        # A worker leases the first query, then dies without completing it
+        queue.enqueue(model.name, [0])
+        expect(queue.lease(model.name, "crashed-worker") == 0, "the first lease was not index 0")
+        expect(queue.lease(model.name, "other-worker") is None, "a live lease was handed out twice")
+
+        sent = run_models(server, [model], dataset, results_dir, concurrency=4, queue=queue)
+        expect(queue.progress(model.name) == (20, 20), f"queue progress {queue.progress(model.name)}, expected (20, 20)")
+    finally:
+        queue.close()
+    expect(sent == len(dataset), f"the coordinator sent {sent} requests for {len(dataset)} queries")
+    merged = results_dir / f"{runner.result_file_name(model)}.jsonl"
+    expect(sorted(result_indices(merged)) == list(range(20)), "merged queue results miss or repeat an index")
+
+    # The crashed worker finishes after all and writes its own result for index 0
+    (worker_file,) = (results_dir / "workers").glob("*.jsonl")
+    lines = worker_file.read_text(encoding="utf-8").splitlines(keepends=True)
+    straggler = [line for line in lines if json.loads(line).get("index", 0) == 0 and "run" not in json.loads(line)]
+    (worker_file.parent / f"{runner.result_file_name(model)}.crashed-worker.jsonl").write_text(
+        "".join(straggler), encoding="utf-8")
+    (remerged,) = runner.merge_result_files([results_dir / "workers"], work_dir / "remerged")
+    expect(sorted(result_indices(remerged)) == list(range(20)), "a late duplicate changed the merged results")
+    expect(run_summary(remerged)["duplicates_dropped"] == 1, "the late duplicate was not reported as dropped")
+
+def check_early_stop(server: Any, work_dir: Path) -> None:
+    """Early stopping rarely stops a model at its gate, and stops one that clearly fails it."""
+    thresholds = runner.Thresholds()
+    rng = random.Random(7)
+    ok = {"error": None, "response": "a well-formed response"}
+    failed = {"error": "HTTP 500", "response": ""}
+    trials, stops = 400, 0
+    for _ in range(trials):
+        # True task completion exactly at the threshold: any stop is a false stop
+        stopper = runner.EarlyStopper(thresholds)
+        stops += any(stopper.add(ok if rng.random() < thresholds.task_completion else failed) for _ in range(300))
+    # 5% allowed, plus three standard errors of the estimate
+    expect(stops / trials <= 0.05 + 3 * (0.05 * 0.95 / trials) ** 0.5,
+           f"{stops}/{trials} models meeting their gate were stopped early")
+
+    dataset = build_dataset(200)
+    model = build_model()
+    results_dir = work_dir / "results"
+    early_stop = {"thresholds": thresholds, "min_samples": 20}
+    with mock_config(server, throttle_rate=0.8, retry_after_s=0.01):
+        run_models(server, [model], dataset, results_dir, concurrency=4, fresh=True, early_stop=early_stop)
+        scores = runner.compare_models(str(results_dir), thresholds, use_cache=False)["models"][0]
+        expect(scores["early_stop"] is not None, "a model failing half its queries was not stopped early")
+        expect(scores["dataset_size"] < len(dataset), "the early-stopped model still ran every query")
+        expect(not scores["passed"], "an early-stopped model passed its gates")
+        sent = run_models(server, [model], dataset, results_dir, concurrency=4, early_stop=early_stop)
+    expect(sent == 0, f"resuming an early-stopped model sent {sent} requests")
+
+def check_bootstrap(server: Any, work_dir: Path) -> None:
+    """Bootstrap intervals cover the estimate, pairs are joined per query, and a clear gap is significant."""
+    dataset = build_dataset(80)
+    results_dir = work_dir / "results"
+    run_models(server, [build_model("check-steady")], dataset, results_dir, concurrency=8, fresh=True)
+    with mock_config(server, throttle_rate=0.8, retry_after_s=0.01):
+        run_models(server, [build_model("check-flaky")], dataset, results_dir, concurrency=8, fresh=True)
+
+    reports = [
+        runner.compare_models(str(results_dir), runner.Thresholds(), bootstrap=300, use_cache=False) for _ in range(2)
+    ]
+    expect(reports[0]["statistics"] == reports[1]["statistics"], "the same resamples gave different statistics")
+    for m in reports[0]["models"]:
+        interval = m["confidence_intervals"]["task_completion"]
+        expect(interval["low"] <= m["task_completion"] <= interval["high"],
+               f"{m['name']}: task_completion {m['task_completion']} outside its interval {interval}")
+
+    pairs = reports[0]["statistics"]["pairwise"]
+    expect(len(pairs) == 1 and pairs[0]["queries"] == len(dataset), f"expected one pair over every query: {pairs}")
+    pair = pairs[0]
+    steady_first = pair["model_a"] == "check-steady"
+    diff = pair["task_completion_diff"]
+    expect(diff["significant"] and (diff["value"] > 0) == steady_first,
+           f"a model that never fails is not significantly ahead of a flaky one: {diff}")
+    expect(pair["success_win_rate"] == (1.0 if steady_first else 0.0),
+           f"success win rate {pair['success_win_rate']} for a model that never fails")
+    expect(reports[0]["winner_ties"]["task_completion"] == [], "a significant winner is listed as tied")
+
+def check_aggregate_cache(server: Any, work_dir: Path) -> None:
+    """Cached aggregates are reused while a result file is unchanged and dropped once it changes."""
+    dataset = build_dataset(30)
+    model = build_model()
+    results_dir = work_dir / "results"
+    run_models(server, [model], dataset, results_dir, concurrency=4, fresh=True)
+    path = only_result_file(results_dir)
+    drop_results(path, set(range(20, 30)))
+
+    first = runner.compare_models(str(results_dir), runner.Thresholds())
+    cache = runner.AggregateCache(results_dir)
+    try:
+        expect(cache.get(path) is not None, "compare_models did not store the file's aggregate")
+        expect(cache.get(path, collect=True) is None, "metric columns were stored before --bootstrap needed them")
+    finally:
+        cache.close()
+    again = runner.compare_models(str(results_dir), runner.Thresholds())
+    uncached = runner.compare_models(str(results_dir), runner.Thresholds(), use_cache=False)
+    expect(again["models"] == first["models"] == uncached["models"], "the cached aggregate differs from a fresh parse")
+
+    sent = run_models(server, [model], dataset, results_dir, concurrency=4)
+    expect(sent == 10, f"resume sent {sent} requests, expected the 10 missing queries")
+    cache = runner.AggregateCache(results_dir)
+    try:
+        expect(cache.get(path) is None, "an appended result file still matched its cached aggregate")
+    finally:
+        cache.close()
+    after = runner.compare_models(str(results_dir), runner.Thresholds())
+    expect(after["models"][0]["dataset_size"] == 30, "the report used the stale aggregate of 20 queries")
+
+def check_dedupe(server: Any, work_dir: Path) -> None:
+    """--dedupe calls the model once per unique query, fans results out, and resumes lost copies."""
+    dataset = [{"id": f"dup-{i}", "input": f"Repeated query {i % 8}", "tags": [f"group-{i % 3}"]} for i in range(32)]
+    model = build_model()
+    results_dir = work_dir / "results"
+    sent = run_models(server, [model], dataset, results_dir, concurrency=4, fresh=True, dedupe=1)
+    expect(sent == 8, f"de-duplicated run sent {sent} requests for 8 unique queries")
+
+    path = only_result_file(results_dir)
+    results = read_results(path)
+    expect(sorted(r["index"] for r in results) == list(range(32)), "fan-out did not fill every index exactly once")
+    copies = [r for r in results if "dedup_of" in r]
+    expect(len(copies) == 24 and all(dataset[r["index"]]["input"] == dataset[r["dedup_of"]]["input"] for r in copies),
+           "duplicates were not copied from the result of the same query")
+    scores = runner.compare_models(str(results_dir), runner.Thresholds(), use_cache=False)["models"][0]
+    expect(scores["dedup_saved_calls"] == 24, f"report counts {scores['dedup_saved_calls']} saved calls, expected 24")
+
+    # A crash lost query 0 with all its copies, and two copies of query 1 whose own result survived
+    drop_results(path, {0, 8, 16, 24, 9, 17})
+    sent = run_models(server, [model], dataset, results_dir, concurrency=4, dedupe=1)
+    expect(sent == 3, f"resume sent {sent} requests, expected 1 for query 0 and 2 for the orphaned copies")
+    expect(sorted(result_indices(path)) == list(range(32)), "resumed file does not hold every index exactly once")
+
+def check_batch(server: Any, work_dir: Path) -> None:
+    """Batch mode resumes polling a submitted batch instead of paying twice, and bills at the batch price."""
+    dataset = build_dataset(30)
+    model = build_model(priced=True)
+    root, results_dir = work_dir / "batch-service", work_dir / "results"
+    client = runner.FileBatchClient(root)
+
+    # Interrupted while the batch waits for a service that is not running yet
+    try:
+        asyncio.run(asyncio.wait_for(
+            runner.run_batch_models([model], dataset, results_dir, client, poll_seconds=0.05), timeout=0.5))
+    except asyncio.TimeoutError:
+        pass
+    else:
+        raise CheckFailed("a batch completed with no batch service running")
+
+    _, stop = batch_service.start_service(root, batch_service.mock.MockConfig(seed=1), poll_s=0.02)
+    try:
+        asyncio.run(runner.run_batch_models([model], dataset, results_dir, client, poll_seconds=0.05))
+    finally:
+        stop.set()
+    submitted = list(root.glob("*/status.json"))
+    expect(len(submitted) == 1, f"resuming submitted {len(submitted)} batches, expected to poll the first one")
+    results = read_results(only_result_file(results_dir))
+    expect(sorted(r["index"] for r in results) == list(range(30)) and all(r.get("batch") for r in results),
+           "batch results miss an index or are not marked as batch results")
+
+    batch = runner.compare_models(str(results_dir), runner.Thresholds(), use_cache=False)["models"][0]
+    expect(batch["batch_queries"] == 30 and batch["avg_latency_ms"] is None,
+           "batch results were counted as timed queries")
+    live_dir = work_dir / "interactive"
+    run_models(server, [model], dataset, live_dir, concurrency=4, fresh=True)
+    live = runner.compare_models(str(live_dir), runner.Thresholds(), use_cache=False)["models"][0]
+    ratio = batch["estimated_cost_per_1k"] / live["estimated_cost_per_1k"]
+    expect(abs(ratio - runner.BATCH_PRICE_FACTOR) < 1e-6,
+           f"batch results cost {ratio:.3f}x list price, expected {runner.BATCH_PRICE_FACTOR}x")
+
+def check_loadtest(server: Any, work_dir: Path) -> None:
+    """A load step past the deployment's capacity is flagged as saturated; lighter steps are not."""
+    steps = [
+        runner.LoadStep(target_qps=1, offered_qps=1, sent=10, achieved_qps=1, p95_latency_ms=100),
+        runner.LoadStep(target_qps=2, offered_qps=2, sent=20, achieved_qps=2, p95_latency_ms=250),
+        runner.LoadStep(target_qps=4, offered_qps=4, sent=40, achieved_qps=4, p95_latency_ms=100, error_rate=0.1),
+        runner.LoadStep(target_qps=8, offered_qps=8, sent=80, achieved_qps=5, p95_latency_ms=100),
+    ]
+    runner.mark_saturation(steps)
+    found = [[reason.split()[0] for reason in s.saturation_reasons] for s in steps]
+    expect(found == [[], ["p95"], ["error"], ["throughput"]], f"saturation reasons {found}")
+    expect(runner.sustainable_qps(steps) == 1, f"sustainable rate {runner.sustainable_qps(steps)}, expected 1")
+
+    # 4 requests in flight at 50ms each serve at most 80 req/s: 10 fits, 200 does not
+    with mock_config(server, latency_ms=50):
+        steps, _ = asyncio.run(runner.run_load_test(
+            build_model(), build_dataset(20), "You are a helpful assistant.", rates=[10, 200],
+            step_seconds=1.0, arrival="constant", max_in_flight=4, drain_seconds=5.0,
+        ))
+    light, heavy = steps
+    expect(not light.saturated, f"10 req/s flagged as saturated: {light.saturation_reasons}")
+    expect(heavy.saturated and heavy.dropped, f"200 req/s past capacity not flagged: {heavy}")
+    expect(runner.sustainable_qps(steps) == 10, f"sustainable rate {runner.sustainable_qps(steps)}, expected 10")
+
+class ScriptedJudge:
+    """Judge client scoring every item 1, except queries containing ``refuse``.
+
+    Its first reply is not JSON at all, so the batch it answers must be resent.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def chat(self, messages: list[dict]) -> Any:
+        self.calls += 1
+        if self.calls == 1:
+            return SimpleNamespace(content="I would rather not answer in JSON.")
+        items = re.findall(r"^## Item (\d+)\nQuery: (.*)$", messages[-1]["content"], re.MULTILINE)
+        verdicts = [{"id": int(n), "score": 1, "reason": "correct"} for n, query in items if "refuse" not in query]
+        return SimpleNamespace(content=json.dumps(verdicts))
+
+def check_judge(server: Any, work_dir: Path) -> None:
+    """Judge replies are parsed defensively, missed items are re-asked, and verdicts and failures are cached."""
+    rubric = runner.Rubric(metric="accuracy", path="", text="", sha256="", scale_min=0.0, scale_max=1.0)
+    reply = ('Verdicts:\n```json\n[{"id": 1, "score": 1}, {"id": 2, "score": 5}, {"id": "x", "score": 0}, '
+             '{"id": 3, "score": 0.5, "reason": "partly"}]\n```')
+    expect(sorted(runner.parse_judge_reply(reply, 3, rubric)) == [0, 2],
+           "out-of-scale or malformed verdicts were accepted, or valid ones dropped")
+    expect(runner.parse_judge_reply("no verdicts here", 3, rubric) == {}, "a reply without JSON produced verdicts")
+
+    dataset = build_dataset(20)
+    for i in (3, 13):
+        dataset[i]["input"] += " refuse"
+    results_dir = work_dir / "results"
+    run_models(server, [build_model()], dataset, results_dir, concurrency=4, fresh=True)
+    rubrics_dir = work_dir / "rubrics"
+    rubrics_dir.mkdir()
+    (rubrics_dir / "accuracy.md").write_text("Is the response correct?\n\n- `0`: Wrong\n- `1`: Correct\n",
+                                             encoding="utf-8")
+    rubrics = runner.load_rubrics(rubrics_dir)
+
+    judge = ScriptedJudge()
+    chat_client = runner.chat_client
+    runner.chat_client = lambda model: judge
+    cache = runner.ResponseCache(work_dir / "judge-cache.sqlite")
+    try:
+        summary = asyncio.run(runner.judge_result_files(results_dir, rubrics, build_model("judge"), cache))
+        calls = judge.calls
+        asyncio.run(runner.judge_result_files(results_dir, rubrics, build_model("judge"), cache))
+    finally:
+        runner.chat_client = chat_client
+        cache.close()
+    counts = summary["check-model"]["rubrics"]["accuracy"]
+    expect((counts["judged"], counts["unjudged"]) == (18, 2),
+           f"judged {counts['judged']} and left {counts['unjudged']} unjudged, expected 18 and the 2 refused")
+    expect(calls > 3, f"{calls} judge calls: the malformed reply or the refused items were not re-asked")
+    expect(judge.calls == calls, f"rejudging unchanged results made {judge.calls - calls} more judge calls")
+    scores = runner.compare_models(str(results_dir), runner.Thresholds(), use_cache=False)["models"][0]
+    expect(scores["judge_scores"] == {"accuracy": 1.0}, f"report judge scores {scores['judge_scores']}")
+
+CHECKS: dict[str, Callable[[Any, Path], None]] = {
+    "resume": check_resume,
+    "streaming-aggregation": check_streaming_aggregation,
+    "parallel-aggregation": check_parallel_aggregation,
+    "adaptive-concurrency": check_adaptive_concurrency,
+    "hedging": check_hedging,
+    "shard-merge": check_shard_merge,
+    "queue": check_queue,
+    "early-stop": check_early_stop,
+    "bootstrap": check_bootstrap,
+    "aggregate-cache": check_aggregate_cache,
+    "dedupe": check_dedupe,
+    "batch": check_batch,
+    "warehouse": check_warehouse,
+    "loadtest": check_loadtest,
+    "judge": check_judge,
+    "budget": check_budget,
+    "dataset-index": check_dataset_index,
+}
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Check run-model-comparison.py behaviour against a local mock LLM server",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--check", action="append", choices=sorted(CHECKS),
+                        help="Run only the named check (repeatable)")
+    parser.add_argument("--verbose", action="store_true", help="Show runner output")
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    names = args.check or list(CHECKS)
+
+    # Short injected latency keeps the checks fast while requests still overlap
+    server = mock.start_server(mock.MockConfig(latency_ms=5, seed=42))
+    os.environ["FOUNDRY_ENDPOINT"] = server.url
+    os.environ.setdefault("FOUNDRY_API_KEY", "mock")
+    print(f"Mock LLM server: {server.url}")
+
+    failures = []
+    try:
+        for name in names:
+            start = time.perf_counter()
+            output = None if args.verbose else io.StringIO()
+            with tempfile.TemporaryDirectory(prefix="rmc-check-") as tmp:
+                try:
+                    with contextlib.ExitStack() as quiet:
+                        if output:
+                            quiet.enter_context(contextlib.redirect_stdout(output))
+                            quiet.enter_context(contextlib.redirect_stderr(output))
+                        CHECKS[name](server, Path(tmp))
+                except CheckFailed as e:
+                    failures.append(f"{name}: {e}")
+                    print(f" FAIL {name}: {e}")
+                    continue
+            print(f" ok   {name} ({time.perf_counter() - start:.1f}s)")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if failures:
+        print(f"\n{len(failures)} of {len(names)} checks failed")
+        return 1
+    print(f"\nAll {len(names)} checks passed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
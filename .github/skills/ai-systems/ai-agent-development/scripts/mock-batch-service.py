@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""File-based stand-in for an OpenAI-style batch API.
+
+Processes the batch directories that ``run-model-comparison.py --mode batch
+--batch-dir DIR`` submits, answering every request with the same mock
+chat completions as mock-llm-server.py. Lets batch mode be exercised
+end to end without network access, quota or a 24h completion window.
+
+Usage:
+ # Watch .batches/ and complete each batch about 5 seconds after submission
+ python mock-batch-service.py --root .batches --processing-s 5
+
+ # Point the comparison runner at it
+ python run-model-comparison.py --mode batch --batch-dir .batches --batch-poll-s 1
+
+ # Process whatever is pending once and exit (CI)
+ python mock-batch-service.py --root .batches --once
+
+Layout (one directory per batch):
+ <root>/<batch_id>/input.jsonl Request lines: custom_id, method, url, body
+ <root>/<batch_id>/status.json validating -> in_progress -> completed
+ <root>/<batch_id>/output.jsonl One response or error line per request
+
+Requirements:
+ Python standard library only
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+from types import ModuleType
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+def load_script(file_name: str, module_name: str) -> ModuleType:
+    """Import a sibling script whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPTS_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+mock = load_script("mock-llm-server.py", "mock_llm_server")
+
+# ---------------------------------------------------------------------------
+# Service
+# ---------------------------------------------------------------------------
+
+def write_status(path: Path, status: dict) -> None:
+    """Replace status.json atomically so pollers never read a partial file."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(status), encoding="utf-8")
+    os.replace(tmp, path)
+
+class MockBatchService:
+    """Completes submitted batches using ``mock_llm_server.MockConfig`` behaviour.
+
+    A batch moves to ``in_progress`` when first seen and is completed once
+    ``processing_s`` has passed since submission. Requests fail with a 500
+    at ``config.error_rate``; latency settings are ignored.
+    """
+
+    def __init__(self, root: Path, config: mock.MockConfig, processing_s: float = 0.0):
+        self.root = root
+        self.config = config
+        self.processing_s = processing_s
+        self.rng = random.Random(config.seed)
+        root.mkdir(parents=True, exist_ok=True)
+
+    def process_pending(self) -> int:
+        """Advance every unfinished batch. Returns the number completed."""
+        completed = 0
+        for status_path in sorted(self.root.glob("*/status.json")):
+            try:
+                status = json.loads(status_path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                continue
+            if status["status"] == "validating":
+                status["status"] = "in_progress"
+                status["in_progress_at"] = time.time()
+                write_status(status_path, status)
+            if status["status"] == "in_progress" and time.time() - status["created_at"] >= self.processing_s:
+                self._complete(status_path.parent, status)
+                completed += 1
+        return completed
+
+    def _complete(self, batch_dir: Path, status: dict) -> None:
+        counts = {"total": 0, "completed": 0, "failed": 0}
+        with open(batch_dir / "input.jsonl", encoding="utf-8") as src, \
+                open(batch_dir / "output.jsonl", "w", encoding="utf-8") as out:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                counts["total"] += 1
+                response = self._respond(request["body"])
+                counts["completed" if response["status_code"] == 200 else "failed"] += 1
+                out.write(json.dumps({
+                    "id": f"batch_req_{counts['total']}",
+                    "custom_id": request["custom_id"],
+                    "response": response,
+                    "error": None,
+                }) + "\n")
+        status.update(status="completed", completed_at=time.time(), request_counts=counts)
+        write_status(batch_dir / "status.json", status)
+
+    def _respond(self, body: dict) -> dict:
+        if self.rng.random() < self.config.error_rate:
+            return {
+                "status_code": 500,
+                "body": {"error": {"code": "500", "message": "Internal server error (mock)"}},
+            }
+        messages = body.get("messages", [])
+        words = mock.completion_words(self.config, messages)
+        return {
+            "status_code": 200,
+            "body": {
+                "id": f"chatcmpl-mock-{int(time.time() * 1000)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock-model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": mock.usage_block(mock.count_prompt_tokens(messages), len(words)),
+            },
+        }
+
+    def serve(self, poll_s: float = 0.5, stop: threading.Event | None = None) -> None:
+        """Process batches every ``poll_s`` seconds until ``stop`` is set."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.process_pending()
+            stop.wait(poll_s)
+
+def start_service(
+    root: Path,
+    config: mock.MockConfig,
+    processing_s: float = 0.0,
+    poll_s: float = 0.1,
+) -> tuple[MockBatchService, threading.Event]:
+    """Run the service on a background thread. Set the returned event to stop it."""
+    service = MockBatchService(root, config, processing_s)
+    stop = threading.Event()
+    thread = threading.Thread(target=service.serve, args=(poll_s, stop), name="mock-batch-service", daemon=True)
+    thread.start()
+    return service, stop
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="File-based stand-in for an OpenAI-style batch API",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    defaults = mock.MockConfig()
+    parser.add_argument("--root", default=".batches", help="Batch directory shared with --batch-dir (default: .batches)")
+    parser.add_argument("--poll-s", type=float, default=0.5, help="Seconds between directory scans (default: 0.5)")
+    parser.add_argument("--processing-s", type=float, default=0.0,
+                        help="Seconds after submission before a batch completes (default: 0)")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens,
+                        help="Completion tokens per response (default: 64)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="Fraction of requests answered with a 500 error line (default: 0)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    parser.add_argument("--once", action="store_true", help="Process pending batches once and exit")
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    config = mock.MockConfig(completion_tokens=args.completion_tokens, error_rate=args.error_rate, seed=args.seed)
+    service = MockBatchService(Path(args.root), config, args.processing_s)
+    if args.once:
+        print(f"Completed {service.process_pending()} batch(es) in {args.root}")
+        return 0
+
+    print(f"Mock batch service watching {args.root}")
+    print(f" Config: {json.dumps(asdict(config))}")
+    try:
+        service.serve(args.poll_s)
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
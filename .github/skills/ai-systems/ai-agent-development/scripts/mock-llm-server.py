@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""Local OpenAI-compatible mock LLM server for offline benchmarking.
+
+Serves ``POST .../chat/completions`` (plain OpenAI, ``/v1`` and Azure
+``/openai/deployments/<name>`` paths all work) with configurable latency
+distributions, error and 429 injection, token counts and SSE streaming.
+Lets run-model-comparison.py be exercised without network access or quota.
+
+Usage:
+ # Serve on localhost:8765 with ~200ms lognormal latency
+ python mock-llm-server.py --latency-dist lognormal --latency-ms 200
+
+ # Inject 5% throttling (429 + Retry-After) and 1% server errors
+ python mock-llm-server.py --throttle-rate 0.05 --error-rate 0.01
+
+ # Point the comparison runner at it
+ FOUNDRY_ENDPOINT=http://127.0.0.1:8765 python run-model-comparison.py --concurrency 16
+
+Endpoints:
+ POST */chat/completions Chat completion (set "stream": true for SSE)
+ GET /stats Request counters and mean injected latency
+ POST /stats/reset Zero the counters
+
+Requirements:
+ Python standard library only
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock server."""
+    latency_dist: str = "fixed"
+    latency_ms: float = 100.0 # fixed value, uniform/exponential mean, lognormal median
+    latency_jitter_ms: float = 50.0 # uniform half-width
+    latency_sigma: float = 0.5 # lognormal shape
+    token_interval_ms: float = 5.0 # delay between streamed tokens
+    completion_tokens: int = 64
+    error_rate: float = 0.0 # fraction answered with HTTP 500
+    throttle_rate: float = 0.0 # fraction answered with HTTP 429
+    retry_after_s: float = 1.0
+    seed: int | None = None
+
+class MockStats:
+    """Thread-safe request counters exposed on ``GET /stats``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.completed = 0
+            self.throttled = 0
+            self.errors = 0
+            self.streamed = 0
+            self.injected_latency_ms = 0.0
+
+    def record(self, outcome: str, latency_ms: float = 0.0, streamed: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            if outcome == "ok":
+                self.completed += 1
+                self.injected_latency_ms += latency_ms
+                self.streamed += int(streamed)
+            elif outcome == "throttled":
+                self.throttled += 1
+            else:
+                self.errors += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "completed": self.completed,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "streamed": self.streamed,
+                "mean_injected_latency_ms": (
+                    round(self.injected_latency_ms / self.completed, 3) if self.completed else 0.0
+                ),
+            }
+
+# ---------------------------------------------------------------------------
+# Behaviour
+# ---------------------------------------------------------------------------
+
+def sample_latency_ms(config: MockConfig, rng: random.Random) -> float:
+    """Draw one response latency from the configured distribution."""
+    if config.latency_dist == "uniform":
+        low = max(0.0, config.latency_ms - config.latency_jitter_ms)
+        return rng.uniform(low, config.latency_ms + config.latency_jitter_ms)
+    if config.latency_dist == "lognormal":
+        return config.latency_ms * rng.lognormvariate(0.0, config.latency_sigma)
+    if config.latency_dist == "exponential":
+        return rng.expovariate(1.0 / config.latency_ms) if config.latency_ms > 0 else 0.0
+    return config.latency_ms
+
+def count_prompt_tokens(messages: list[dict]) -> int:
+    """Rough prompt token count (4 characters per token)."""
+    return max(1, sum(len(str(m.get("content", ""))) for m in messages) // 4)
+
+def completion_words(config: MockConfig, messages: list[dict]) -> list[str]:
+    """Deterministic response text, one word per completion token."""
+    query = str(messages[-1].get("content", "")) if messages else ""
+    seed_words = (query.split() or ["mock"])[:8]
+    return [seed_words[i % len(seed_words)] for i in range(max(1, config.completion_tokens))]
+
+def usage_block(prompt_tokens: int, completion_tokens: int) -> dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+# ---------------------------------------------------------------------------
+# HTTP server
+# ---------------------------------------------------------------------------
+
+class MockHandler(BaseHTTPRequestHandler):
+    """OpenAI chat-completions handler driven by ``server.config``."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without TCP_NODELAY a
+    # keep-alive client waits on a delayed ACK (~40ms) for every response
+    disable_nagle_algorithm = True
+    server: MockServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: dict, headers: dict[str, str] | None = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b"{}"
+
+        if self.path.rstrip("/").endswith("/stats/reset"):
+            self.server.stats.reset()
+            self._send_json(200, {"reset": True})
+            return
+        if "/chat/completions" not in self.path:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        try:
+            body = json.loads(raw)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+
+        config = self.server.config
+        with self.server.rng_lock:
+            roll = self.server.rng.random()
+            latency_ms = sample_latency_ms(config, self.server.rng)
+
+        if roll < config.throttle_rate:
+            self.server.stats.record("throttled")
+            self._send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit exceeded (mock)"}},
+                {"Retry-After": f"{config.retry_after_s:g}"},
+            )
+            return
+        if roll < config.throttle_rate + config.error_rate:
+            self.server.stats.record("error")
+            self._send_json(500, {"error": {"code": "500", "message": "Internal server error (mock)"}})
+            return
+
+        messages = body.get("messages", [])
+        model = body.get("model", "mock-model")
+        words = completion_words(config, messages)
+        if body.get("max_tokens"):
+            words = words[:body["max_tokens"]]
+        usage = usage_block(count_prompt_tokens(messages), len(words))
+        time.sleep(latency_ms / 1000)
+
+        if body.get("stream"):
+            self._stream(model, words, usage, bool(body.get("stream_options", {}).get("include_usage", True)))
+            # Token pacing is injected delay too, so harness overhead excludes it
+            streaming_ms = config.token_interval_ms * (len(words) - 1)
+            self.server.stats.record("ok", latency_ms + streaming_ms, streamed=True)
+            return
+
+        self.server.stats.record("ok", latency_ms)
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, model: str, words: list[str], usage: dict, include_usage: bool) -> None:
+        """Write an SSE chat-completion stream, one token per chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(chunk: dict | str) -> None:
+            data = chunk if isinstance(chunk, str) else json.dumps(chunk)
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        created = int(time.time())
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.server.config.token_interval_ms / 1000)
+            send({
+                "id": "chatcmpl-mock-stream",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}, "finish_reason": None}],
+            })
+        final: dict[str, Any] = {
+            "id": "chatcmpl-mock-stream",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        if include_usage:
+            final["usage"] = usage
+        send(final)
+        send("[DONE]")
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded HTTP server carrying the mock configuration and counters."""
+
+    daemon_threads = True
+    # Benchmarks open many keep-alive connections at once
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple[str, int], config: MockConfig, verbose: bool = False):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.verbose = verbose
+        self.stats = MockStats()
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Start the mock server on a background thread and return it.
+
+    ``port=0`` picks a free port; read it back from ``server.url``. Call
+    ``server.shutdown()`` when done.
+    """
+    server = MockServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True)
+    thread.start()
+    return server
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI-compatible mock LLM server",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    defaults = MockConfig()
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port (default: 8765)")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default=defaults.latency_dist,
+                        help="Response latency distribution (default: fixed)")
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms,
+                        help="Fixed latency, uniform/exponential mean or lognormal median (default: 100)")
+    parser.add_argument("--latency-jitter-ms", type=float, default=defaults.latency_jitter_ms,
+                        help="Half-width of the uniform distribution (default: 50)")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma,
+                        help="Shape of the lognormal distribution (default: 0.5)")
+    parser.add_argument("--token-interval-ms", type=float, default=defaults.token_interval_ms,
+                        help="Delay between streamed tokens (default: 5)")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens,
+                        help="Completion tokens per response (default: 64)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="Fraction of requests answered with HTTP 500 (default: 0)")
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate,
+                        help="Fraction of requests answered with HTTP 429 (default: 0)")
+    parser.add_argument("--retry-after-s", type=float, default=defaults.retry_after_s,
+                        help="Retry-After header on 429 responses (default: 1)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    config = MockConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_sigma=args.latency_sigma,
+        token_interval_ms=args.token_interval_ms,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after_s=args.retry_after_s,
+        seed=args.seed,
+    )
+    server = MockServer((args.host, args.port), config, verbose=args.verbose)
+    print(f"Mock LLM server listening on {server.url}")
+    print(f" Config: {json.dumps(asdict(config))}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,31 +12,109 @@ Usage:
  # Custom config + dataset
  python run-model-comparison.py --config path/to/models.yaml --dataset evaluation/core.jsonl
 
+ # Smoke-test a 1% sample, stratified by tags (.jsonl, .jsonl.gz or .jsonl.zst; row index cached in --cache-dir)
+ python run-model-comparison.py --dataset evaluation/synthetic.jsonl.zst --sample 1% --sample-method stratified
+
+ # Keep up to 8 requests in flight per model
+ python run-model-comparison.py --concurrency 8
+
+ # Open a warm keep-alive connection per worker before timing starts (cold start is reported separately)
+ python run-model-comparison.py --concurrency 8 --warmup 9
+
+ # Call the model once per unique query (or 3 times, for variance) and copy results to duplicates
+ python run-model-comparison.py --dedupe
+ python run-model-comparison.py --dedupe 3
+
+ # Results stream to <model>.jsonl; rerunning resumes, --fresh starts over
+ python run-model-comparison.py --fresh
+
+ # Share one work queue between this coordinator and extra worker processes
+ python run-model-comparison.py --queue evaluation/.queue/run.sqlite --concurrency 8
+ python run-model-comparison.py --queue evaluation/.queue/run.sqlite --queue-worker # in other shells
+
+ # Submit through the provider's batch API instead of interactive calls
+ python run-model-comparison.py --mode batch --batch-poll-s 60
+
+ # ... or through the local file-based stand-in (python mock-batch-service.py --root .batches)
+ python run-model-comparison.py --mode batch --batch-dir .batches --batch-poll-s 1
+
+ # Never spend more than $5 in one run (prices per deployment come from the config's pricing section)
+ python run-model-comparison.py --max-spend 5
+
+ # Stop a model as soon as it is 95% certain to fail the completion gates
+ python run-model-comparison.py --early-stop --early-stop-confidence 0.95
+
+ # Split across machines, then merge the shard files for comparison
+ python run-model-comparison.py --shard 1/4 --results-dir shards/1
+ python run-model-comparison.py merge shards/*/ --output-dir evaluation/results/
+
+ # Map each deployment's saturation curve with open-loop Poisson arrivals at rising rates
+ python run-model-comparison.py loadtest --rates 1,2,4,8,16 --step-s 30 --arrival poisson
+
  # Compare from pre-existing result files (skip eval, just compare)
  python run-model-comparison.py --results-dir evaluation/results/
 
+ # Score responses with an LLM judge against the gated rubrics in evaluation/rubrics/; verdicts are cached in --cache-dir
+ python run-model-comparison.py --results-dir evaluation/results/ --judge --judge-model gpt-4.1
+
+ # Also judge report-only rubrics (or --judge-rubric all)
+ python run-model-comparison.py --results-dir evaluation/results/ --judge --judge-rubric correctness
+
+ # Bootstrap confidence intervals and paired per-query comparisons
+ python run-model-comparison.py --results-dir evaluation/results/ --bootstrap 1000
+
+ # Time each phase (wall, CPU, peak memory) and trace every model and query to a span file
+ python run-model-comparison.py --profile --otel file --otel-file evaluation/otel-spans.jsonl
+
  # Gate check only (exit 1 if any model fails thresholds)
  python run-model-comparison.py --results-dir evaluation/results/ --check-gates
 
  # Fail CI if primary model regressed from baseline
  python run-model-comparison.py --results-dir evaluation/results/ --check-gates --fail-on-regression
 
+ # Record every report in a local history and gate on the median of the last 10 runs
+ python run-model-comparison.py --results-dir evaluation/results/ --warehouse evaluation/history.sqlite \
+ --fail-on-regression --rolling-baseline 10
+ python run-model-comparison.py history --warehouse evaluation/history.sqlite --model gpt-4.1
+
 Requirements:
  pip install pyyaml
  pip install agent-framework-azure-ai # only needed for --run mode
+ pip install numpy # only needed for --bootstrap
+ pip install openai # only needed for --mode batch without --batch-dir (ships with agent-framework)
+ pip install opentelemetry-sdk # only needed for --otel
+ pip install zstandard # only needed for .zst datasets before Python 3.14
+ pip install h2 # optional: HTTP/2 for the pooled model clients
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import itertools
 import json
+import math
 import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
 import sys
 import time
+import uuid
+import warnings
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from statistics import NormalDist
+from typing import Any, Callable, Iterator, Sequence
 
 # ---------------------------------------------------------------------------
 # Data classes
@@ -44,547 +122,5002 @@ from typing import Any
 
 @dataclass
 class ModelSpec:
- """One model in the comparison matrix."""
- name: str
- deployment: str
- role: str # primary | challenger | fallback | budget | reasoning
- provider: str = "azure"
+    """One model in the comparison matrix."""
+    name: str
+    deployment: str
+    role: str # primary | challenger | fallback | budget | reasoning
+    provider: str = "azure"
+    requests_per_minute: float | None = None # None = unlimited
+    tokens_per_minute: float | None = None # None = unlimited
+    input_cost_per_1m: float | None = None # USD per 1M prompt tokens; None = unpriced
+    output_cost_per_1m: float | None = None # USD per 1M completion tokens
 
 @dataclass
 class Thresholds:
- """Minimum pass criteria."""
- task_completion: float = 0.85
- coherence: float = 3.5
- relevance: float = 3.5
- format_compliance: float = 0.95
- tool_accuracy: float = 0.90
- max_latency_ms: float = 5000
- max_cost_per_1k: float = 15.0
- max_regression_pct: float = 10.0
+    """Minimum pass criteria."""
+    task_completion: float = 0.85
+    coherence: float = 3.5
+    relevance: float = 3.5
+    format_compliance: float = 0.95
+    tool_accuracy: float = 0.90
+    max_latency_ms: float = 5000
+    max_cost_per_1k: float = 15.0
+    max_regression_pct: float = 10.0
+    # Optional tail-latency gates (None = not checked)
+    max_p50_latency_ms: float | None = None
+    max_p95_latency_ms: float | None = None
+    max_p99_latency_ms: float | None = None
+    # Optional streaming gates, checked only for --stream runs
+    max_p95_ttft_ms: float | None = None
+    min_output_tokens_per_sec: float | None = None
 
 @dataclass
 class ModelResult:
- """Aggregated scores for one model."""
- name: str
- role: str
- dataset_size: int = 0
- task_completion: float = 0.0
- coherence: float = 0.0
- relevance: float = 0.0
- format_compliance: float = 0.0
- tool_accuracy: float = 0.0
- avg_latency_ms: float = 0.0
- avg_tokens: float = 0.0
- estimated_cost_per_1k: float = 0.0
- passed: bool = True
- failures: list[str] = field(default_factory=list)
+    """Aggregated scores for one model."""
+    name: str
+    role: str
+    dataset_size: int = 0
+    task_completion: float = 0.0
+    coherence: float = 0.0
+    relevance: float = 0.0
+    format_compliance: float = 0.0
+    tool_accuracy: float = 0.0
+    # Latency fields are None when no result was timed (all cached, de-duplicated or batch)
+    avg_latency_ms: float | None = 0.0
+    p50_latency_ms: float | None = 0.0
+    p90_latency_ms: float | None = 0.0
+    p95_latency_ms: float | None = 0.0
+    p99_latency_ms: float | None = 0.0
+    max_latency_ms: float | None = 0.0
+    latency_histogram: list[dict] = field(default_factory=list)
+    # Streaming metrics (0 when the run did not use --stream)
+    streamed_queries: int = 0
+    avg_ttft_ms: float = 0.0
+    p50_ttft_ms: float = 0.0
+    p95_ttft_ms: float = 0.0
+    avg_inter_token_ms: float = 0.0
+    avg_output_tokens_per_sec: float = 0.0
+    # Request hedging (0 when the run did not use --hedge)
+    hedged_queries: int = 0
+    hedge_rate: float = 0.0
+    hedge_wins: int = 0
+    avg_latency_saved_ms: float = 0.0
+    # Sequential early stopping verdict (None when the model ran to completion)
+    early_stop: dict | None = None
+    # Bootstrap intervals per metric, {"low", "high"} (empty unless --bootstrap)
+    confidence_intervals: dict = field(default_factory=dict)
+    avg_tokens: float = 0.0
+    # USD per 1k queries at list price; cache hits and duplicates count as the call they reuse
+    estimated_cost_per_1k: float = 0.0
+    # Priced results (models with a price table entry) and the USD actually spent on model calls
+    priced_queries: int = 0
+    total_cost_usd: float = 0.0
+    # Set when --max-spend stopped the model before it finished
+    budget_stop: dict | None = None
+    cache_hits: int = 0
+    # Duplicate queries answered from another index's result (--dedupe)
+    dedup_saved_calls: int = 0
+    # Results answered through the batch API, which has no per-query latency (--mode batch)
+    batch_queries: int = 0
+    # Warm-up requests sent before timing started (--warmup); excluded from every other metric
+    warmup_requests: int = 0
+    cold_start_latency_ms: float = 0.0 # first request, on a new connection
+    avg_warmup_latency_ms: float = 0.0
+    # Mean LLM-judge score per rubric metric (empty unless judged with --judge)
+    judge_scores: dict = field(default_factory=dict)
+    passed: bool = True
+    failures: list[str] = field(default_factory=list)
+
+@dataclass
+class Rubric:
+    """One LLM-as-judge rubric from evaluation/rubrics/<metric>.md."""
+    metric: str # file stem, hyphens -> underscores
+    path: str
+    text: str
+    sha256: str
+    scale_min: float = 0.0
+    scale_max: float = 1.0
+
+@dataclass
+class LoadStep:
+    """Open-loop load test measurements at one target arrival rate."""
+    target_qps: float
+    offered_qps: float = 0.0 # requests actually scheduled / step length
+    sent: int = 0
+    dropped: int = 0 # not sent because --max-in-flight requests were outstanding
+    errors: int = 0 # failed or still unanswered after the drain period
+    error_rate: float = 0.0
+    achieved_qps: float = 0.0 # successful responses completed inside the step window
+    # Latency from the scheduled send time, so client-side queueing is included
+    p50_latency_ms: float = 0.0
+    p90_latency_ms: float = 0.0
+    p95_latency_ms: float = 0.0
+    p99_latency_ms: float = 0.0
+    max_latency_ms: float = 0.0
+    mean_send_lag_ms: float = 0.0
+    saturated: bool = False
+    saturation_reasons: list[str] = field(default_factory=list)
 
 # ---------------------------------------------------------------------------
 # Config loading
 # ---------------------------------------------------------------------------
 
 def load_config(path: str) -> dict[str, Any]:
- """Load models.yaml configuration."""
- try:
- import yaml
- except ImportError:
- print("ERROR: PyYAML required. Install: pip install pyyaml", file=sys.stderr)
- sys.exit(1)
-
- config_path = Path(path)
- if not config_path.exists():
- print(f"ERROR: Config not found: {path}", file=sys.stderr)
- print("Create config/models.yaml with model matrix. See model-change-test-automation.md", file=sys.stderr)
- sys.exit(1)
-
- with open(config_path) as f:
- return yaml.safe_load(f)
+    """Load models.yaml configuration."""
+    try:
+        import yaml
+    except ImportError:
+        print("ERROR: PyYAML required. Install: pip install pyyaml", file=sys.stderr)
+        sys.exit(1)
+
+    config_path = Path(path)
+    if not config_path.exists():
+        print(f"ERROR: Config not found: {path}", file=sys.stderr)
+        print("Create config/models.yaml with model matrix. See model-change-test-automation.md", file=sys.stderr)
+        sys.exit(1)
+
+    with open(config_path) as f:
+        return yaml.safe_load(f)
 
 def load_thresholds(config: dict) -> Thresholds:
- """Extract thresholds from config, with sensible defaults."""
- raw = config.get("thresholds", {})
- return Thresholds(**{k: v for k, v in raw.items() if hasattr(Thresholds, k)})
+    """Extract thresholds from config, with sensible defaults."""
+    raw = config.get("thresholds", {})
+    return Thresholds(**{k: v for k, v in raw.items() if hasattr(Thresholds, k)})
 
 def load_models(config: dict) -> list[ModelSpec]:
- """Extract model specs from config."""
- models = []
- for role, spec in config.get("models", {}).items():
- models.append(ModelSpec(
- name=spec["name"],
- deployment=spec.get("deployment", spec["name"]),
- role=role,
- provider=spec.get("provider", "azure"),
- ))
- return models
+    """Extract model specs from config.
+
+    Rate limits are resolved from the model entry first, then from the
+    top-level ``rate_limits`` section keyed by deployment, then by provider.
+    Prices (``input_cost_per_1m``/``output_cost_per_1m``) resolve the same
+    way from the ``pricing`` section.
+    """
+    rate_limits = config.get("rate_limits", {}) or {}
+    pricing = config.get("pricing", {}) or {}
+    models = []
+    for role, spec in config.get("models", {}).items():
+        deployment = spec.get("deployment", spec["name"])
+        provider = spec.get("provider", "azure")
+        limits = {
+            **rate_limits.get(provider, {}),
+            **rate_limits.get(deployment, {}),
+            **{k: v for k, v in spec.items() if k in ("requests_per_minute", "tokens_per_minute")},
+        }
+        prices = {
+            **pricing.get(provider, {}),
+            **pricing.get(deployment, {}),
+            **{k: v for k, v in spec.items() if k in PRICE_KEYS},
+        }
+        models.append(ModelSpec(
+            name=spec["name"],
+            deployment=deployment,
+            role=role,
+            provider=provider,
+            requests_per_minute=limits.get("requests_per_minute"),
+            tokens_per_minute=limits.get("tokens_per_minute"),
+            input_cost_per_1m=prices.get("input_cost_per_1m"),
+            output_cost_per_1m=prices.get("output_cost_per_1m"),
+        ))
+    return models
 
 # ---------------------------------------------------------------------------
 # Dataset
 # ---------------------------------------------------------------------------
 
-def load_dataset(path: str) -> list[dict]:
- """Load JSONL evaluation dataset."""
- dataset_path = Path(path)
- if not dataset_path.exists():
- print(f"ERROR: Dataset not found: {path}", file=sys.stderr)
- sys.exit(1)
+def item_query(item: dict) -> str:
+    """Query text of a dataset item (``query`` or ``input`` field)."""
+    return item.get("query", item.get("input", ""))
+
+SAMPLE_METHODS = ("random", "stratified", "first")
+DATASET_INDEX_VERSION = 3
+
+def dataset_fingerprint(dataset: Sequence[dict]) -> str:
+    """Content hash of the rows a run evaluates, in order (``JsonlDataset`` keeps its own)."""
+    if isinstance(dataset, JsonlDataset):
+        return dataset.fingerprint
+    digest = hashlib.sha256()
+    for item in dataset:
+        digest.update(json.dumps(item, sort_keys=True, ensure_ascii=False).encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+def pack_columns(columns: dict[str, array]) -> bytes:
+    """Serialize named typed arrays as a JSON layout line followed by their raw bytes."""
+    layout = [[name, col.typecode, len(col)] for name, col in columns.items()]
+    return json.dumps(layout).encode("utf-8") + b"\n" + b"".join(col.tobytes() for col in columns.values())
+
+def unpack_columns(blob: bytes) -> dict[str, array]:
+    header, _, body = blob.partition(b"\n")
+    columns, offset = {}, 0
+    for name, typecode, length in json.loads(header):
+        col = array(typecode)
+        end = offset + length * col.itemsize
+        col.frombytes(body[offset:end])
+        columns[name], offset = col, end
+    return columns
+
+def tag_key(tags: Any) -> tuple[str, ...]:
+    """Stratum of a dataset item: its sorted ``tags``."""
+    return tuple(sorted(map(str, tags or [])))
+
+class JsonlDataset:
+    """Read-only sequence of JSONL rows, parsed on access from a memory map.
+
+    Built by ``load_dataset`` from a line-offset index that also records each
+    row's tag stratum, so ``len``, sharding and sampling never parse a row.
+    Only rows that parsed as JSON objects when the index was built are listed.
+    ``fingerprint`` identifies the file's content and the rows selected from
+    it, so result files and work queues can tell a different dataset or
+    sample apart from the one they were built for.
+    """
+
+    def __init__(
+        self,
+        data: Any,
+        starts: array,
+        lengths: array,
+        strata: array,
+        keys: list[tuple[str, ...]],
+        groups: tuple[array, array] | None = None,
+        fingerprint: str = "",
+    ):
+        self._data = data
+        self._starts = starts
+        self._lengths = lengths
+        self._strata = strata
+        self.keys = keys # stratum id -> tag key
+        self._groups = groups # (rows ordered by stratum, rows per stratum), from the index
+        self.fingerprint = fingerprint
 
- items = []
- with open(dataset_path, encoding="utf-8") as f:
- for lineno, line in enumerate(f, 1):
- line = line.strip()
- if not line:
- continue
- try:
- items.append(json.loads(line))
- except json.JSONDecodeError as e:
- print(f"WARNING: Invalid JSON on line {lineno}: {e}", file=sys.stderr)
- return items
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self)
+        start = self._starts[i]
+        return json.loads(self._data[start:start + self._lengths[i]])
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self[i] for i in range(len(self)))
+
+    def tag_keys(self) -> Iterator[tuple[str, ...]]:
+        """Tag key of every row, in order, without parsing rows."""
+        return (self.keys[s] for s in self._strata)
+
+    def select(self, rows: list[int]) -> JsonlDataset:
+        """View over ``rows`` (positions in this dataset), in the given order."""
+        selection = hashlib.sha256(self.fingerprint.encode("ascii") + array("q", rows).tobytes())
+        return JsonlDataset(
+            self._data,
+            array("q", (self._starts[r] for r in rows)),
+            array("I", (self._lengths[r] for r in rows)),
+            array("I", (self._strata[r] for r in rows)),
+            self.keys,
+            fingerprint=selection.hexdigest(),
+        )
+
+    def sample(self, size: int, method: str = "random", seed: int = 0) -> JsonlDataset:
+        """Pick ``size`` rows, kept in file order.
+
+        ``first`` takes the leading rows, ``random`` a uniform sample and
+        ``stratified`` a proportional share of every tag stratum (largest
+        remainder, and at least one row per stratum while ``size`` allows).
+        On a dataset fresh from ``load_dataset`` the cost grows with
+        ``size``, not with the dataset.
+        """
+        size = min(size, len(self))
+        if method == "first":
+            return self.select(list(range(size)))
+        rng = random.Random(seed)
+        if method == "random":
+            return self.select(sorted(rng.sample(range(len(self)), size)))
+
+        by_stratum, counts = self._groups or group_strata(self._strata, len(self.keys))
+        present = [s for s, count in enumerate(counts) if count]
+        quota = {s: size * counts[s] / len(self) for s in present}
+        shares = {s: int(quota[s]) for s in present}
+        if size >= len(present):
+            shares = {s: max(1, share) for s, share in shares.items()}
+        # Top up by largest remainder, then trim what the one-per-stratum floor overshot
+        while sum(shares.values()) < size:
+            open_strata = [s for s in present if shares[s] < counts[s]]
+            shares[max(open_strata, key=lambda s: quota[s] - shares[s])] += 1
+        while sum(shares.values()) > size:
+            shares[max(present, key=lambda s: shares[s])] -= 1
+
+        rows, offset = [], 0
+        for s, count in enumerate(counts):
+            rows += [by_stratum[offset + k] for k in rng.sample(range(count), shares.get(s, 0))]
+            offset += count
+        return self.select(sorted(rows))
+
+def group_strata(strata: array, stratum_count: int) -> tuple[array, array]:
+    """Row positions ordered by stratum id, and the number of rows in each stratum."""
+    counts = array("q", [0] * stratum_count)
+    for s in strata:
+        counts[s] += 1
+    return array("q", sorted(range(len(strata)), key=strata.__getitem__)), counts
+
+def parse_sample(spec: str, total: int) -> int:
+    """Rows requested by a ``--sample`` spec: a count (``500``) or a percentage (``1%``)."""
+    try:
+        if spec.endswith("%"):
+            size = math.ceil(total * float(spec[:-1]) / 100)
+        else:
+            size = int(spec)
+    except ValueError:
+        raise ValueError(f"Invalid sample {spec!r}; expected a row count or a percentage like 1%") from None
+    if size < 1:
+        raise ValueError(f"Invalid sample {spec!r}; must select at least one row")
+    return size
+
+def open_decompressed(path: Path) -> Any:
+    """Binary reader for a ``.gz``/``.zst`` dataset (zstd needs Python 3.14+ or the zstandard package)."""
+    if path.suffix == ".gz":
+        import gzip
+        return gzip.open(path, "rb")
+    try:
+        from compression import zstd # Python 3.14+
+        return zstd.open(path, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        print("ERROR: zstandard required for .zst datasets. Install: pip install zstandard", file=sys.stderr)
+        sys.exit(1)
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+def build_dataset_index(data: Any) -> tuple[dict[str, array], list[tuple[str, ...]], list[int]]:
+    """Scan a mapped JSONL file once for row offsets and tag strata.
+
+    Every line is parsed once here so that only JSON objects are indexed;
+    blank lines are ignored and the 1-based numbers of any other skipped
+    lines are returned. The stratum is the row's top-level ``tags``.
+    """
+    starts, lengths, strata = array("q"), array("I"), array("I")
+    key_ids: dict[tuple[str, ...], int] = {}
+    skipped: list[int] = []
+    position, size, lineno = 0, len(data), 0
+    while position < size:
+        end = data.find(b"\n", position)
+        if end < 0:
+            end = size
+        lineno += 1
+        line = data[position:end]
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                row = None
+            if isinstance(row, dict):
+                starts.append(position)
+                lengths.append(end - position)
+                strata.append(key_ids.setdefault(tag_key(row.get("tags")), len(key_ids)))
+            else:
+                skipped.append(lineno)
+        position = end + 1
+    keys = sorted(key_ids, key=key_ids.get) or [()]
+    by_stratum, counts = group_strata(strata, len(keys))
+    columns = {"start": starts, "length": lengths, "stratum": strata, "by_stratum": by_stratum, "counts": counts}
+    return columns, keys, skipped
+
+def load_dataset(
+    path: str,
+    index_dir: Path | None = None,
+    sample: str | None = None,
+    sample_method: str = "random",
+    seed: int = 0,
+) -> JsonlDataset:
+    """Open a JSONL evaluation dataset (optionally ``.gz`` or ``.zst``) for lazy reading.
+
+    The file is memory-mapped and rows are parsed only when accessed. With
+    ``index_dir``, the line-offset index is cached there keyed by the file's
+    size and mtime, so later runs start without scanning; compressed files
+    are decompressed into it once and mapped from there. ``sample`` (a row
+    count or ``N%``) narrows the dataset with ``JsonlDataset.sample``.
+    """
+    import mmap
+
+    dataset_path = Path(path)
+    if not dataset_path.exists():
+        print(f"ERROR: Dataset not found: {path}", file=sys.stderr)
+        sys.exit(1)
+
+    stat = dataset_path.stat()
+    fingerprint = {"version": DATASET_INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    stem = hashlib.sha256(str(dataset_path.resolve()).encode("utf-8")).hexdigest()[:16]
+    index_path = index_dir / f"{stem}.index" if index_dir else None
+    source = dataset_path
+    if dataset_path.suffix in (".gz", ".zst", ".zstd"):
+        if index_dir is None:
+            import tempfile
+            index_dir = Path(tempfile.gettempdir()) / "rmc-datasets"
+        index_dir.mkdir(parents=True, exist_ok=True)
+        source = index_dir / f"{stem}.jsonl"
+
+    columns = keys = skipped = content_sha256 = None
+    if index_path and index_path.exists():
+        meta_line, _, blob = index_path.read_bytes().partition(b"\n")
+        meta = json.loads(meta_line)
+        if meta.get("fingerprint") == fingerprint and source.exists():
+            columns, keys = unpack_columns(blob), [tuple(k) for k in meta["keys"]]
+            skipped = (meta["skipped"], meta["skipped_lines"])
+            content_sha256 = meta["sha256"]
+
+    if columns is None and source != dataset_path:
+        tmp = source.with_name(f".{source.name}.{os.getpid()}.tmp")
+        with open_decompressed(dataset_path) as src, open(tmp, "wb") as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+        os.replace(tmp, source)
+
+    with open(source, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if source.stat().st_size else b""
+    if columns is None:
+        columns, keys, lines = build_dataset_index(data)
+        skipped = (len(lines), lines[:5])
+        content_sha256 = hashlib.sha256(data).hexdigest()
+        if index_path:
+            index_dir.mkdir(parents=True, exist_ok=True)
+            meta = json.dumps({
+                "fingerprint": fingerprint, "source": str(dataset_path), "keys": keys,
+                "skipped": skipped[0], "skipped_lines": skipped[1], "sha256": content_sha256,
+            })
+            tmp = index_path.with_name(f".{index_path.name}.{os.getpid()}.tmp")
+            tmp.write_bytes(meta.encode("utf-8") + b"\n" + pack_columns(columns))
+            os.replace(tmp, index_path)
+
+    if skipped[0]:
+        shown = ", ".join(map(str, skipped[1])) + (", ..." if skipped[0] > len(skipped[1]) else "")
+        print(f"WARNING: Skipped {skipped[0]} dataset line(s) that are not valid JSON objects "
+              f"(line {shown})", file=sys.stderr)
+
+    dataset = JsonlDataset(
+        data, columns["start"], columns["length"], columns["stratum"], keys,
+        groups=(columns["by_stratum"], columns["counts"]), fingerprint=content_sha256,
+    )
+    if sample:
+        dataset = dataset.sample(parse_sample(sample, len(dataset)), sample_method, seed)
+        print(f" Sampled {len(dataset)} of {len(columns['start'])} rows ({sample_method}, seed {seed})")
+    return dataset
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """Parse a 1-based ``i/N`` shard spec into ``(i, N)``."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}; expected i/N, e.g. 1/4") from None
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {spec!r}; need 1 <= i <= N")
+    return index, count
+
+def shard_indices(dataset: Sequence[dict], shard_index: int, shard_count: int) -> list[int]:
+    """Dataset indices belonging to 1-based shard ``shard_index`` of ``shard_count``.
+
+    Items are grouped by their ``tags`` and dealt round-robin across shards,
+    stratum by stratum, with one counter carried across strata. Every tag
+    combination is therefore split evenly (within one item) and shard sizes
+    differ by at most one. The split depends only on the dataset contents,
+    so every machine computes the same assignment.
+    """
+    strata: dict[tuple[str, ...], list[int]] = {}
+    keys = dataset.tag_keys() if isinstance(dataset, JsonlDataset) else (tag_key(item.get("tags")) for item in dataset)
+    for i, key in enumerate(keys):
+        strata.setdefault(key, []).append(i)
+
+    selected = []
+    position = 0
+    for key in sorted(strata):
+        for i in strata[key]:
+            if position % shard_count == shard_index - 1:
+                selected.append(i)
+            position += 1
+    return sorted(selected)
+
+def dedupe_plan(dataset: Sequence[dict], indices: list[int], repeats: int = 1) -> dict[int, list[int]]:
+    """Group identical queries among ``indices`` for de-duplicated evaluation.
+
+    Returns ``{evaluated index: [duplicate indices]}``. The first ``repeats``
+    occurrences of each query are evaluated and every later occurrence is
+    assigned round-robin to one of them, so each unique query costs at most
+    ``repeats`` calls. The plan depends only on the dataset, so separate
+    worker processes compute the same one.
+    """
+    groups: dict[str, list[int]] = {}
+    for i in indices:
+        groups.setdefault(item_query(dataset[i]), []).append(i)
+
+    plan: dict[int, list[int]] = {}
+    for members in groups.values():
+        evaluated = members[:repeats]
+        for i in evaluated:
+            plan[i] = []
+        for position, duplicate in enumerate(members[repeats:]):
+            plan[evaluated[position % len(evaluated)]].append(duplicate)
+    return plan
 
 # ---------------------------------------------------------------------------
-# Evaluation runner (requires agent-framework)
+# Rate limiting
 # ---------------------------------------------------------------------------
 
-async def run_single_model(
- model: ModelSpec,
- dataset: list[dict],
- system_prompt: str,
-) -> list[dict]:
- """Run dataset through a single model. Returns per-query results."""
- try:
- from agent_framework.openai import OpenAIChatClient
- except ImportError:
- print("ERROR: agent-framework not installed. Use --results-dir to compare pre-existing results.", file=sys.stderr)
- sys.exit(1)
-
- client = OpenAIChatClient(
- model=model.deployment,
- api_key=os.getenv("FOUNDRY_API_KEY", ""),
- endpoint=os.getenv("FOUNDRY_ENDPOINT", ""),
- )
-
- results = []
- for i, item in enumerate(dataset):
- query = item.get("query", item.get("input", ""))
- start = time.perf_counter()
-
- try:
- response = await client.chat(
- messages=[
- {"role": "system", "content": system_prompt},
- {"role": "user", "content": query},
- ],
- )
- elapsed_ms = (time.perf_counter() - start) * 1000
- content = response.content if hasattr(response, "content") else str(response)
- tokens = getattr(response, "usage", {}).get("total_tokens", 0) if hasattr(response, "usage") else 0
-
- results.append({
- "index": i,
- "query": query,
- "response": content,
- "expected": item.get("expected_response", item.get("response", "")),
- "latency_ms": round(elapsed_ms),
- "tokens_used": tokens,
- "error": None,
- })
- except Exception as e:
- elapsed_ms = (time.perf_counter() - start) * 1000
- results.append({
- "index": i,
- "query": query,
- "response": "",
- "expected": item.get("expected_response", ""),
- "latency_ms": round(elapsed_ms),
- "tokens_used": 0,
- "error": str(e),
- })
-
- # Progress
- if (i + 1) % 10 == 0 or i == len(dataset) - 1:
- print(f" [{model.name}] {i + 1}/{len(dataset)} queries complete")
-
- return results
+DEFAULT_COMPLETION_TOKENS = 256 # token estimate before any usage is observed
 
-async def run_all_models(
- models: list[ModelSpec],
- dataset: list[dict],
- output_dir: Path,
- system_prompt: str = "You are a helpful assistant.",
-) -> None:
- """Run evaluation for all models and save results."""
- output_dir.mkdir(parents=True, exist_ok=True)
-
- for model in models:
- print(f"\n{'='*60}")
- print(f" Evaluating: {model.name} ({model.role})")
- print(f"{'='*60}")
-
- results = await run_single_model(model, dataset, system_prompt)
-
- # Save results
- safe_name = model.name.replace("/", "-").replace(" ", "-")
- output_file = output_dir / f"{safe_name}.json"
- with open(output_file, "w", encoding="utf-8") as f:
- json.dump({
- "model": model.name,
- "role": model.role,
- "provider": model.provider,
- "timestamp": datetime.now(timezone.utc).isoformat(),
- "dataset_size": len(dataset),
- "results": results,
- }, f, indent=2)
- print(f" Saved: {output_file}")
+class TokenBucket:
+    """Async token bucket refilled continuously at ``rate_per_minute``.
+
+    Holds at most ``burst_seconds`` worth of capacity. A request larger than
+    the capacity is admitted once the bucket is full and leaves it in debt,
+    so oversized requests are delayed rather than rejected.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10.0):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """Wait until ``amount`` can be taken from the bucket, then take it."""
+        async with self._lock:
+            needed = min(amount, self.capacity)
+            self._refill()
+            while self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """Take ``amount`` only if it is available now and nobody is waiting."""
+        if self._lock.locked():
+            return False
+        self._refill()
+        if self.tokens < min(amount, self.capacity):
+            return False
+        self.tokens -= amount
+        return True
+
+    def adjust(self, amount: float) -> None:
+        """Return (positive) or charge (negative) tokens after the fact."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """Requests/min and tokens/min limits for one provider deployment.
+
+    Token cost is unknown until the response arrives, so each request
+    reserves an estimate up front and the difference is settled afterwards.
+    """
+
+    def __init__(self, requests_per_minute: float | None, tokens_per_minute: float | None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._observed_tokens = 0
+        self._observed_requests = 0
+
+    def estimate_tokens(self, prompt: str) -> int:
+        """Estimate total tokens for a request from observed usage."""
+        if self._observed_requests:
+            return max(1, round(self._observed_tokens / self._observed_requests))
+        return len(prompt) // 4 + DEFAULT_COMPLETION_TOKENS
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens:
+            await self.tokens.acquire(estimated_tokens)
+
+    def try_acquire(self, estimated_tokens: int) -> bool:
+        """Like ``acquire``, but give up instead of waiting for capacity."""
+        if self.requests and not self.requests.try_acquire(1):
+            return False
+        if self.tokens and not self.tokens.try_acquire(estimated_tokens):
+            if self.requests:
+                self.requests.adjust(1)
+            return False
+        return True
+
+    def refund(self, estimated_tokens: int) -> None:
+        """Return a reservation that was never sent."""
+        if self.requests:
+            self.requests.adjust(1)
+        if self.tokens:
+            self.tokens.adjust(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Reconcile the up-front reservation with actual usage."""
+        if actual_tokens > 0:
+            self._observed_tokens += actual_tokens
+            self._observed_requests += 1
+            if self.tokens:
+                self.tokens.adjust(estimated_tokens - actual_tokens)
+
+def build_rate_limiters(models: list[ModelSpec]) -> dict[tuple[str, str], RateLimiter]:
+    """Create one limiter per (provider, deployment) with configured limits.
+
+    Models that share a deployment share its limiter, since they draw on the
+    same quota.
+    """
+    limiters: dict[tuple[str, str], RateLimiter] = {}
+    for model in models:
+        key = (model.provider, model.deployment)
+        if key in limiters or not (model.requests_per_minute or model.tokens_per_minute):
+            continue
+        limiters[key] = RateLimiter(model.requests_per_minute, model.tokens_per_minute)
+    return limiters
 
 # ---------------------------------------------------------------------------
-# Comparison engine
+# Cost budget
 # ---------------------------------------------------------------------------
 
-def aggregate_scores(data: dict) -> ModelResult:
- """Calculate aggregate metrics from raw per-query results."""
- results = data.get("results", [])
- n = len(results)
- if n == 0:
- return ModelResult(name=data["model"], role=data.get("role", "unknown"))
-
- errors = [r for r in results if r.get("error")]
- successful = [r for r in results if not r.get("error")]
- s = len(successful) if successful else 1 # avoid division by zero
-
- return ModelResult(
- name=data["model"],
- role=data.get("role", "unknown"),
- dataset_size=n,
- # Task completion = % of queries that got a non-empty, non-error response
- task_completion=round(len(successful) / n, 3),
- # Format compliance = % of responses that are valid (non-empty)
- format_compliance=round(
- sum(1 for r in successful if len(r.get("response", "").strip()) > 10) / s, 3
- ),
- avg_latency_ms=round(sum(r["latency_ms"] for r in results) / n, 1),
- avg_tokens=round(sum(r.get("tokens_used", 0) for r in successful) / s, 1),
- )
+PRICE_KEYS = ("input_cost_per_1m", "output_cost_per_1m")
+BATCH_PRICE_FACTOR = 0.5 # batch APIs bill at half the interactive list price
 
-def compare_models(
- results_dir: str,
- thresholds: Thresholds,
-) -> dict[str, Any]:
- """Load all result files and generate comparison report."""
- results_path = Path(results_dir)
- if not results_path.exists():
- print(f"ERROR: Results directory not found: {results_dir}", file=sys.stderr)
- sys.exit(1)
-
- result_files = list(results_path.glob("*.json"))
- if not result_files:
- print(f"ERROR: No .json result files in {results_dir}", file=sys.stderr)
- sys.exit(1)
-
- models: list[ModelResult] = []
- alerts: list[str] = []
-
- for result_file in sorted(result_files):
- with open(result_file, encoding="utf-8") as f:
- data = json.load(f)
- scores = aggregate_scores(data)
-
- # Check thresholds
- checks = [
- ("task_completion", scores.task_completion, thresholds.task_completion, "min"),
- ("format_compliance", scores.format_compliance, thresholds.format_compliance, "min"),
- ("avg_latency_ms", scores.avg_latency_ms, thresholds.max_latency_ms, "max"),
- ]
-
- for metric, value, threshold, direction in checks:
- if direction == "min" and value < threshold:
- msg = f"{scores.name}: {metric} = {value:.3f} below threshold {threshold}"
- alerts.append(msg)
- scores.failures.append(msg)
- scores.passed = False
- elif direction == "max" and value > threshold:
- msg = f"{scores.name}: {metric} = {value:.1f} exceeds threshold {threshold}"
- alerts.append(msg)
- scores.failures.append(msg)
- scores.passed = False
-
- models.append(scores)
-
- # Determine winners
- winners = {}
- if models:
- viable = [m for m in models if m.passed] or models
- winners["task_completion"] = max(viable, key=lambda m: m.task_completion).name
- winners["format_compliance"] = max(viable, key=lambda m: m.format_compliance).name
- winners["latency"] = min(viable, key=lambda m: m.avg_latency_ms).name
- winners["token_efficiency"] = min(viable, key=lambda m: m.avg_tokens or float("inf")).name
-
- report = {
- "report_id": f"compare-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}",
- "timestamp": datetime.now(timezone.utc).isoformat(),
- "models_tested": len(models),
- "models": [asdict(m) for m in models],
- "winner_by_metric": winners,
- "alerts": alerts,
- "all_passed": all(m.passed for m in models),
- }
-
- return report
+def query_cost(model: ModelSpec, result: dict) -> float | None:
+    """USD cost of one result at ``model``'s prices, or None when it is unpriced.
+
+    Without a prompt/completion split in the usage data, every token is
+    billed at the higher of the two prices so budgets err on the safe side.
+    """
+    if model.input_cost_per_1m is None and model.output_cost_per_1m is None:
+        return None
+    input_price = model.input_cost_per_1m or 0.0
+    output_price = model.output_cost_per_1m or 0.0
+    prompt, completion = result.get("prompt_tokens"), result.get("completion_tokens")
+    if prompt is None or completion is None:
+        return result.get("tokens_used", 0) * max(input_price, output_price) / 1_000_000
+    return (prompt * input_price + completion * output_price) / 1_000_000
+
+class SpendBudget:
+    """Run-wide spend cap in USD, shared by every model in this process.
+
+    Before each model call ``reserve`` sets aside the model's running mean
+    cost per call and refuses once spent plus reserved would pass the cap,
+    so requests already in flight cannot overshoot it by much. ``settle``
+    swaps the reservation for the call's actual cost. Until a model has a
+    successful call on record its cost is unknown, so one call at a time
+    goes out as a probe and every other ``reserve`` waits for its price
+    instead of going out unreserved. Optional calls such as hedges use
+    ``try_reserve``, which never waits and refuses while the cost is unknown,
+    and calls whose cost is bounded up front use ``reserve_fixed``.
+    """
+
+    def __init__(self, limit_usd: float):
+        self.limit_usd = limit_usd
+        self.spent_usd = 0.0
+        self.reserved_usd = 0.0
+        self.stopped: set[str] = set() # models refused a call
+        self._calls: dict[str, tuple[float, int]] = {} # model -> (cost, successful calls)
+        self._probes: dict[str, asyncio.Event] = {} # model -> set when its probe call settles
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent_usd >= self.limit_usd
+
+    async def reserve(self, model: str) -> float | None:
+        """Reserve the expected cost of one call, or None when it would exceed the cap."""
+        while model not in self._calls:
+            if model not in self._probes:
+                reserved = self._claim(0.0)
+                if reserved is not None:
+                    self._probes[model] = asyncio.Event()
+                return reserved
+            await self._probes[model].wait()
+        return self.try_reserve(model)
+
+    def try_reserve(self, model: str) -> float | None:
+        """Like ``reserve``, but refuse instead of waiting while the model's cost is unknown."""
+        if model not in self._calls:
+            return None
+        cost, calls = self._calls[model]
+        return self._claim(cost / calls)
+
+    def reserve_fixed(self, cost: float) -> float | None:
+        """Reserve a call whose cost is known not to exceed ``cost``, without waiting for a probe."""
+        return self._claim(cost)
+
+    def _claim(self, estimate: float) -> float | None:
+        if self.spent_usd + self.reserved_usd + estimate > self.limit_usd:
+            return None
+        self.reserved_usd += estimate
+        return estimate
+
+    def release(self, reserved: float) -> None:
+        """Return a reservation that was not used for a call."""
+        self.reserved_usd -= reserved
+
+    def settle(self, model: str, reserved: float, actual: float, observed: bool = True) -> None:
+        """Swap a reservation for the actual cost; ``observed`` calls also update the mean cost per call.
+
+        Failed or cancelled calls pass ``observed=False``: they are charged
+        but say nothing about what an answered call costs.
+        """
+        self.reserved_usd -= reserved
+        self.spent_usd += actual
+        if observed:
+            cost, calls = self._calls.get(model, (0.0, 0))
+            self._calls[model] = (cost + actual, calls + 1)
+        probe = self._probes.pop(model, None)
+        if probe:
+            probe.set() # waiters price their call, or the next one becomes the probe
 
 # ---------------------------------------------------------------------------
-# Reports
+# Adaptive concurrency
 # ---------------------------------------------------------------------------
 
-def generate_markdown_report(report: dict) -> str:
- """Generate human-readable Markdown comparison report."""
- lines = [
- "# Model Comparison Report",
- "",
- f"**Generated**: {report['timestamp']} ",
- f"**Report ID**: {report['report_id']} ",
- f"**Models Tested**: {report['models_tested']}",
- "",
- ]
-
- # Summary table
- lines.append("## Results")
- lines.append("")
- lines.append("| Model | Role | Task Completion | Format Compliance | Avg Latency | Avg Tokens | Status |")
- lines.append("|-------|------|---------------:|------------------:|------------:|-----------:|--------|")
-
- for m in report["models"]:
- status = "[PASS] PASS" if m["passed"] else "[FAIL] FAIL"
- lines.append(
- f"| {m['name']} | {m['role']} | {m['task_completion']:.3f} | "
- f"{m['format_compliance']:.3f} | {m['avg_latency_ms']:.0f}ms | "
- f"{m['avg_tokens']:.0f} | {status} |"
- )
-
- # Winners
- if report.get("winner_by_metric"):
- lines.append("")
- lines.append("## Best By Metric")
- lines.append("")
- for metric, winner in report["winner_by_metric"].items():
- lines.append(f"- **{metric}**: {winner}")
-
- # Alerts
- if report.get("alerts"):
- lines.append("")
- lines.append("## Alerts")
- lines.append("")
- for alert in report["alerts"]:
- lines.append(f"- [WARN] {alert}")
-
- # Overall
- lines.append("")
- if report["all_passed"]:
- lines.append("## Verdict: [PASS] All models meet minimum thresholds")
- else:
- failed = [m["name"] for m in report["models"] if not m["passed"]]
- lines.append(f"## Verdict: [FAIL] {len(failed)} model(s) failed threshold checks")
- for name in failed:
- lines.append(f" - {name}")
-
- lines.append("")
- return "\n".join(lines)
+def error_status(exc: BaseException) -> int | None:
+    """HTTP status carried by a client exception, if any."""
+    for candidate in (exc, getattr(exc, "response", None), exc.__cause__):
+        status = getattr(candidate, "status_code", None)
+        if isinstance(status, int):
+            return status
+    return None
 
-def save_reports(report: dict, output_dir: str) -> None:
- """Save JSON and Markdown reports."""
- output = Path(output_dir)
- output.mkdir(parents=True, exist_ok=True)
-
- # JSON report
- json_path = output / "comparison-report.json"
- with open(json_path, "w", encoding="utf-8") as f:
- json.dump(report, f, indent=2)
- print(f" JSON report: {json_path}")
-
- # Markdown report
- md_path = output / "comparison-report.md"
- md_content = generate_markdown_report(report)
- with open(md_path, "w", encoding="utf-8") as f:
- f.write(md_content)
- print(f" Markdown report: {md_path}")
+def retry_after_seconds(exc: BaseException) -> float | None:
+    """``Retry-After`` header (in seconds) carried by a client exception, if any."""
+    for candidate in (exc, getattr(exc, "response", None), exc.__cause__):
+        headers = getattr(candidate, "headers", None)
+        if not headers:
+            continue
+        value = next((v for k, v in dict(headers).items() if k.lower() == "retry-after"), None)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None # HTTP-date form; fall back to backoff
+    return None
 
-def print_summary(report: dict) -> None:
- """Print colored summary to terminal."""
- print("\n" + "=" * 60)
- print(" MODEL COMPARISON SUMMARY")
- print("=" * 60)
-
- for m in report["models"]:
- status = "PASS" if m["passed"] else "FAIL"
- print(f"\n [{status}] {m['name']} ({m['role']})")
- print(f" Task Completion: {m['task_completion']:.3f}")
- print(f" Format Compliance: {m['format_compliance']:.3f}")
- print(f" Avg Latency: {m['avg_latency_ms']:.0f}ms")
- print(f" Avg Tokens: {m['avg_tokens']:.0f}")
- if m["failures"]:
- for fail in m["failures"]:
- print(f" [!] {fail}")
-
- if report.get("alerts"):
- print(f"\n ALERTS ({len(report['alerts'])})")
- for alert in report["alerts"]:
- print(f" - {alert}")
-
- print("\n" + "=" * 60)
- if report["all_passed"]:
- print(" [PASS] All models meet minimum thresholds")
- else:
- print(" [FAIL] Some models failed threshold checks")
- print("=" * 60 + "\n")
+def is_retryable(result: dict) -> bool:
+    """True for throttled (429) or server-side (5xx) failures."""
+    status = result.get("error_status")
+    return bool(result.get("error")) and status is not None and (status == 429 or status >= 500)
+
+class AdaptiveConcurrency:
+    """AIMD controller for the number of in-flight requests of one model.
+
+    The limit grows by roughly one request per round trip while responses
+    are healthy, and halves on a 429/5xx or when the p95 latency of the
+    latest window rises past ``latency_tolerance`` times the best window seen.
+    A ``Retry-After`` pauses all new dispatches until it has elapsed. Every
+    limit change is appended to ``timeline``.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: int | None = None,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        window: int = 20,
+        max_retries: int = 3,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial or min_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.window = window
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.timeline: list[dict] = []
+        self._start = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latencies: list[float] = []
+        self._best_p95: float | None = None
+        self._cond = asyncio.Condition()
+        self._log("start")
+
+    def _log(self, reason: str) -> None:
+        self.timeline.append({
+            "t_s": round(time.monotonic() - self._start, 3),
+            "limit": int(self.limit),
+            "reason": reason,
+        })
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        previous = int(self.limit)
+        self.limit = min(float(self.max_limit), max(float(self.min_limit), limit))
+        if int(self.limit) != previous:
+            self._log(reason)
+
+    async def acquire(self) -> None:
+        """Wait for a free slot under the current limit (and any pause)."""
+        async with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    # Sleep without holding the condition, then re-check
+                    self._cond.release()
+                    try:
+                        await asyncio.sleep(pause)
+                    finally:
+                        await self._cond.acquire()
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self._cond.wait()
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free now (and no ``Retry-After`` pause is active)."""
+        if self._paused_until > time.monotonic() or self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    async def release(self, result: dict, retry_after: float | None = None) -> None:
+        """Free a slot and adjust the limit from the request outcome."""
+        async with self._cond:
+            self.in_flight -= 1
+            if is_retryable(result):
+                self._on_overload("throttled" if result.get("error_status") == 429 else "server_error",
+                                  retry_after)
+            elif not result.get("error"):
+                self._on_success(result["latency_ms"])
+            self._cond.notify_all()
+
+    def _on_overload(self, reason: str, retry_after: float | None) -> None:
+        now = time.monotonic()
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        # One decrease per cooldown, so a burst of 429s from the same window
+        # does not collapse the limit to the floor
+        if now - self._last_decrease >= 1.0:
+            self._last_decrease = now
+            self._set_limit(self.limit * self.decrease_factor, reason)
+
+    def _on_success(self, latency_ms: float) -> None:
+        self._latencies.append(latency_ms)
+        if len(self._latencies) >= self.window:
+            window = sorted(self._latencies)
+            self._latencies = []
+            p95 = window[min(len(window) - 1, int(0.95 * len(window)))]
+            if self._best_p95 is not None and p95 > self._best_p95 * self.latency_tolerance:
+                self._set_limit(self.limit * self.decrease_factor, "latency")
+                return
+            self._best_p95 = p95 if self._best_p95 is None else min(self._best_p95, p95)
+        # Additive increase: about +1 per round trip at the current limit
+        self._set_limit(self.limit + 1.0 / max(self.limit, 1.0), "healthy")
+
+    def backoff_seconds(self, attempt: int, retry_after: float | None) -> float:
+        """Delay before retry ``attempt`` (1-based) of a throttled request."""
+        if retry_after is not None:
+            return retry_after
+        return min(30.0, 0.5 * 2 ** (attempt - 1))
 
 # ---------------------------------------------------------------------------
-# Regression check
+# Request hedging
 # ---------------------------------------------------------------------------
 
-def check_regression(report: dict, baseline_path: str | None, max_regression_pct: float) -> bool:
- """Check if primary model regressed from baseline. Returns True if OK."""
- if not baseline_path:
- # Try default location
- candidates = [
- "evaluation/baseline.json",
- "baseline.json",
- "evaluation/results/baseline.json",
- ]
- for candidate in candidates:
- if Path(candidate).exists():
- baseline_path = candidate
- break
-
- if not baseline_path or not Path(baseline_path).exists():
- print(" No baseline found - skipping regression check")
- return True
-
- with open(baseline_path, encoding="utf-8") as f:
- baseline = json.load(f)
-
- # Find primary model in current results
- primary = next((m for m in report["models"] if m["role"] == "primary"), None)
- if not primary:
- print(" No primary model found in results - skipping regression check")
- return True
-
- baseline_scores = baseline.get("scores", baseline)
- regression_found = False
-
- for metric in ["task_completion", "format_compliance"]:
- baseline_val = baseline_scores.get(metric, 0)
- current_val = primary.get(metric, 0)
- if baseline_val > 0:
- drop_pct = ((baseline_val - current_val) / baseline_val) * 100
- if drop_pct > max_regression_pct:
- print(f" REGRESSION: {metric} dropped {drop_pct:.1f}% "
- f"(baseline: {baseline_val:.3f} -> current: {current_val:.3f})")
- regression_found = True
- else:
- print(f" {metric}: {current_val:.3f} (baseline: {baseline_val:.3f}) - OK")
-
- return not regression_found
+class Hedger:
+    """Fires a duplicate request when the original is slower than usual.
+
+    The hedge delay is ``delay_ms`` when given, otherwise the running
+    ``quantile`` of primary latencies (once ``min_samples`` are seen). At most
+    ``budget`` hedges are fired per request started, which caps the extra
+    load. The first successful attempt wins; the loser keeps running in the
+    background so its latency can still be recorded (see ``drain``). Hedges
+    that find no rate-limit or concurrency headroom are counted in
+    ``skipped`` instead of being sent.
+    """
+
+    def __init__(
+        self,
+        delay_ms: float | None = None,
+        budget: float = 0.05,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+    ):
+        self.fixed_delay_ms = delay_ms
+        self.budget = budget
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.sketch = LatencySketch()
+        self.requests = 0
+        self.hedges = 0
+        self.skipped = 0
+        self._finishers: set[asyncio.Task] = set()
+
+    def delay_ms(self) -> float | None:
+        if self.fixed_delay_ms is not None:
+            return self.fixed_delay_ms
+        if self.sketch.count < self.min_samples:
+            return None
+        return self.sketch.quantile(self.quantile)
+
+    def _observe_primary(self, result: dict) -> None:
+        if not result.get("error"):
+            self.sketch.add(result["latency_ms"])
+
+    async def run(
+        self,
+        send: Callable[[], Any],
+        admit: Callable[[], Callable[[], Any] | None] | None = None,
+    ) -> tuple[dict, asyncio.Task | None]:
+        """Run ``send`` with hedging and return the winning result.
+
+        When a hedge is due, ``admit`` (if given) claims headroom for it
+        without waiting and returns the function that sends the hedge, or
+        None to skip it and wait for the original. Hedged records carry a
+        ``hedge`` block with both attempts' latencies and the latency saved.
+        If the losing attempt is still running, the second item is a task
+        that completes the record once the loser finishes (or is cancelled
+        by ``drain``); otherwise it is None.
+        """
+        self.requests += 1
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(send())
+        delay = self.delay_ms()
+
+        if delay is not None and self.hedges < self.budget * self.requests:
+            done, _ = await asyncio.wait({primary}, timeout=delay / 1000)
+        else:
+            done = {primary}
+            await primary
+        hedge_send = None
+        if primary not in done and self.hedges >= self.budget * self.requests:
+            # Hedges fired by requests that waited out the delay alongside this one used up the budget
+            await primary
+        elif primary not in done:
+            hedge_send = admit() if admit else send
+            if hedge_send is None:
+                self.skipped += 1
+                await primary
+        if hedge_send is None:
+            result = primary.result()
+            self._observe_primary(result)
+            return result, None
+
+        self.hedges += 1
+        hedge = asyncio.ensure_future(hedge_send())
+        attempts = {primary: "primary", hedge: "hedge"}
+        pending = {primary, hedge}
+        winner = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Prefer a successful finisher; fall back to an error only if both fail
+            ok = [t for t in done if not t.result().get("error")]
+            if ok:
+                winner = ok[0]
+            elif not pending:
+                winner = primary
+        loser = hedge if winner is primary else primary
+
+        result = dict(winner.result())
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000)
+        result["hedge"] = {
+            "delay_ms": round(delay),
+            "winner": attempts[winner],
+            "primary_latency_ms": primary.result()["latency_ms"] if primary.done() else None,
+            "hedge_latency_ms": hedge.result()["latency_ms"] if hedge.done() else None,
+            "latency_saved_ms": None,
+        }
+        if loser.done():
+            self._finish(result, primary, loser)
+            return result, None
+        finisher = asyncio.ensure_future(self._await_loser(result, primary, loser, attempts[loser]))
+        self._finishers.add(finisher)
+        finisher.add_done_callback(self._finishers.discard)
+        return result, finisher
+
+    def _finish(self, record: dict, primary: asyncio.Future, loser: asyncio.Future) -> None:
+        hedge = record["hedge"]
+        if loser.done() and not loser.cancelled() and loser.result().get("cost_usd") is not None:
+            # The losing attempt was paid for too
+            hedge["extra_cost_usd"] = loser.result()["cost_usd"]
+        if hedge["primary_latency_ms"] is not None:
+            self._observe_primary(primary.result())
+            # Latency saved = what the original request alone would have cost
+            hedge["latency_saved_ms"] = max(0, hedge["primary_latency_ms"] - record["latency_ms"])
+
+    async def _await_loser(
+        self,
+        record: dict,
+        primary: asyncio.Future,
+        loser: asyncio.Future,
+        name: str,
+    ) -> None:
+        try:
+            record["hedge"][f"{name}_latency_ms"] = (await loser)["latency_ms"]
+        except asyncio.CancelledError:
+            loser.cancel()
+            record["hedge"]["censored"] = True
+        finally:
+            self._finish(record, primary, loser)
+
+    async def drain(self, grace_s: float) -> None:
+        """Wait up to ``grace_s`` for losing attempts, then cancel the rest."""
+        if not self._finishers:
+            return
+        _, pending = await asyncio.wait(set(self._finishers), timeout=grace_s)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
 # ---------------------------------------------------------------------------
-# CLI
+# Sequential early stopping
 # ---------------------------------------------------------------------------
 
-def parse_args() -> argparse.Namespace:
- parser = argparse.ArgumentParser(
- description="Run multi-model evaluation comparison for AI agents",
- formatter_class=argparse.RawDescriptionHelpFormatter,
- epilog="""
-Examples:
- # Run full comparison using config
- python run-model-comparison.py --config config/models.yaml --dataset evaluation/core-regression.jsonl
+class EarlyStopper:
+    """Sequential test of the proportion gates while a model is running.
 
- # Compare from pre-existing result files
- python run-model-comparison.py --results-dir evaluation/results/
+    Once ``min_samples`` results are in, every ``check_every``-th result
+    triggers a look: a one-sided Wilson upper bound is computed for
+    ``task_completion`` and ``format_compliance``. Look *k* spends
+    ``alpha / (k * (k + 1))`` of the error budget, so the chance of stopping
+    a model that actually meets its gates stays below ``1 - confidence``
+    however many looks are taken. When a bound falls below its threshold the
+    failure is settled and ``verdict`` is set. Passing models always run to
+    completion, because the latency gates need the full sample.
+    """
 
- # CI gate check
- python run-model-comparison.py --results-dir evaluation/results/ --check-gates --fail-on-regression
- """,
- )
-
- parser.add_argument("--config", default="config/models.yaml",
- help="Path to model matrix config (default: config/models.yaml)")
- parser.add_argument("--dataset", default="evaluation/core-regression.jsonl",
- help="Path to evaluation dataset JSONL")
- parser.add_argument("--results-dir", default="evaluation/results",
- help="Directory for per-model result files")
- parser.add_argument("--output-dir", default="evaluation",
- help="Directory for comparison reports")
- parser.add_argument("--system-prompt",
- help="System prompt for the agent (or path to .txt file)")
- parser.add_argument("--check-gates", action="store_true",
- help="Check thresholds and exit with code 1 on failure")
- parser.add_argument("--fail-on-regression", action="store_true",
- help="Exit 1 if primary model regressed from baseline")
- parser.add_argument("--baseline", default=None,
- help="Path to baseline scores JSON")
- parser.add_argument("--skip-eval", action="store_true",
- help="Skip evaluation, only compare existing results")
-
- return parser.parse_args()
+    def __init__(
+        self,
+        thresholds: Thresholds,
+        confidence: float = 0.95,
+        min_samples: int = 50,
+        check_every: int = 10,
+    ):
+        self.thresholds = thresholds
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.check_every = check_every
+        self.count = 0
+        self.successful = 0
+        self.well_formed = 0
+        self.looks = 0
+        self.verdict: dict | None = None
 
-def main() -> int:
- args = parse_args()
- exit_code = 0
-
- # Load config for thresholds
- config = {}
- config_path = Path(args.config)
- if config_path.exists():
- config = load_config(args.config)
- thresholds = load_thresholds(config)
-
- # Step 1: Run evaluations (unless --skip-eval or --results-dir only)
- if not args.skip_eval and config.get("models") and Path(args.dataset).exists():
- import asyncio
- models = load_models(config)
- dataset = load_dataset(args.dataset)
-
- # Load system prompt
- system_prompt = "You are a helpful assistant."
- if args.system_prompt:
- sp_path = Path(args.system_prompt)
- if sp_path.exists():
- system_prompt = sp_path.read_text(encoding="utf-8")
- else:
- system_prompt = args.system_prompt
-
- print(f"\nRunning evaluation: {len(models)} models {len(dataset)} queries")
- asyncio.run(run_all_models(
- models=models,
- dataset=dataset,
- output_dir=Path(args.results_dir),
- system_prompt=system_prompt,
- ))
-
- # Step 2: Compare results
- results_path = Path(args.results_dir)
- if results_path.exists() and list(results_path.glob("*.json")):
- print("\nGenerating comparison report...")
- report = compare_models(args.results_dir, thresholds)
-
- # Save reports
- save_reports(report, args.output_dir)
- print_summary(report)
-
- # Gate check
- if args.check_gates and not report["all_passed"]:
- print("GATE CHECK FAILED: Not all models meet thresholds")
- exit_code = 1
-
- # Regression check
- if args.fail_on_regression:
- if not check_regression(report, args.baseline, thresholds.max_regression_pct):
- print("REGRESSION CHECK FAILED: Primary model regressed from baseline")
- exit_code = 1
- else:
- print(f"\nNo results found in {args.results_dir}")
- print("Run with a valid --config and --dataset to generate results,")
- print("or provide --results-dir pointing to existing .json result files.")
- exit_code = 1
-
- return exit_code
+    @staticmethod
+    def wilson_upper(successes: int, n: int, z: float) -> float:
+        """Upper end of the Wilson score interval for ``successes / n``."""
+        p = successes / n
+        denominator = 1 + z * z / n
+        centre = p + z * z / (2 * n)
+        spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        return min(1.0, (centre + spread) / denominator)
+
+    def add(self, result: dict) -> bool:
+        """Record one result. Returns True once the model should stop."""
+        if self.verdict:
+            return True
+        # Same success / well-formed rules as ScoreAggregator
+        self.count += 1
+        if not result.get("error"):
+            self.successful += 1
+            if len(result.get("response", "").strip()) > 10:
+                self.well_formed += 1
+        if self.count < self.min_samples or self.count % self.check_every:
+            return False
+
+        self.looks += 1
+        alpha = (1 - self.confidence) / (self.looks * (self.looks + 1))
+        z = NormalDist().inv_cdf(1 - alpha)
+        gates = [
+            ("task_completion", self.successful, self.count, self.thresholds.task_completion),
+            ("format_compliance", self.well_formed, self.successful, self.thresholds.format_compliance),
+        ]
+        for metric, successes, n, threshold in gates:
+            if n == 0:
+                continue
+            upper = self.wilson_upper(successes, n, z)
+            if upper < threshold:
+                self.verdict = {
+                    "metric": metric,
+                    "observed": round(successes / n, 3),
+                    "upper_bound": round(upper, 3),
+                    "threshold": threshold,
+                    "confidence": self.confidence,
+                    "after_queries": self.count,
+                }
+                return True
+        return False
+
+# ---------------------------------------------------------------------------
+# Result files
+# ---------------------------------------------------------------------------
+
+def result_file_name(model: ModelSpec) -> str:
+    """File name stem for a model's result file."""
+    return model.name.replace("/", "-").replace(" ", "-")
+
+# run_fingerprint key -> what a mismatch means, in error messages
+FINGERPRINT_FIELDS = {
+    "dataset_sha256": "dataset or sample",
+    "system_prompt_sha256": "system prompt",
+    "deployment": "deployment",
+    "deployments": "set of model deployments",
+}
+
+def run_fingerprint(dataset_sha256: str, system_prompt: str, **deployment: Any) -> dict:
+    """What results depend on besides the model: the rows evaluated and the system prompt.
+
+    Pass ``deployment=`` for one model's result file, or ``deployments=``
+    (name -> deployment) for a work queue shared by several models.
+    """
+    return {
+        "dataset_sha256": dataset_sha256,
+        "system_prompt_sha256": hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        **deployment,
+    }
+
+def fingerprint_changes(stored: dict | None, current: dict | None) -> list[str]:
+    """Descriptions of the fingerprint fields that differ (none for files written before fingerprints)."""
+    if not stored or not current:
+        return []
+    return [label for key, label in FINGERPRINT_FIELDS.items() if stored.get(key) != current.get(key)]
+
+_SUPERSEDED_WARNED: set[Path] = set()
+
+def find_result_files(results_path: Path) -> list[Path]:
+    """List legacy ``.json`` and streaming ``.jsonl`` result files, sorted.
+
+    A legacy ``<model>.json`` left beside the ``<model>.jsonl`` that replaced
+    it is skipped (with a one-time warning) so the model is not reported twice.
+    """
+    streaming = sorted(results_path.glob("*.jsonl"))
+    stems = {path.stem for path in streaming}
+    legacy = []
+    for path in results_path.glob("*.json"):
+        if path.stem not in stems:
+            legacy.append(path)
+        elif path not in _SUPERSEDED_WARNED:
+            _SUPERSEDED_WARNED.add(path)
+            print(f"WARNING: Ignoring legacy {path.name}; {path.stem}.jsonl supersedes it", file=sys.stderr)
+    return sorted([*legacy, *streaming])
+
+class ResultWriter:
+    """Append-only JSONL result file for one model.
+
+    The first line is a metadata header, every per-query result is appended
+    and flushed as soon as it completes, and each run ends with a ``run``
+    summary line. Lines carrying an ``index`` key are results; any other line
+    is metadata. Reopening an existing file resumes it: indices already
+    present are reported via ``done_indices`` so they can be skipped, and
+    the metadata already in the file is kept as ``existing``. A file whose
+    header ``fingerprint`` (see ``run_fingerprint``) differs from the new
+    run's was written for other queries, a prompt or a deployment, and is
+    never resumed.
+    """
+
+    def __init__(self, path: Path, header: dict, fresh: bool = False):
+        self.path = path
+        self.done_indices: set[int] = set()
+        self.existing: dict = {}
+
+        if path.exists() and not fresh:
+            self.existing = existing = scan_result_file(path, lambda r: self.done_indices.add(r["index"]))
+            if existing.get("dataset_size") != header.get("dataset_size"):
+                print(f"ERROR: {path} was written for a dataset of {existing.get('dataset_size')} "
+                      f"queries, not {header.get('dataset_size')}. Use --fresh to start over.",
+                      file=sys.stderr)
+                sys.exit(1)
+            changed = fingerprint_changes(existing.get("fingerprint"), header.get("fingerprint"))
+            if changed:
+                print(f"ERROR: {path} was written for a different {', '.join(changed)}. "
+                      f"Use --fresh to start over.", file=sys.stderr)
+                sys.exit(1)
+            self._truncate_partial_line()
+            self._file = open(path, "a", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+            self._append(header)
+
+    def _truncate_partial_line(self) -> None:
+        """Drop a half-written last line left behind by a crash."""
+        with open(self.path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                if pos + step == end and chunk.endswith(b"\n"):
+                    return
+                newline = chunk.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(pos + newline + 1)
+                    return
+            f.truncate(0)
+
+    def _append(self, record: dict) -> None:
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def write(self, result: dict) -> None:
+        """Persist one per-query result."""
+        self._append(result)
+        self.done_indices.add(result["index"])
+
+    def close(self, run_summary: dict | None = None) -> None:
+        if run_summary:
+            self._append({"run": run_summary})
+        self._file.close()
+
+class _JsonStream:
+    """Incremental reader for one large JSON document.
+
+    Decodes one value at a time from a sliding text buffer, so memory is
+    bounded by the largest single value rather than the whole document.
+    """
+
+    def __init__(self, f: Any, chunk_size: int = 1 << 16):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ('' at end of input)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos:self._pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON stream, found {self.peek()!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A number cut short by the buffer end ("12" of "12.5") still
+                # decodes, so only trust a value followed by a delimiter
+                if self._eof or (end < len(self._buf) and self._buf[end] in " \t\r\n,:]}"):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+def _scan_json_results(path: Path, on_result: Callable[[dict], None]) -> dict:
+    """Stream a legacy ``{"results": [...]}`` file element by element."""
+    data: dict[str, Any] = {}
+    with open(path, encoding="utf-8") as f:
+        stream = _JsonStream(f)
+        stream.expect("{")
+        while stream.peek() != "}":
+            key = stream.value()
+            stream.expect(":")
+            if key == "results":
+                stream.expect("[")
+                while stream.peek() != "]":
+                    on_result(stream.value())
+                    if stream.peek() == ",":
+                        stream.expect(",")
+                stream.expect("]")
+            else:
+                data[key] = stream.value()
+            if stream.peek() == ",":
+                stream.expect(",")
+    return data
+
+# Run summary fields that add up over the runs that resumed a file, and ones
+# where the first run's value is kept (the cold start happens only once);
+# every other field describes the latest run
+RUN_TOTALS = ("queries_run", "wall_clock_s", "spent_usd", "hedges_fired", "hedges_skipped")
+RUN_FIRST = ("warmup",)
+
+def merge_run_summaries(previous: dict, latest: dict) -> dict:
+    """Combine the ``run`` summary of an earlier run of a file with a later one."""
+    merged = dict(latest)
+    for key in RUN_TOTALS:
+        if key in previous or key in latest:
+            merged[key] = round(previous.get(key, 0) + latest.get(key, 0), 6)
+    for key in RUN_FIRST:
+        if previous.get(key):
+            merged[key] = previous[key]
+    if merged.get("wall_clock_s"):
+        merged["queries_per_sec"] = round(merged.get("queries_run", 0) / merged["wall_clock_s"], 3)
+    return merged
+
+def scan_result_file(path: Path, on_result: Callable[[dict], None]) -> dict:
+    """Stream a result file in either the JSONL or legacy JSON format.
+
+    Calls ``on_result`` for each per-query result as it is parsed and returns
+    the file's metadata (everything except ``results``), with the ``run``
+    summaries of resumed runs combined by ``merge_run_summaries``. Memory
+    use does not grow with the number of results.
+    """
+    if path.suffix != ".jsonl":
+        return _scan_json_results(path, on_result)
+
+    data: dict[str, Any] = {}
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave the final line half-written
+                print(f"WARNING: Skipping truncated line {lineno} in {path}", file=sys.stderr)
+                continue
+            if "index" in record:
+                on_result(record)
+            elif "run" in record and "run" in data:
+                data["run"] = merge_run_summaries(data["run"], record["run"])
+            else:
+                data.update(record)
+    return data
+
+def load_result_file(path: Path) -> dict:
+    """Load a result file in either the streaming JSONL or legacy JSON format.
+
+    Always returns the legacy shape: metadata keys plus a ``results`` list
+    sorted by ``index``.
+    """
+    results: list[dict] = []
+    data = scan_result_file(path, results.append)
+    data["results"] = sorted(results, key=lambda r: r["index"])
+    return data
+
+# ---------------------------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------------------------
+
+CACHE_MODES = ("read", "write", "off")
+
+class ResponseCache:
+    """On-disk response cache keyed by (deployment, system prompt, query).
+
+    Entries live in a SQLite file and are evicted least-recently-used first
+    once the stored responses exceed ``max_bytes``. Modes:
+
+    - ``read``: serve hits from the cache, call the model on a miss and store it
+    - ``write``: always call the model and refresh the stored response
+    - ``off``: bypass the cache entirely
+    """
+
+    def __init__(self, path: Path, mode: str = "read", max_bytes: int = 512 * 1024 * 1024):
+        self.mode = mode
+        self.max_bytes = max_bytes
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(deployment: str, system_prompt: str, query: str) -> str:
+        """Content address of one request."""
+        payload = json.dumps([deployment, system_prompt, query], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """Return the cached response for ``key`` (``read`` mode only)."""
+        if self.mode != "read":
+            return None
+        row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        return json.loads(row[0])
+
+    def get_many(self, keys: list[str], chunk: int = 500) -> dict[str, dict]:
+        """Cached values for whichever ``keys`` are present, in one transaction."""
+        if self.mode != "read":
+            return {}
+        found = {}
+        for start in range(0, len(keys), chunk):
+            part = keys[start:start + chunk]
+            marks = ",".join("?" * len(part))
+            for key, value in self._db.execute(f"SELECT key, value FROM responses WHERE key IN ({marks})", part):
+                found[key] = json.loads(value)
+        if found:
+            now = time.time()
+            self._db.executemany("UPDATE responses SET last_access = ? WHERE key = ?", ((now, k) for k in found))
+            self._db.commit()
+        return found
+
+    def put(self, key: str, value: dict) -> None:
+        """Store a response, then evict LRU entries beyond the size cap."""
+        self.put_many({key: value})
+
+    def put_many(self, values: dict[str, dict]) -> None:
+        """Store several responses in one transaction."""
+        if self.mode == "off" or not values:
+            return
+        now = time.time()
+        for key, value in values.items():
+            blob = json.dumps(value)
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), now),
+            )
+            self._total_bytes += len(blob) - (old[0] if old else 0)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+        self._db.commit()
+
+    def _evict(self) -> None:
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= size
+
+    def close(self) -> None:
+        self._db.close()
+
+# ---------------------------------------------------------------------------
+# Work queue
+# ---------------------------------------------------------------------------
+
+QUEUE_POLL_SECONDS = 1.0
+
+class WorkQueue:
+    """SQLite work queue of ``(model, index)`` tasks shared by worker processes.
+
+    The coordinator enqueues every query once; each worker leases tasks one
+    at a time, writes the result to its own file and marks the task done. A
+    lease not completed within ``lease_seconds`` (slow or crashed worker) is
+    handed out again, so stragglers never hold up the run. Duplicate results
+    from an expired lease that still finishes are dropped at merge time.
+    Claims run inside ``BEGIN IMMEDIATE``, serialising workers on SQLite's
+    file lock, which also works on shared filesystems without WAL support.
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = 300.0):
+        self.lease_seconds = lease_seconds
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "model TEXT NOT NULL, idx INTEGER NOT NULL, "
+            "state TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (model, idx))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_claim ON tasks(model, state, lease_expires)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _transaction(self, statements: Callable[[], Any]) -> Any:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            value = statements()
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return value
+
+    def bind_dataset(self, dataset_size: int, fingerprint: dict | None = None) -> None:
+        """Record the dataset size and run fingerprint, or exit if the queue was built for another run."""
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dataset_size', ?)", (str(dataset_size),))
+        stored = int(self._db.execute("SELECT value FROM meta WHERE key = 'dataset_size'").fetchone()[0])
+        if stored != dataset_size:
+            print(f"ERROR: Work queue was built for a dataset of {stored} queries, not {dataset_size}. "
+                  f"Use --fresh on the coordinator to start over.", file=sys.stderr)
+            sys.exit(1)
+        if fingerprint is None:
+            return
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('fingerprint', ?)",
+                         (json.dumps(fingerprint),))
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        changed = fingerprint_changes(json.loads(row[0]), fingerprint)
+        if changed:
+            print(f"ERROR: Work queue was built for a different {', '.join(changed)}. "
+                  f"Use --fresh on the coordinator to start over.", file=sys.stderr)
+            sys.exit(1)
+
+    def reset(self) -> None:
+        """Drop all tasks and metadata."""
+        self._transaction(lambda: (self._db.execute("DELETE FROM tasks"), self._db.execute("DELETE FROM meta")))
+
+    def enqueue(self, model: str, indices: list[int]) -> int:
+        """Add tasks for ``model``; tasks already queued keep their state. Returns tasks added."""
+        before = self._db.total_changes
+        self._transaction(lambda: self._db.executemany(
+            "INSERT OR IGNORE INTO tasks (model, idx) VALUES (?, ?)", ((model, i) for i in indices),
+        ))
+        return self._db.total_changes - before
+
+    def lease(self, model: str, worker: str) -> int | None:
+        """Claim the lowest pending (or lease-expired) index for ``model``."""
+        def claim() -> int | None:
+            now = time.time()
+            row = self._db.execute(
+                "SELECT idx FROM tasks WHERE model = ? AND (state = 'pending' "
+                "OR (state = 'leased' AND lease_expires < ?)) ORDER BY idx LIMIT 1",
+                (model, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE model = ? AND idx = ?",
+                (worker, now + self.lease_seconds, model, row[0]),
+            )
+            return row[0]
+
+        return self._transaction(claim)
+
+    def complete(self, model: str, index: int) -> None:
+        """Mark a task done, whichever worker finished it first."""
+        self._db.execute(
+            "UPDATE tasks SET state = 'done', lease_expires = NULL WHERE model = ? AND idx = ?",
+            (model, index),
+        )
+
+    def cancel(self, model: str) -> None:
+        """Withdraw every unfinished task for ``model`` (e.g. after an early stop)."""
+        self._db.execute("UPDATE tasks SET state = 'cancelled' WHERE model = ? AND state != 'done'", (model,))
+
+    def progress(self, model: str) -> tuple[int, int]:
+        """``(finished, total)`` task counts for ``model``; cancelled tasks count as finished."""
+        done, total = self._db.execute(
+            "SELECT COALESCE(SUM(state IN ('done', 'cancelled')), 0), COUNT(*) FROM tasks WHERE model = ?",
+            (model,),
+        ).fetchone()
+        return done, total
+
+    def close(self) -> None:
+        self._db.close()
+
+# ---------------------------------------------------------------------------
+# Profiling and tracing (tracing requires opentelemetry-sdk)
+# ---------------------------------------------------------------------------
+
+OTEL_EXPORTERS = ("console", "file")
+
+_tracer: Any = None # set by configure_tracing; spans are no-ops while None
+
+def configure_tracing(exporter: str, path: Path | None = None) -> Callable[[], None]:
+    """Export OpenTelemetry spans to stdout or to ``path`` as JSON lines.
+
+    Returns a shutdown callable that flushes pending spans; call it before exit.
+    """
+    global _tracer
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        print("ERROR: opentelemetry-sdk required for --otel. Install: pip install opentelemetry-sdk", file=sys.stderr)
+        sys.exit(1)
+
+    out = sys.stdout
+    if exporter == "file":
+        path.parent.mkdir(parents=True, exist_ok=True)
+        out = open(path, "w", encoding="utf-8")
+    provider = TracerProvider(resource=Resource.create({"service.name": "run-model-comparison"}))
+    provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter(
+        out=out,
+        formatter=lambda span: span.to_json(indent=None) + "\n",
+    )))
+    # The provider is used directly rather than installed globally, so the
+    # host's own OpenTelemetry setup (if any) is left alone
+    _tracer = provider.get_tracer("run-model-comparison")
+
+    def shutdown() -> None:
+        global _tracer
+        _tracer = None
+        provider.shutdown()
+        if out is not sys.stdout:
+            out.close()
+            print(f" Saved: {path}")
+
+    return shutdown
+
+def trace_span(name: str, attributes: dict[str, Any] | None = None) -> Any:
+    """Context manager for a span that becomes the parent of spans opened inside it."""
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+def start_span(name: str, attributes: dict[str, Any] | None = None) -> Any:
+    """Start a leaf span under the current span; finish it with ``end_span``."""
+    return _tracer.start_span(name, attributes=attributes) if _tracer is not None else None
+
+def end_span(span: Any, result: dict) -> None:
+    """Record a query result on ``span`` and end it."""
+    if span is None:
+        return
+    from opentelemetry.trace import Status, StatusCode
+
+    span.set_attributes({
+        "eval.latency_ms": result["latency_ms"],
+        "eval.tokens_used": result["tokens_used"],
+        "eval.cached": bool(result.get("cached")),
+        "eval.attempts": result.get("attempts", 1),
+        **({"eval.ttft_ms": result["ttft_ms"]} if result.get("ttft_ms") is not None else {}),
+    })
+    if result["error"]:
+        span.set_status(Status(StatusCode.ERROR, str(result["error"])))
+    span.end()
+
+def peak_rss_mb(who: str = "self") -> float | None:
+    """Peak resident set size of this process (or its largest reaped child), in MB."""
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class PhaseProfiler:
+    """Wall-clock, CPU and peak-memory timings for the phases of one run.
+
+    CPU time is split between this process and reaped child processes (the
+    ``--workers`` aggregation pool). Peak RSS is a high-water mark, so a
+    phase's ``peak_rss_growth_mb`` is how far it raised the process peak.
+    Each phase is also traced as a span when tracing is configured.
+    """
+
+    def __init__(self):
+        self.phases: list[dict[str, Any]] = []
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.started = (time.perf_counter(), time.process_time(), self.children_cpu_s())
+
+    @staticmethod
+    def children_cpu_s() -> float:
+        times = os.times() # children fields are 0 on Windows
+        return times.children_user + times.children_system
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        before_rss = peak_rss_mb() or 0.0
+        start, cpu, children_cpu = time.perf_counter(), time.process_time(), self.children_cpu_s()
+        try:
+            with trace_span(f"phase.{name}"):
+                yield
+        finally:
+            wall_s = time.perf_counter() - start
+            rss = peak_rss_mb()
+            self.phases.append({
+                "name": name,
+                "wall_s": round(wall_s, 4),
+                "cpu_s": round(time.process_time() - cpu, 4),
+                "children_cpu_s": round(self.children_cpu_s() - children_cpu, 4),
+                "peak_rss_mb": round(rss, 1) if rss is not None else None,
+                "peak_rss_growth_mb": round(rss - before_rss, 1) if rss is not None else None,
+            })
+
+    def summary(self) -> dict[str, Any]:
+        wall, cpu, children_cpu = self.started
+        rss, children_rss = peak_rss_mb(), peak_rss_mb("children")
+        return {
+            "timestamp": self.started_at,
+            "python": sys.version.split()[0],
+            "total_wall_s": round(time.perf_counter() - wall, 4),
+            "total_cpu_s": round(time.process_time() - cpu, 4),
+            "total_children_cpu_s": round(self.children_cpu_s() - children_cpu, 4),
+            "peak_rss_mb": round(rss, 1) if rss is not None else None,
+            "children_peak_rss_mb": round(children_rss, 1) if children_rss is not None else None,
+            "phases": self.phases,
+        }
+
+    def save(self, output_dir: str) -> Path:
+        """Write ``comparison-timing.json`` next to the comparison reports."""
+        path = Path(output_dir) / "comparison-timing.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(), indent=2), encoding="utf-8")
+        return path
+
+    def print_summary(self) -> None:
+        summary = self.summary()
+        print(f"\n{'Phase':<20} {'Wall s':>9} {'CPU s':>9} {'Child CPU s':>12} {'Peak RSS MB':>12}")
+        for p in self.phases:
+            rss = f"{p['peak_rss_mb']:.1f}" if p["peak_rss_mb"] is not None else "n/a"
+            print(f"{p['name']:<20} {p['wall_s']:>9.3f} {p['cpu_s']:>9.3f} {p['children_cpu_s']:>12.3f} {rss:>12}")
+        rss = f"{summary['peak_rss_mb']:.1f}" if summary["peak_rss_mb"] is not None else "n/a"
+        print(f"{'total':<20} {summary['total_wall_s']:>9.3f} {summary['total_cpu_s']:>9.3f} "
+              f"{summary['total_children_cpu_s']:>12.3f} {rss:>12}")
+
+# ---------------------------------------------------------------------------
+# Evaluation runner (requires agent-framework)
+# ---------------------------------------------------------------------------
+
+def chat_client(model: ModelSpec) -> Any:
+    """Chat client for ``model``'s deployment on the FOUNDRY_* endpoint."""
+    try:
+        from agent_framework.openai import OpenAIChatClient
+    except ImportError:
+        print("ERROR: agent-framework not installed. Use --results-dir to compare pre-existing results.", file=sys.stderr)
+        sys.exit(1)
+
+    return OpenAIChatClient(
+        model=model.deployment,
+        api_key=os.getenv("FOUNDRY_API_KEY", ""),
+        endpoint=os.getenv("FOUNDRY_ENDPOINT", ""),
+    )
+
+POOL_KEEPALIVE_S = 60.0 # idle pooled connections are closed after this long
+
+class ClientPool:
+    """Chat clients sharing one keep-alive HTTP connection pool per endpoint.
+
+    Models on the same FOUNDRY_* endpoint reuse the same connections,
+    negotiated over HTTP/2 when the ``h2`` package is installed, so only
+    the first requests to an endpoint pay for DNS, TCP and TLS setup.
+    Clients are cached per deployment. ``aclose`` must run in the event
+    loop that used the pool.
+    """
+
+    def __init__(self, max_keepalive: int = 20):
+        self.max_keepalive = max_keepalive
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self._transports: dict[tuple[str, str], Any] = {}
+        self._clients: dict[tuple[str, str, str], Any] = {}
+
+    def client(self, model: ModelSpec) -> Any:
+        endpoint, api_key = os.getenv("FOUNDRY_ENDPOINT", ""), os.getenv("FOUNDRY_API_KEY", "")
+        key = (endpoint, api_key, model.deployment)
+        if key in self._clients:
+            return self._clients[key]
+        try:
+            import httpx
+            from agent_framework.openai import OpenAIChatClient
+            from openai import AsyncOpenAI
+        except ImportError:
+            print("ERROR: agent-framework not installed. Use --results-dir to compare pre-existing results.", file=sys.stderr)
+            sys.exit(1)
+
+        transport = self._transports.get((endpoint, api_key))
+        if transport is None:
+            transport = self._transports[(endpoint, api_key)] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=endpoint or None,
+                http_client=httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=httpx.Limits(
+                        max_connections=None, # --concurrency bounds the requests in flight
+                        max_keepalive_connections=self.max_keepalive,
+                        keepalive_expiry=POOL_KEEPALIVE_S,
+                    ),
+                ),
+            )
+        self._clients[key] = OpenAIChatClient(model=model.deployment, async_client=transport)
+        return self._clients[key]
+
+    async def aclose(self) -> None:
+        for transport in self._transports.values():
+            await transport.close()
+        self._transports.clear()
+        self._clients.clear()
+
+async def stream_chat(client: Any, messages: list[dict], **options: Any) -> dict:
+    """Consume a streaming chat response, timing each content chunk.
+
+    Returns the response text, total token usage and the streaming metrics
+    recorded per query: time-to-first-token, mean inter-token gap and output
+    tokens/sec over the generation phase (after the first token). ``options``
+    (e.g. ``max_tokens``) are passed to the chat client.
+    """
+    start = time.perf_counter()
+    parts: list[str] = []
+    chunk_times: list[float] = []
+    usage: dict = {}
+
+    async for update in client.get_streaming_response(messages=messages, **options):
+        text = getattr(update, "text", None) or getattr(update, "content", None) or ""
+        if text:
+            chunk_times.append(time.perf_counter())
+            parts.append(text)
+        usage = getattr(update, "usage", None) or usage
+
+    end = time.perf_counter()
+    output_tokens = usage.get("completion_tokens") or len(chunk_times)
+    metrics: dict[str, Any] = {"ttft_ms": None, "inter_token_ms": None, "output_tokens_per_sec": None}
+    if chunk_times:
+        metrics["ttft_ms"] = round((chunk_times[0] - start) * 1000, 1)
+        if len(chunk_times) > 1:
+            metrics["inter_token_ms"] = round(
+                (chunk_times[-1] - chunk_times[0]) * 1000 / (len(chunk_times) - 1), 2
+            )
+        if end > chunk_times[0]:
+            metrics["output_tokens_per_sec"] = round(output_tokens / (end - chunk_times[0]), 1)
+
+    return {
+        "content": "".join(parts),
+        "tokens_used": usage.get("total_tokens", 0),
+        "output_tokens": output_tokens,
+        **usage_split(usage),
+        **metrics,
+    }
+
+def usage_split(usage: dict) -> dict[str, int]:
+    """Prompt/completion token counts from a usage block, when the provider reports them."""
+    return {key: usage[key] for key in ("prompt_tokens", "completion_tokens") if usage.get(key) is not None}
+
+async def run_single_query(
+    client: Any,
+    index: int,
+    item: dict,
+    system_prompt: str,
+    stream: bool = False,
+    max_tokens: int | None = None,
+) -> dict:
+    """Send one dataset item to the model. Returns the per-query result.
+
+    With ``stream``, the streaming chat API is used and the result also
+    carries ``ttft_ms``, ``inter_token_ms``, ``output_tokens`` and
+    ``output_tokens_per_sec``. ``prompt_tokens`` and ``completion_tokens``
+    are included whenever the provider reports them. ``max_tokens`` caps
+    the completion length (the provider default when None).
+    """
+    query = item_query(item)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": query},
+    ]
+    options = {"max_tokens": max_tokens} if max_tokens is not None else {}
+    start = time.perf_counter()
+
+    try:
+        details: dict[str, Any] = {}
+        if stream:
+            details = await stream_chat(client, messages, **options)
+            content = details.pop("content")
+            tokens = details.pop("tokens_used")
+        else:
+            response = await client.chat(messages=messages, **options)
+            content = response.content if hasattr(response, "content") else str(response)
+            usage = getattr(response, "usage", None) or {}
+            tokens = usage.get("total_tokens", 0)
+            details = usage_split(usage)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        return {
+            "index": index,
+            "query": query,
+            "response": content,
+            "expected": item.get("expected_response", item.get("response", "")),
+            "latency_ms": round(elapsed_ms),
+            "tokens_used": tokens,
+            "error": None,
+            **details,
+        }
+    except Exception as e:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return {
+            "index": index,
+            "query": query,
+            "response": "",
+            "expected": item.get("expected_response", ""),
+            "latency_ms": round(elapsed_ms),
+            "tokens_used": 0,
+            "error": str(e),
+            "error_status": error_status(e),
+            "retry_after_s": retry_after_seconds(e),
+        }
+
+# Warm-up requests send a fixed prompt for a one-token reply, so no dataset
+# query is paid for twice; WARMUP_TOKENS bounds their total tokens
+WARMUP_SYSTEM_PROMPT = "Reply with one word."
+WARMUP_ITEM = {"input": "Ready?"}
+WARMUP_MAX_TOKENS = 1
+WARMUP_TOKENS = 32
+
+async def warm_up(
+    client: Any,
+    model: ModelSpec,
+    requests: int,
+    concurrency: int = 1,
+    stream: bool = False,
+    limiter: RateLimiter | None = None,
+    budget: SpendBudget | None = None,
+) -> dict:
+    """Send ``requests`` warm-up requests and discard their results.
+
+    The first request goes out alone and pays connection setup (and any
+    deployment cold start); the rest run up to ``concurrency`` at a time
+    so the pool holds a warm connection per worker before timing starts.
+    Each asks ``WARMUP_ITEM`` for ``WARMUP_MAX_TOKENS`` token. Rate limits
+    and ``budget`` are charged up to ``WARMUP_TOKENS`` per request, which
+    does not feed the estimates used for dataset queries. Returns the
+    ``warmup`` entry of the run summary, or ``{}`` when the spend cap left
+    nothing to send.
+    """
+    gate = asyncio.Semaphore(max(1, concurrency))
+    bound = query_cost(model, {"tokens_used": WARMUP_TOKENS}) or 0.0
+
+    async def send(k: int) -> dict | None:
+        async with gate:
+            reserved = budget.reserve_fixed(bound) if budget else None
+            if budget and reserved is None:
+                return None
+            if limiter:
+                await limiter.acquire(WARMUP_TOKENS)
+            result = await run_single_query(client, k, WARMUP_ITEM, WARMUP_SYSTEM_PROMPT, stream,
+                                            max_tokens=WARMUP_MAX_TOKENS)
+            result["cost_usd"] = query_cost(model, result) or 0.0
+            if reserved is not None:
+                budget.settle(model.name, reserved, result["cost_usd"], observed=False)
+            return result
+
+    first = await send(0)
+    rest = await asyncio.gather(*(send(k) for k in range(1, requests))) if first else []
+    sent = [r for r in [first, *rest] if r is not None]
+    if not sent:
+        return {}
+    latencies = [r["latency_ms"] for r in sent]
+    return {
+        "requests": len(sent),
+        "errors": sum(1 for r in sent if r["error"]),
+        "cold_start_ms": latencies[0],
+        "latency_ms": latencies,
+        **({"cost_usd": round(sum(r["cost_usd"] for r in sent), 6)} if any(r["cost_usd"] for r in sent) else {}),
+    }
+
+async def run_single_model(
+    model: ModelSpec,
+    dataset: Sequence[dict],
+    system_prompt: str,
+    concurrency: int = 1,
+    limiter: RateLimiter | None = None,
+    writer: ResultWriter | None = None,
+    cache: ResponseCache | None = None,
+    stream: bool = False,
+    controller: AdaptiveConcurrency | None = None,
+    hedger: Hedger | None = None,
+    indices: list[int] | None = None,
+    queue: WorkQueue | None = None,
+    stopper: EarlyStopper | None = None,
+    fan_out: dict[int, list[int]] | None = None,
+    budget: SpendBudget | None = None,
+    client: Any = None,
+) -> list[dict]:
+    """Run dataset through a single model. Returns per-query results.
+
+    Up to ``concurrency`` requests are kept in flight, throttled by
+    ``limiter`` when given. With a ``writer``, each result is persisted as
+    soon as it completes and indices the writer already holds are skipped,
+    so only newly-run results are returned. Responses served from ``cache``
+    are marked ``"cached": true``. ``stream`` switches to the streaming chat
+    API to record time-to-first-token and generation throughput. With a
+    ``controller``, ``concurrency`` is only the ceiling: the AIMD controller
+    sets the live in-flight limit, and 429/5xx responses are retried after
+    ``Retry-After`` (or exponential backoff). A ``hedger`` fires a duplicate
+    request for stragglers and records both attempts. ``indices`` restricts
+    the run to those dataset positions (a shard); results keep the original
+    dataset index. With a ``queue``, items are leased from the shared work
+    queue instead, and the call returns once every queued task for the model
+    is done, by this process or another. A ``stopper`` ends the run early,
+    letting in-flight requests finish, once a gate failure is statistically
+    settled. With a ``fan_out`` plan from ``dedupe_plan``, only its keys are
+    sent to the model and each result is copied to the listed duplicate
+    indices with ``dedup_of`` set. Results of a priced model carry
+    ``cost_usd``; a shared ``budget`` is charged for every call, retries and
+    hedges included, and stops new model calls once the run's spend reaches
+    its cap, leaving the rest for a later resume. ``client``
+    (e.g. from a ``ClientPool``) replaces the model's own chat client. Results
+    are returned in dataset order regardless of completion order.
+    """
+    if client is None:
+        client = chat_client(model)
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    results: dict[int, dict] = {}
+    if queue:
+        todo = []
+        completed, total = queue.progress(model.name)
+    else:
+        done = writer.done_indices if writer else set()
+        selected = range(len(dataset)) if indices is None else indices
+        if fan_out is not None:
+            # Duplicates are filled in from their evaluated twin, unless a crash
+            # left the twin done without its copies; then they are run directly
+            twin = {d: i for i, duplicates in fan_out.items() for d in duplicates}
+            selected = [i for i in selected if i not in twin or (twin[i] in done and i not in done)]
+        total = len(selected)
+        todo = [(i, dataset[i]) for i in selected if i not in done]
+        completed = total - len(todo)
+    pending = iter(todo)
+    spent_usd = 0.0
+    if completed:
+        print(f" [{model.name}] Resuming: {completed}/{total} queries already complete")
+
+    async def claim() -> tuple[int, dict] | None:
+        if stopper and stopper.verdict:
+            return None
+        if not queue:
+            return next(pending, None)
+        while True:
+            i = queue.lease(model.name, worker_id)
+            if i is not None:
+                return i, dataset[i]
+            done_count, queued = queue.progress(model.name)
+            if done_count == queued:
+                return None
+            # Other workers hold the remaining leases; wait for them to finish or expire
+            await asyncio.sleep(QUEUE_POLL_SECONDS)
+
+    def persist(record: dict) -> None:
+        records = [record]
+        for d in (fan_out or {}).get(record["index"], []):
+            if writer and d in writer.done_indices:
+                continue
+            copy = {key: value for key, value in record.items() if key not in ("hedge", "attempts")}
+            copy.update(
+                index=d,
+                expected=dataset[d].get("expected_response", dataset[d].get("response", "")),
+                dedup_of=record["index"],
+            )
+            results[d] = copy
+            records.append(copy)
+        if writer:
+            for r in records:
+                writer.write(r)
+        if queue:
+            queue.complete(model.name, record["index"])
+
+    async def call(i: int, item: dict, reserved: float | None) -> dict:
+        """One model call, priced and settled against its budget reservation (kept if cancelled)."""
+        nonlocal spent_usd
+        result = None
+        try:
+            result = await run_single_query(client, i, item, system_prompt, stream)
+            return result
+        finally:
+            cost = query_cost(model, result) if result else None
+            if cost is not None:
+                result["cost_usd"] = round(cost, 8)
+                spent_usd += cost
+            if reserved is not None:
+                budget.settle(model.name, reserved, reserved if result is None else cost or 0.0,
+                              observed=result is not None and not result.get("error"))
+
+    def admit_hedge(i: int, item: dict) -> Callable[[], Any] | None:
+        """Claim budget, a rate-limit token and an AIMD slot for a hedge now, or None if any is short."""
+        reserved = budget.try_reserve(model.name) if budget else None
+        if budget and reserved is None:
+            return None
+        estimate = limiter.estimate_tokens(system_prompt + item_query(item)) if limiter else 0
+        if limiter and not limiter.try_acquire(estimate):
+            if budget:
+                budget.release(reserved)
+            return None
+        if controller and not controller.try_acquire():
+            if limiter:
+                limiter.refund(estimate)
+            if budget:
+                budget.release(reserved)
+            return None
+
+        async def send() -> dict:
+            result = None
+            try:
+                result = await call(i, item, reserved)
+                return result
+            finally:
+                if limiter:
+                    limiter.settle(estimate, result["tokens_used"] if result else 0)
+                if controller:
+                    await controller.release(result or {"error": "cancelled"})
+        return send
+
+    async def worker() -> None:
+        nonlocal completed, spent_usd
+        # Workers share one claim source, so each item is claimed exactly once
+        while (claimed := await claim()) is not None:
+            i, item = claimed
+            query = item_query(item)
+            finisher = None
+            reserved = None
+            cache_key = ResponseCache.key(model.deployment, system_prompt, query) if cache else ""
+            hit = cache.get(cache_key) if cache else None
+            if hit is None and budget:
+                reserved = await budget.reserve(model.name)
+                if reserved is None:
+                    # The claimed item stays undone: a resume (or an expired queue lease) picks it up
+                    if model.name not in budget.stopped:
+                        budget.stopped.add(model.name)
+                        print(f" [{model.name}] Spend cap ${budget.limit_usd:.2f} reached "
+                              f"(${budget.spent_usd:.4f} spent); no new queries scheduled")
+                    return
+            query_span = start_span("evaluate.query", {"eval.model": model.name, "eval.index": i})
+            if hit is not None:
+                results[i] = {
+                    "index": i,
+                    "query": query,
+                    "response": hit["response"],
+                    "expected": item.get("expected_response", item.get("response", "")),
+                    "latency_ms": hit["latency_ms"],
+                    "tokens_used": hit["tokens_used"],
+                    **usage_split(hit),
+                    "error": None,
+                    "cached": True,
+                }
+            else:
+                attempt = 0
+                while True:
+                    attempt += 1
+                    if attempt > 1 and budget:
+                        reserved = await budget.reserve(model.name)
+                        if reserved is None:
+                            break # no budget left to retry; keep the failed result
+                    if limiter:
+                        estimate = limiter.estimate_tokens(system_prompt + query)
+                        await limiter.acquire(estimate)
+                    if controller:
+                        await controller.acquire()
+                    if hedger:
+                        results[i], finisher = await hedger.run(
+                            lambda reserved=reserved: call(i, item, reserved),
+                            admit=lambda: admit_hedge(i, item),
+                        )
+                    else:
+                        results[i] = await call(i, item, reserved)
+                    reserved = None # settled by call
+                    if limiter:
+                        limiter.settle(estimate, results[i]["tokens_used"])
+                    if not controller:
+                        break
+                    retry_after = results[i].get("retry_after_s")
+                    await controller.release(results[i], retry_after)
+                    if not is_retryable(results[i]) or attempt > controller.max_retries:
+                        break
+                    await asyncio.sleep(controller.backoff_seconds(attempt, retry_after))
+                if attempt > 1:
+                    results[i]["attempts"] = attempt
+                if cache and not results[i]["error"]:
+                    cache.put(cache_key, {
+                        "response": results[i]["response"],
+                        "latency_ms": results[i]["latency_ms"],
+                        "tokens_used": results[i]["tokens_used"],
+                        **usage_split(results[i]),
+                    })
+            if hit is not None:
+                # Priced at the call it reuses, for cost per 1k; nothing was spent
+                cost = query_cost(model, results[i])
+                if cost is not None:
+                    results[i]["cost_usd"] = round(cost, 8)
+            end_span(query_span, results[i])
+            if stopper and not stopper.verdict and stopper.add(results[i]):
+                verdict = stopper.verdict
+                verdict["planned_queries"] = total
+                print(f" [{model.name}] Stopping early after {verdict['after_queries']}/{total} queries: "
+                      f"{verdict['metric']} upper bound {verdict['upper_bound']:.3f} < {verdict['threshold']} "
+                      f"({verdict['confidence']:.0%} confidence)")
+                if queue:
+                    queue.cancel(model.name)
+            if finisher:
+                # Persist the hedged record once the losing attempt reports back
+                finisher.add_done_callback(lambda _, record=results[i]: persist(record))
+            else:
+                persist(results[i])
+            completed += 1
+
+            # Progress
+            if completed % 10 == 0 or completed == total:
+                spend = f", ${spent_usd:.4f} spent" if "cost_usd" in results[i] else ""
+                print(f" [{model.name}] {completed}/{total} queries complete{spend}")
+
+    workers = concurrency if queue else max(1, min(concurrency, len(todo)))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if hedger:
+        # Give losing attempts about one more hedge delay to report back
+        await hedger.drain((hedger.delay_ms() or 0) / 1000 + 1.0)
+
+    return [results[i] for i in sorted(results)]
+
+async def run_all_models(
+    models: list[ModelSpec],
+    dataset: Sequence[dict],
+    output_dir: Path,
+    system_prompt: str = "You are a helpful assistant.",
+    concurrency: int = 1,
+    parallel_models: bool = True,
+    fresh: bool = False,
+    cache: ResponseCache | None = None,
+    stream: bool = False,
+    adaptive: bool = False,
+    hedge: dict | None = None,
+    shard: tuple[int, int] | None = None,
+    queue: WorkQueue | None = None,
+    coordinate: bool = True,
+    early_stop: dict | None = None,
+    dedupe: int = 0,
+    budget: SpendBudget | None = None,
+    warmup: int = 0,
+) -> None:
+    """Run evaluation for all models and save results.
+
+    Models are evaluated at the same time by default, each throttled by the
+    rate limiter of its provider deployment, so total wall-clock time tracks
+    the slowest model rather than the sum of all models. Results stream to
+    ``<model>.jsonl`` as they complete; an interrupted run resumes where it
+    stopped unless ``fresh`` is set. With ``adaptive``, each model gets an
+    AIMD controller capped at ``concurrency`` and its limit timeline is
+    saved in the run summary. ``hedge`` holds ``Hedger`` keyword arguments
+    to enable request hedging per model. ``shard`` = ``(i, N)`` runs only the
+    i-th of N stratified shards and writes ``<model>.shard-i-of-N.jsonl``
+    for the ``merge`` subcommand.
+
+    With a ``queue``, this process pulls leased queries alongside any other
+    worker processes and writes ``workers/<model>.<worker>.jsonl``. When
+    ``coordinate`` is set it also enqueues the dataset first, waits for the
+    queue to drain, and merges the worker files into ``<model>.jsonl``.
+
+    ``early_stop`` holds ``EarlyStopper`` keyword arguments; a model whose
+    gate failure is settled stops early and records the verdict in its run
+    summary. Resuming such a file does not restart the model.
+
+    ``dedupe`` = k > 0 evaluates each unique query at most k times and fans
+    the results out to its duplicates; the calls saved are printed and
+    reported.
+
+    A ``budget`` caps the spend of all models together; each run summary
+    records the model's spend, and ``budget_stop`` when the cap ended it.
+
+    Models on the same endpoint share a ``ClientPool``. ``warmup`` requests
+    per model (see ``warm_up``) are sent before timing starts, unless no
+    query will reach the model; their results are discarded, their cost is
+    charged to ``budget`` and the run's spend, and their latencies are
+    recorded as ``warmup`` in the run summary, to report cold start
+    separately from steady-state latency.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if budget:
+        for model in models:
+            if model.input_cost_per_1m is None and model.output_cost_per_1m is None:
+                print(f"WARNING: {model.name} has no pricing entry; --max-spend cannot limit it", file=sys.stderr)
+    limiters = build_rate_limiters(models)
+    dataset_sha256 = dataset_fingerprint(dataset)
+    indices = shard_indices(dataset, *shard) if shard else None
+    shard_meta = {}
+    suffix = ""
+    if shard:
+        shard_meta = {"shard": {"index": shard[0], "count": shard[1]}, "total_dataset_size": len(dataset)}
+        suffix = f".shard-{shard[0]}-of-{shard[1]}"
+        print(f" Shard {shard[0]}/{shard[1]}: {len(indices)} of {len(dataset)} queries")
+
+    selected = indices if shard else list(range(len(dataset)))
+    fan_out = dedupe_plan(dataset, selected, dedupe) if dedupe > 0 else None
+    if fan_out is not None:
+        print(f" De-duplication: {len(fan_out)} of {len(selected)} queries need a model call "
+              f"({len(selected) - len(fan_out)} duplicates reuse a result)")
+
+    attempts = 2 if hedge is not None else 1 # a hedged query holds a second connection
+    pool = ClientPool(max_keepalive=concurrency * attempts * len(models))
+    print(f" Client pool: keep-alive, {'HTTP/2' if pool.http2 else 'HTTP/1.1 (pip install h2 for HTTP/2)'}")
+
+    worker_dir = output_dir / "workers"
+    if queue:
+        worker_dir.mkdir(exist_ok=True)
+        if coordinate and fresh:
+            queue.reset()
+            for stale in worker_dir.glob("*.jsonl"):
+                stale.unlink()
+        queue.bind_dataset(len(dataset), run_fingerprint(
+            dataset_sha256, system_prompt, deployments={model.name: model.deployment for model in models},
+        ))
+        if coordinate:
+            for model in models:
+                added = queue.enqueue(model.name, list(fan_out) if fan_out is not None else selected)
+                print(f" Queued {added} new tasks for {model.name}")
+        shard_meta = {"total_dataset_size": len(indices) if shard else len(dataset)}
+        suffix = f".{socket.gethostname()}-{os.getpid()}"
+
+    async def evaluate(model: ModelSpec) -> None:
+        print(f"\n{'='*60}")
+        print(f" Evaluating: {model.name} ({model.role})")
+        print(f"{'='*60}")
+
+        output_file = (worker_dir if queue else output_dir) / f"{result_file_name(model)}{suffix}.jsonl"
+        writer = ResultWriter(output_file, {
+            "model": model.name,
+            "role": model.role,
+            "provider": model.provider,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "dataset_size": len(indices) if shard else len(dataset),
+            "fingerprint": run_fingerprint(dataset_sha256, system_prompt, deployment=model.deployment),
+            **shard_meta,
+        }, fresh=fresh)
+
+        previous_stop = writer.existing.get("run", {}).get("early_stop")
+        if early_stop is not None and previous_stop:
+            print(f" [{model.name}] Already stopped early after {previous_stop['after_queries']} queries; "
+                  f"use --fresh to run it again")
+            writer.close()
+            return
+
+        client = pool.client(model)
+        warmed = {}
+
+        def reaches_model(i: int) -> bool:
+            if i in writer.done_indices:
+                return False
+            return not (cache and cache.get(ResponseCache.key(model.deployment, system_prompt, item_query(dataset[i]))))
+
+        # Skip warm-up when no query will reach the model; the scan stops at the first that will
+        if warmup > 0 and any(reaches_model(i) for i in (fan_out if fan_out is not None else selected)):
+            limiter = limiters.get((model.provider, model.deployment))
+            warmed = await warm_up(client, model, warmup, concurrency, stream, limiter, budget)
+            if warmed:
+                steady = warmed["latency_ms"][1:]
+                after = f", then avg {sum(steady) / len(steady):.0f}ms" if steady else ""
+                print(f" [{model.name}] Warm-up: {warmed['requests']} requests, cold start "
+                      f"{warmed['cold_start_ms']}ms{after} (excluded from results)")
+
+        controller = AdaptiveConcurrency(max_limit=concurrency) if adaptive else None
+        hedger = Hedger(**hedge) if hedge is not None else None
+        stopper = EarlyStopper(**early_stop) if early_stop is not None else None
+        start = time.perf_counter()
+        with trace_span("evaluate.model", {"eval.model": model.name, "eval.role": model.role}):
+            try:
+                results = await run_single_model(
+                    model, dataset, system_prompt, concurrency,
+                    limiter=limiters.get((model.provider, model.deployment)),
+                    writer=writer,
+                    cache=cache,
+                    stream=stream,
+                    controller=controller,
+                    hedger=hedger,
+                    indices=indices,
+                    queue=queue,
+                    stopper=stopper,
+                    fan_out=fan_out,
+                    budget=budget,
+                    client=client,
+                )
+            except BaseException:
+                writer.close()
+                raise
+        wall_clock_s = time.perf_counter() - start
+        queries_per_sec = len(results) / wall_clock_s if wall_clock_s > 0 else 0.0
+        spent_usd = sum(result_spend(r) for r in results) + warmed.get("cost_usd", 0.0)
+        print(f" [{model.name}] {len(results)} queries in {wall_clock_s:.1f}s "
+              f"({queries_per_sec:.2f} queries/sec, concurrency={concurrency})")
+        budget_stop = None
+        if budget and model.name in budget.stopped:
+            budget_stop = {
+                "limit_usd": budget.limit_usd,
+                "run_spent_usd": round(budget.spent_usd, 6),
+                "after_queries": len(writer.done_indices),
+            }
+
+        writer.close({
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "queries_run": len(results),
+            "concurrency": concurrency,
+            "wall_clock_s": round(wall_clock_s, 3),
+            "queries_per_sec": round(queries_per_sec, 3),
+            **({"concurrency_timeline": controller.timeline} if controller else {}),
+            **({"hedges_fired": hedger.hedges} if hedger else {}),
+            **({"hedges_skipped": hedger.skipped} if hedger and hedger.skipped else {}),
+            **({"early_stop": stopper.verdict} if stopper and stopper.verdict else {}),
+            **({"spent_usd": round(spent_usd, 6)} if spent_usd else {}),
+            **({"budget_stop": budget_stop} if budget_stop else {}),
+            **({"warmup": warmed} if warmed else {}),
+        })
+        if controller:
+            peak = max(entry["limit"] for entry in controller.timeline)
+            print(f" [{model.name}] Adaptive concurrency: final limit {int(controller.limit)}, "
+                  f"peak {peak}, {len(controller.timeline) - 1} adjustments")
+        print(f" Saved: {output_file}")
+
+        if queue and coordinate:
+            merge_result_files(sorted(worker_dir.glob(f"{result_file_name(model)}.*.jsonl")), output_dir, {
+                "wall_clock_s": round(wall_clock_s, 3),
+                "coordinator_queries_run": len(results),
+            })
+
+    try:
+        if parallel_models:
+            await asyncio.gather(*(evaluate(model) for model in models))
+        else:
+            for model in models:
+                await evaluate(model)
+    finally:
+        await pool.aclose()
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+
+BATCH_TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+def build_batch_requests(
+    model: ModelSpec,
+    dataset: Sequence[dict],
+    indices: list[int],
+    system_prompt: str,
+) -> Iterator[dict]:
+    """OpenAI batch input lines, one chat completion per dataset index."""
+    for i in indices:
+        yield {
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model.deployment,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": item_query(dataset[i])},
+                ],
+            },
+        }
+
+def batch_output_result(line: dict, dataset: Sequence[dict], model: ModelSpec | None = None) -> dict:
+    """Convert one batch output (or error) line into a per-query result.
+
+    Results of a priced ``model`` carry ``cost_usd`` at the batch price
+    (``BATCH_PRICE_FACTOR`` times list price).
+    """
+    index = int(line["custom_id"])
+    item = dataset[index]
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    status = response.get("status_code", 200)
+    if line.get("error") or status != 200:
+        error = line.get("error") or body.get("error") or {}
+        return {
+            "index": index,
+            "query": item_query(item),
+            "response": "",
+            "expected": item.get("expected_response", ""),
+            "latency_ms": 0,
+            "tokens_used": 0,
+            "error": error.get("message") or f"HTTP {status}",
+            "error_status": status if status != 200 else None,
+            "batch": True,
+        }
+    usage = body.get("usage") or {}
+    result = {
+        "index": index,
+        "query": item_query(item),
+        "response": body["choices"][0]["message"]["content"] or "",
+        "expected": item.get("expected_response", item.get("response", "")),
+        "latency_ms": 0,
+        "tokens_used": usage.get("total_tokens", 0),
+        **usage_split(usage),
+        "error": None,
+        "batch": True,
+    }
+    cost = query_cost(model, result) if model else None
+    if cost is not None:
+        result["cost_usd"] = round(cost * BATCH_PRICE_FACTOR, 8)
+    return result
+
+def write_json_atomic(path: Path, value: dict) -> None:
+    """Replace ``path`` so concurrent readers never see a half-written file."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(value), encoding="utf-8")
+    os.replace(tmp, path)
+
+class FileBatchClient:
+    """Batch client for the local file-based stand-in (mock-batch-service.py).
+
+    Each batch is a directory ``<root>/<batch_id>/`` holding ``input.jsonl``
+    (written here), ``status.json`` (created here, then advanced by the
+    service) and ``output.jsonl`` (written by the service on completion).
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        root.mkdir(parents=True, exist_ok=True)
+
+    def submit(self, input_path: Path) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+        batch_dir = self.root / batch_id
+        batch_dir.mkdir()
+        shutil.copyfile(input_path, batch_dir / "input.jsonl")
+        # status.json goes last: the service only picks up batches that have one
+        write_json_atomic(batch_dir / "status.json", {
+            "id": batch_id,
+            "status": "validating",
+            "created_at": time.time(),
+        })
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> dict:
+        with open(self.root / batch_id / "status.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def output_lines(self, batch_id: str) -> Iterator[str]:
+        output = self.root / batch_id / "output.jsonl"
+        if output.exists():
+            with open(output, encoding="utf-8") as f:
+                yield from f
+
+class OpenAIBatchClient:
+    """Batch client for the OpenAI-compatible batch API at ``FOUNDRY_ENDPOINT``."""
+
+    def __init__(self):
+        try:
+            from openai import OpenAI
+        except ImportError:
+            print("ERROR: openai package required for --mode batch. Install: pip install openai "
+                  "(or use --batch-dir with mock-batch-service.py)", file=sys.stderr)
+            sys.exit(1)
+        self._client = OpenAI(
+            api_key=os.getenv("FOUNDRY_API_KEY", ""),
+            base_url=os.getenv("FOUNDRY_ENDPOINT") or None,
+        )
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self._client.files.create(file=f, purpose="batch")
+        batch = self._client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> dict:
+        batch = self._client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            "id": batch.id,
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "request_counts": (
+                {"total": counts.total, "completed": counts.completed, "failed": counts.failed} if counts else {}
+            ),
+        }
+
+    def output_lines(self, batch_id: str) -> Iterator[str]:
+        batch = self.retrieve(batch_id)
+        # Failed requests are reported in a separate error file
+        for file_id in (batch["output_file_id"], batch["error_file_id"]):
+            if file_id:
+                yield from self._client.files.content(file_id).text.splitlines()
+
+async def run_batch_models(
+    models: list[ModelSpec],
+    dataset: Sequence[dict],
+    output_dir: Path,
+    client: FileBatchClient | OpenAIBatchClient,
+    system_prompt: str = "You are a helpful assistant.",
+    poll_seconds: float = 30.0,
+    fresh: bool = False,
+) -> None:
+    """Evaluate every model through a batch API and save standard result files.
+
+    Each model's pending queries are written to ``batches/<model>.input.jsonl``
+    and submitted as one batch; all batches are then polled together until
+    they finish, and their output is appended to ``<model>.jsonl`` like an
+    interactive run. The batch id is kept in ``batches/<model>.batch.json``
+    until ingested, so an interrupted run resumes polling instead of paying
+    for a second batch. Results carry ``"batch": true`` and are excluded
+    from latency statistics; those of priced models are costed at the
+    batch price.
+    """
+    batch_dir = output_dir / "batches"
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    dataset_sha256 = dataset_fingerprint(dataset)
+
+    async def evaluate(model: ModelSpec) -> None:
+        stem = result_file_name(model)
+        output_file = output_dir / f"{stem}.jsonl"
+        writer = ResultWriter(output_file, {
+            "model": model.name,
+            "role": model.role,
+            "provider": model.provider,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "dataset_size": len(dataset),
+            "fingerprint": run_fingerprint(dataset_sha256, system_prompt, deployment=model.deployment),
+            "mode": "batch",
+        }, fresh=fresh)
+        state_path = batch_dir / f"{stem}.batch.json"
+        start = time.perf_counter()
+
+        if state_path.exists() and not fresh:
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+            print(f" [{model.name}] Resuming batch {state['batch_id']} ({state['requests']} requests)")
+        else:
+            todo = [i for i in range(len(dataset)) if i not in writer.done_indices]
+            if not todo:
+                print(f" [{model.name}] All {len(dataset)} queries already complete")
+                writer.close()
+                return
+            input_path = batch_dir / f"{stem}.input.jsonl"
+            with open(input_path, "w", encoding="utf-8") as f:
+                for request in build_batch_requests(model, dataset, todo, system_prompt):
+                    f.write(json.dumps(request) + "\n")
+            batch_id = await asyncio.to_thread(client.submit, input_path)
+            state = {
+                "batch_id": batch_id,
+                "submitted_at": datetime.now(timezone.utc).isoformat(),
+                "requests": len(todo),
+            }
+            write_json_atomic(state_path, state)
+            print(f" [{model.name}] Submitted batch {batch_id} ({len(todo)} requests)")
+
+        while True:
+            status = await asyncio.to_thread(client.retrieve, state["batch_id"])
+            if status["status"] in BATCH_TERMINAL_STATES:
+                break
+            counts = status.get("request_counts") or {}
+            progress = f" {counts.get('completed', 0)}/{counts['total']}" if counts.get("total") else ""
+            print(f" [{model.name}] Batch {state['batch_id']}: {status['status']}{progress}")
+            await asyncio.sleep(poll_seconds)
+
+        ingested, spent_usd = 0, 0.0
+        try:
+            for line in client.output_lines(state["batch_id"]):
+                if not line.strip():
+                    continue
+                result = batch_output_result(json.loads(line), dataset, model)
+                if result["index"] not in writer.done_indices:
+                    writer.write(result)
+                    ingested += 1
+                    spent_usd += result.get("cost_usd", 0.0)
+        except BaseException:
+            writer.close()
+            raise
+        wall_clock_s = time.perf_counter() - start
+
+        writer.close({
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "mode": "batch",
+            "batch_id": state["batch_id"],
+            "batch_status": status["status"],
+            "queries_run": ingested,
+            **({"spent_usd": round(spent_usd, 6)} if spent_usd else {}),
+            "wall_clock_s": round(wall_clock_s, 3),
+        })
+        state_path.unlink()
+        if status["status"] != "completed" or ingested < state["requests"]:
+            print(f"WARNING: [{model.name}] Batch {state['batch_id']} {status['status']} with "
+                  f"{ingested}/{state['requests']} results; rerun to resubmit the rest", file=sys.stderr)
+        print(f" [{model.name}] {ingested} batch results in {wall_clock_s:.1f}s")
+        print(f" Saved: {output_file}")
+
+    await asyncio.gather(*(evaluate(model) for model in models))
+
+# ---------------------------------------------------------------------------
+# Load test (open loop)
+# ---------------------------------------------------------------------------
+
+ARRIVAL_PATTERNS = ("constant", "poisson", "ramp")
+
+# A step is saturated when it delivers less than this share of the offered
+# rate, fails more often than this, or its p95 exceeds the lightest step's p95
+# by this factor
+SATURATION_THROUGHPUT_RATIO = 0.9
+SATURATION_ERROR_RATE = 0.05
+SATURATION_LATENCY_FACTOR = 2.0
+
+def parse_rates(spec: str) -> list[float]:
+    """Parse a comma-separated list of positive requests/sec, e.g. ``1,2,4,8``."""
+    try:
+        rates = [float(part) for part in spec.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid --rates {spec!r}: expected comma-separated numbers") from None
+    if not rates or any(rate <= 0 for rate in rates):
+        raise ValueError(f"Invalid --rates {spec!r}: rates must be positive")
+    return rates
+
+def arrival_offsets(
+    rate: float,
+    duration_s: float,
+    pattern: str,
+    start_rate: float = 0.0,
+    rng: random.Random | None = None,
+) -> list[float]:
+    """Send times, in seconds from the start of a step, for one arrival pattern.
+
+    ``constant`` spaces requests evenly at ``rate``; ``poisson`` draws
+    exponential gaps with mean ``1 / rate``; ``ramp`` raises the rate
+    linearly from ``start_rate`` to ``rate`` across the step.
+    """
+    if pattern == "constant":
+        return [k / rate for k in range(int(rate * duration_s))]
+    if pattern == "poisson":
+        rng = rng or random.Random()
+        offsets, t = [], rng.expovariate(rate)
+        while t < duration_s:
+            offsets.append(t)
+            t += rng.expovariate(rate)
+        return offsets
+    # Ramp: the k-th request goes out when the cumulative expected count
+    # start_rate * t + slope * t^2 / 2 reaches k
+    slope = (rate - start_rate) / duration_s
+    expected = int(start_rate * duration_s + slope * duration_s ** 2 / 2)
+    if slope == 0:
+        return [k / rate for k in range(expected)]
+    return [(-start_rate + math.sqrt(start_rate ** 2 + 2 * slope * k)) / slope for k in range(expected)]
+
+async def run_load_test(
+    model: ModelSpec,
+    dataset: Sequence[dict],
+    system_prompt: str,
+    rates: list[float],
+    step_seconds: float = 30.0,
+    arrival: str = "poisson",
+    max_in_flight: int = 256,
+    drain_seconds: float = 30.0,
+    seed: int | None = None,
+    stream: bool = False,
+    warmup: int = 0,
+) -> tuple[list[LoadStep], dict]:
+    """Replay dataset queries at each target rate in turn, open loop.
+
+    Requests are sent on the arrival schedule whether or not earlier ones
+    have completed, so a saturated deployment shows up as growing latency,
+    errors or a throughput shortfall instead of silently slowing the load
+    down. Steps follow each other without a pause. Latency is measured from
+    the scheduled send time. Requests still outstanding ``drain_seconds``
+    after the last step are cancelled and counted as errors. Client-side rate
+    limits from the model config are deliberately not applied.
+
+    Requests go through a ``ClientPool`` as in comparison runs, and
+    ``warmup`` requests are sent before the first step, so step latencies
+    are steady-state and comparable with a comparison report. Returns the
+    steps and the warm-up summary (``{}`` without warm-up).
+    """
+    pool = ClientPool(max_keepalive=max_in_flight)
+    try:
+        client = pool.client(model)
+        warmed = {}
+        if warmup > 0:
+            warmed = await warm_up(client, model, warmup, stream=stream)
+            if warmed:
+                print(f" [{model.name}] Warm-up: {warmed['requests']} requests, cold start {warmed['cold_start_ms']}ms")
+        return await _run_load_steps(
+            client, model, dataset, system_prompt, rates, step_seconds, arrival, max_in_flight,
+            drain_seconds, seed, stream,
+        ), warmed
+    finally:
+        await pool.aclose()
+
+async def _run_load_steps(
+    client: Any,
+    model: ModelSpec,
+    dataset: Sequence[dict],
+    system_prompt: str,
+    rates: list[float],
+    step_seconds: float,
+    arrival: str,
+    max_in_flight: int,
+    drain_seconds: float,
+    seed: int | None,
+    stream: bool,
+) -> list[LoadStep]:
+    rng = random.Random(seed)
+    items = itertools.cycle(list(enumerate(dataset)))
+    # Per step: (scheduled, finished, ok) for every answered request
+    outcomes: list[list[tuple[float, float, bool]]] = [[] for _ in rates]
+    steps = [LoadStep(target_qps=rate) for rate in rates]
+    lags: list[float] = [0.0 for _ in rates]
+    in_flight: set[asyncio.Task] = set()
+
+    async def fire(step: int, scheduled: float, index: int, item: dict) -> None:
+        result = await run_single_query(client, index, item, system_prompt, stream)
+        outcomes[step].append((scheduled, time.perf_counter(), result["error"] is None))
+
+    start = time.perf_counter()
+    previous_rate = 0.0
+    for step, rate in enumerate(rates):
+        step_start = start + step * step_seconds
+        offsets = arrival_offsets(rate, step_seconds, arrival, previous_rate, rng)
+        steps[step].offered_qps = round(len(offsets) / step_seconds, 3)
+        for offset in offsets:
+            scheduled = step_start + offset
+            # Always yield, so responses are collected even when sends fall behind
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            if len(in_flight) >= max_in_flight:
+                steps[step].dropped += 1
+                continue
+            lags[step] += time.perf_counter() - scheduled
+            index, item = next(items)
+            task = asyncio.create_task(fire(step, scheduled, index, item))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            steps[step].sent += 1
+        await asyncio.sleep(max(0.0, step_start + step_seconds - time.perf_counter()))
+        previous_rate = rate
+        print(f" [{model.name}] {rate:g} req/s: sent {steps[step].sent}, "
+              f"dropped {steps[step].dropped}, {len(in_flight)} in flight")
+
+    if in_flight:
+        _, unanswered = await asyncio.wait(set(in_flight), timeout=drain_seconds)
+        for task in unanswered:
+            task.cancel()
+        await asyncio.gather(*unanswered, return_exceptions=True)
+        if unanswered:
+            print(f" [{model.name}] {len(unanswered)} requests unanswered after {drain_seconds:g}s drain")
+
+    completions = sorted(finished for step_outcomes in outcomes for _, finished, ok in step_outcomes if ok)
+    for step, load_step in enumerate(steps):
+        window_start = start + step * step_seconds
+        window_end = window_start + step_seconds
+        sketch = LatencySketch()
+        failed = 0
+        for scheduled, finished, ok in outcomes[step]:
+            sketch.add((finished - scheduled) * 1000)
+            failed += not ok
+        delivered = sum(window_start <= finished < window_end for finished in completions)
+        load_step.errors = failed + load_step.sent - len(outcomes[step])
+        load_step.error_rate = round(load_step.errors / load_step.sent, 4) if load_step.sent else 0.0
+        load_step.achieved_qps = round(delivered / step_seconds, 3)
+        load_step.mean_send_lag_ms = round(lags[step] * 1000 / load_step.sent, 2) if load_step.sent else 0.0
+        fields = latency_fields(sketch)
+        for name in ("p50_latency_ms", "p90_latency_ms", "p95_latency_ms", "p99_latency_ms", "max_latency_ms"):
+            setattr(load_step, name, fields[name])
+    mark_saturation(steps)
+    return steps
+
+def mark_saturation(steps: list[LoadStep]) -> None:
+    """Flag steps past the deployment's capacity, with the reasons why."""
+    answered = [s for s in steps if s.sent]
+    reference_p95 = min((s.p95_latency_ms for s in answered if s.p95_latency_ms > 0), default=0.0)
+    for s in steps:
+        reasons = []
+        if s.dropped:
+            reasons.append(f"{s.dropped} dropped at the in-flight cap")
+        if s.offered_qps and s.achieved_qps < SATURATION_THROUGHPUT_RATIO * s.offered_qps:
+            reasons.append(f"throughput {s.achieved_qps:g} < {SATURATION_THROUGHPUT_RATIO:.0%} of offered")
+        if s.error_rate > SATURATION_ERROR_RATE:
+            reasons.append(f"error rate {s.error_rate:.1%}")
+        if reference_p95 and s.p95_latency_ms > SATURATION_LATENCY_FACTOR * reference_p95:
+            reasons.append(f"p95 {s.p95_latency_ms:.0f}ms > {SATURATION_LATENCY_FACTOR:g}x {reference_p95:.0f}ms")
+        s.saturated = bool(reasons)
+        s.saturation_reasons = reasons
+
+def sustainable_qps(steps: list[LoadStep]) -> float:
+    """Highest target rate reached before the first saturated step (0 if the first is)."""
+    capacity = 0.0
+    for s in sorted(steps, key=lambda s: s.target_qps):
+        if s.saturated:
+            break
+        capacity = s.target_qps
+    return capacity
+
+def generate_loadtest_markdown(report: dict) -> str:
+    """Saturation curve per model as Markdown tables."""
+    lines = [
+        "# Load Test: Saturation Curves",
+        "",
+        f"**Date**: {report['timestamp']}",
+        f"**Arrival**: {report['arrival']}, {report['step_seconds']:g}s per step",
+        "",
+    ]
+    for model in report["models"]:
+        lines += [
+            f"## {model['name']} ({model['role']})",
+            "",
+            f"**Sustainable throughput**: {model['sustainable_qps']:g} req/s",
+            "",
+        ]
+        warmed = model.get("warmup")
+        if warmed:
+            lines += [
+                f"**Cold start**: {warmed['cold_start_ms']}ms, then {warmed['requests']} warm-up requests "
+                f"averaging {sum(warmed['latency_ms']) / len(warmed['latency_ms']):.0f}ms (excluded from the steps)",
+                "",
+            ]
+        lines += [
+            "| Target req/s | Offered | Achieved | Error Rate | p50 ms | p95 ms | p99 ms | Send Lag ms | Saturated |",
+            "|-------------:|--------:|---------:|-----------:|-------:|-------:|-------:|------------:|-----------|",
+        ]
+        for s in model["steps"]:
+            lines.append(
+                f"| {s['target_qps']:g} | {s['offered_qps']:.2f} | {s['achieved_qps']:.2f} | "
+                f"{s['error_rate']:.1%} | {s['p50_latency_ms']:.0f} | {s['p95_latency_ms']:.0f} | "
+                f"{s['p99_latency_ms']:.0f} | {s['mean_send_lag_ms']:.1f} | "
+                f"{'; '.join(s['saturation_reasons']) if s['saturated'] else 'no'} |"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+# ---------------------------------------------------------------------------
+# LLM-as-judge scoring (requires agent-framework)
+# ---------------------------------------------------------------------------
+
+# ModelResult fields filled from the rubric of the same name and then gated
+JUDGED_FIELDS = ("coherence", "relevance", "tool_accuracy")
+JUDGE_MAX_CHARS = 4000 # per query/expected/response in the judge prompt
+JUDGE_MAX_RETRIES = 2 # re-asks per batch for items the judge missed (halving once per retry)
+JUDGE_ERROR_TTL_SECONDS = 3600.0 # how long a failed judgement is cached before it is retried
+
+JUDGE_SYSTEM_PROMPT = (
+    "You are a strict, consistent evaluation judge. Score every numbered item against the rubric "
+    "using only the allowed scores. Reply with only a JSON array containing one object per item: "
+    '{"id": <item number>, "score": <number>, "reason": "<one short sentence>"}.'
+)
+
+def load_rubrics(rubrics_dir: Path) -> list[Rubric]:
+    """Read one rubric per ``*.md`` file; the file stem names the metric.
+
+    The allowed scores are the backticked numbers in the rubric (e.g.
+    ``- `0.5`: Partially correct``); a rubric without any is scored 0-1.
+    """
+    rubrics = []
+    for path in sorted(rubrics_dir.glob("*.md")):
+        if path.stem.lower() == "readme":
+            continue
+        text = path.read_text(encoding="utf-8")
+        scale = [float(v) for v in re.findall(r"`(-?\d+(?:\.\d+)?)`", text)] or [0.0, 1.0]
+        rubrics.append(Rubric(
+            metric=path.stem.replace("-", "_"),
+            path=str(path),
+            text=text.strip(),
+            sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            scale_min=min(scale),
+            scale_max=max(scale),
+        ))
+    return rubrics
+
+def judged_pair_hash(result: dict) -> str:
+    """Content address of what the judge sees for one result."""
+    payload = json.dumps([result.get("query", ""), result.get("expected", ""), result.get("response", "")],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def build_judge_prompt(rubric: Rubric, items: list[dict]) -> str:
+    def clip(text: str) -> str:
+        text = str(text or "")
+        return text if len(text) <= JUDGE_MAX_CHARS else text[:JUDGE_MAX_CHARS] + " [truncated]"
+
+    lines = [
+        "# Rubric", "", rubric.text, "",
+        f"Scores must be between {rubric.scale_min:g} and {rubric.scale_max:g} as defined above.", "",
+    ]
+    for n, item in enumerate(items, 1):
+        lines += [f"## Item {n}", f"Query: {clip(item.get('query'))}"]
+        if item.get("expected"):
+            lines.append(f"Expected: {clip(item['expected'])}")
+        lines += [f"Response: {clip(item.get('response'))}", ""]
+    return "\n".join(lines)
+
+def parse_judge_reply(content: str, count: int, rubric: Rubric) -> dict[int, dict]:
+    """Verdicts by 0-based item position; malformed or out-of-scale entries are left out."""
+    start, end = content.find("["), content.rfind("]")
+    if start < 0 or end < start:
+        return {}
+    try:
+        entries = json.loads(content[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    verdicts = {}
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            position, score = int(entry["id"]) - 1, float(entry["score"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= position < count and rubric.scale_min <= score <= rubric.scale_max:
+            verdicts[position] = {"score": score, "reason": str(entry.get("reason", ""))[:500]}
+    return verdicts
+
+async def judge_result_files(
+    results_dir: Path,
+    rubrics: list[Rubric],
+    judge: ModelSpec,
+    cache: ResponseCache,
+    batch_size: int = 8,
+    concurrency: int = 4,
+) -> dict[str, dict]:
+    """Score every successful result against every rubric with an LLM judge.
+
+    Up to ``batch_size`` (query, response) pairs share one judge call and up
+    to ``concurrency`` calls run at once. Verdicts are cached by judge
+    deployment, rubric hash and judged-pair hash, so unchanged responses are
+    never judged twice, including duplicates within a run. Items a reply
+    misses are asked again up to ``JUDGE_MAX_RETRIES`` times, split in half
+    each time the reply was partly usable and resent whole when it was not.
+    Items that still fail stay unjudged and are cached as ``error`` rows for
+    ``JUDGE_ERROR_TTL_SECONDS``, so a judge that cannot score them is not
+    asked again on every rerun. Per-query verdicts and per-rubric
+    means are written to ``judgements/<model>.json``, stamped with the result
+    file's size and mtime so ``compare_models`` can ignore stale ones.
+    """
+    client = chat_client(judge)
+    semaphore = asyncio.Semaphore(concurrency)
+    judgement_dir = results_dir / "judgements"
+    judgement_dir.mkdir(exist_ok=True)
+    calls = from_cache = failures_cached = 0
+
+    async def judge_batch(rubric: Rubric, items: list[dict], attempt: int = 0) -> dict[int, dict]:
+        nonlocal calls
+        messages = [
+            {"role": "system", "content": JUDGE_SYSTEM_PROMPT},
+            {"role": "user", "content": build_judge_prompt(rubric, items)},
+        ]
+        async with semaphore:
+            calls += 1
+            try:
+                response = await client.chat(messages=messages)
+            except Exception as e:
+                print(f" [judge] {rubric.metric}: call failed ({e})", file=sys.stderr)
+                return {}
+        content = response.content if hasattr(response, "content") else str(response)
+        verdicts = parse_judge_reply(content, len(items), rubric)
+        missing = [n for n in range(len(items)) if n not in verdicts]
+        if missing and attempt < JUDGE_MAX_RETRIES:
+            # An unusable reply says nothing about which items tripped the judge, so resend as is
+            retry = [items[n] for n in missing]
+            halves = [retry[:len(retry) // 2], retry[len(retry) // 2:]] if verdicts and len(retry) > 1 else [retry]
+            offset = 0
+            found_halves = await asyncio.gather(*(judge_batch(rubric, h, attempt + 1) for h in halves))
+            for half, found in zip(halves, found_halves):
+                for n, verdict in found.items():
+                    verdicts[missing[offset + n]] = verdict
+                offset += len(half)
+        return verdicts
+
+    summaries = {}
+    for path in find_result_files(results_dir):
+        latest: dict[int, dict] = {}
+        meta = scan_result_file(path, lambda r: latest.__setitem__(r.get("index", len(latest)), r))
+        name = meta.get("model", path.stem)
+        answered = [latest[i] for i in sorted(latest) if not latest[i].get("error")]
+        verdicts: dict[str, dict[int, dict]] = {}
+
+        async def judge_rubric(rubric: Rubric) -> None:
+            nonlocal from_cache, failures_cached
+            keys = {r["index"]: ResponseCache.key(judge.deployment, rubric.sha256, judged_pair_hash(r)) for r in answered}
+            hits = cache.get_many(list(set(keys.values())))
+            now = time.time()
+            found: dict[int, dict] = {}
+            pending: dict[str, list[dict]] = {}
+            for r in answered:
+                hit = hits.get(keys[r["index"]])
+                if hit is not None and "error" not in hit:
+                    found[r["index"]] = hit
+                    from_cache += 1
+                elif hit is not None and hit.get("expires_at", 0) > now:
+                    failures_cached += 1 # recently failed; stays unjudged until the entry expires
+                else:
+                    pending.setdefault(keys[r["index"]], []).append(r)
+            # One judgement per distinct pair, fanned out to every index sharing it
+            unique = [group[0] for group in pending.values()]
+            batches = [unique[k:k + batch_size] for k in range(0, len(unique), batch_size)]
+            fresh: dict[str, dict] = {}
+            for batch, batch_verdicts in zip(batches, await asyncio.gather(*(judge_batch(rubric, b) for b in batches))):
+                for n, verdict in batch_verdicts.items():
+                    key = keys[batch[n]["index"]]
+                    fresh[key] = verdict
+                    for r in pending[key]:
+                        found[r["index"]] = verdict
+            failed = {"error": "no valid verdict", "expires_at": time.time() + JUDGE_ERROR_TTL_SECONDS}
+            fresh.update({key: failed for key in pending if key not in fresh})
+            cache.put_many(fresh)
+            verdicts[rubric.metric] = found
+
+        await asyncio.gather(*(judge_rubric(rubric) for rubric in rubrics))
+
+        stat = path.stat()
+        summary = {
+            "model": name,
+            "result_file": path.name,
+            "result_size": stat.st_size,
+            "result_mtime_ns": stat.st_mtime_ns,
+            "judge": judge.deployment,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "rubrics": {},
+            "verdicts": [],
+        }
+        for rubric in rubrics:
+            found = verdicts[rubric.metric]
+            scores = [v["score"] for v in found.values()]
+            summary["rubrics"][rubric.metric] = {
+                "path": rubric.path,
+                "sha256": rubric.sha256,
+                "scale": [rubric.scale_min, rubric.scale_max],
+                "mean": round(sum(scores) / len(scores), 4) if scores else None,
+                "judged": len(scores),
+                "unjudged": len(answered) - len(scores),
+            }
+            summary["verdicts"] += [{"index": i, "metric": rubric.metric, **found[i]} for i in sorted(found)]
+            unjudged = f", {len(answered) - len(scores)} unjudged" if len(scores) < len(answered) else ""
+            mean = f"{sum(scores) / len(scores):.3f}" if scores else "n/a"
+            print(f" [judge] {name}: {rubric.metric} = {mean} over {len(scores)} responses{unjudged}")
+        write_json_atomic(judgement_dir / f"{path.stem}.json", summary)
+        summaries[name] = summary
+
+    failed = f", {failures_cached} recent failures not retried" if failures_cached else ""
+    print(f" [judge] {calls} judge calls, {from_cache} verdicts from cache{failed}")
+    return summaries
+
+def load_judgements(results_path: Path) -> dict[str, dict]:
+    """Per-rubric judge means by model name, skipping judgements of since-changed result files."""
+    judgements = {}
+    for path in sorted((results_path / "judgements").glob("*.json")):
+        try:
+            summary = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+        result_file = results_path / summary.get("result_file", "")
+        try:
+            stat = result_file.stat()
+        except OSError:
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != (summary.get("result_size"), summary.get("result_mtime_ns")):
+            print(f"WARNING: {path.name} judged an older {result_file.name}; rerun with --judge to refresh",
+                  file=sys.stderr)
+            continue
+        judgements[summary["model"]] = {
+            metric: info["mean"] for metric, info in summary["rubrics"].items() if info["mean"] is not None
+        }
+    return judgements
+
+# ---------------------------------------------------------------------------
+# Latency statistics
+# ---------------------------------------------------------------------------
+
+class LatencySketch:
+    """Mergeable quantile sketch with bounded relative error.
+
+    Values are counted in logarithmic bins whose width guarantees every
+    quantile is within ``relative_accuracy`` of the true value. Sketches built
+    from separate shards combine exactly with ``merge``, and ``to_dict`` /
+    ``from_dict`` round-trip them through JSON.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: LatencySketch) -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def _bin_value(self, key: int) -> float:
+        # Midpoint (in relative terms) of the bin (gamma^(key-1), gamma^key]
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        """Value at quantile ``q`` (0..1); 0.0 for an empty sketch."""
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return min(self._bin_value(key), self.max)
+        return self.max
+
+    def histogram(self) -> list[dict]:
+        """Counts per power-of-two millisecond bucket, as ``le_ms``/``count``."""
+        buckets: dict[int, int] = {}
+        if self.zero_count:
+            buckets[0] = self.zero_count
+        for key, count in self.bins.items():
+            upper = 2 ** max(0, math.ceil(math.log2(self._bin_value(key))))
+            buckets[upper] = buckets.get(upper, 0) + count
+        return [{"le_ms": upper, "count": buckets[upper]} for upper in sorted(buckets)]
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(k): v for k, v in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> LatencySketch:
+        sketch = cls(data.get("relative_accuracy", 0.01))
+        sketch.bins = {int(k): v for k, v in data.get("bins", {}).items()}
+        sketch.zero_count = data.get("zero_count", 0)
+        sketch.count = data.get("count", 0)
+        sketch.total = data.get("total", 0.0)
+        sketch.max = data.get("max", 0.0)
+        return sketch
+
+# ModelResult latency fields of a model none of whose results were timed
+UNKNOWN_LATENCY = {
+    "p50_latency_ms": None, "p90_latency_ms": None, "p95_latency_ms": None, "p99_latency_ms": None,
+    "max_latency_ms": None, "latency_histogram": [],
+}
+
+def format_ms(value: float | None) -> str:
+    """Milliseconds for reports; ``n/a`` for an unknown latency."""
+    return "n/a" if value is None else f"{value:.0f}ms"
+
+def latency_fields(sketch: LatencySketch) -> dict[str, Any]:
+    """ModelResult latency fields derived from a sketch."""
+    return {
+        "p50_latency_ms": round(sketch.quantile(0.50), 1),
+        "p90_latency_ms": round(sketch.quantile(0.90), 1),
+        "p95_latency_ms": round(sketch.quantile(0.95), 1),
+        "p99_latency_ms": round(sketch.quantile(0.99), 1),
+        "max_latency_ms": round(sketch.max, 1),
+        "latency_histogram": sketch.histogram(),
+    }
+
+# ---------------------------------------------------------------------------
+# Comparison engine
+# ---------------------------------------------------------------------------
+
+class ScoreAggregator:
+    """Single-pass, constant-memory accumulator behind ``aggregate_scores``.
+
+    Feed per-query results one at a time with ``add`` and build the
+    ``ModelResult`` with ``result`` once the file's metadata is known. With
+    ``collect``, compact per-query metric columns are also kept in
+    ``columns`` for ``bootstrap_statistics``.
+    """
+
+    def __init__(self, collect: bool = False):
+        self.columns: dict[str, array] | None = None
+        if collect:
+            self.columns = {
+                "index": array("q"),
+                "success": array("b"),
+                "well_formed": array("b"),
+                "timed": array("b"),
+                "latency_ms": array("d"),
+                "tokens": array("d"),
+            }
+        self.count = 0
+        self.successful = 0
+        self.well_formed = 0
+        self.timed = 0
+        self.latency_sum = 0
+        self.tokens_sum = 0
+        self.sketch = LatencySketch()
+        self.ttft_sketch = LatencySketch()
+        self.inter_token_sum = 0.0
+        self.inter_token_count = 0
+        self.throughput_sum = 0.0
+        self.throughput_count = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved_sum = 0.0
+        self.saved_count = 0
+        self.cached = 0
+        self.deduplicated = 0
+        self.batched = 0
+        self.priced = 0
+        self.cost_sum = 0.0
+        self.spent_sum = 0.0
+
+    def add(self, r: dict) -> None:
+        self.count += 1
+        if r.get("cost_usd") is not None:
+            self.priced += 1
+            self.cost_sum += r["cost_usd"]
+        # Cache hits and de-duplicated copies carry the cost of the call they reuse but spent nothing
+        self.spent_sum += result_spend(r)
+        self.cached += bool(r.get("cached"))
+        self.deduplicated += "dedup_of" in r
+        self.batched += bool(r.get("batch"))
+        if not r.get("error"):
+            self.successful += 1
+            self.tokens_sum += r.get("tokens_used", 0)
+            if len(r.get("response", "").strip()) > 10:
+                self.well_formed += 1
+        # Cache hits and de-duplicated copies are excluded so replayed latencies do not skew latency stats
+        if not is_replayed(r):
+            self.timed += 1
+            self.latency_sum += r["latency_ms"]
+            self.sketch.add(r["latency_ms"])
+            if r.get("ttft_ms") is not None:
+                self.ttft_sketch.add(r["ttft_ms"])
+            if r.get("inter_token_ms") is not None:
+                self.inter_token_sum += r["inter_token_ms"]
+                self.inter_token_count += 1
+            if r.get("output_tokens_per_sec") is not None:
+                self.throughput_sum += r["output_tokens_per_sec"]
+                self.throughput_count += 1
+        hedge = r.get("hedge")
+        if hedge:
+            self.hedged += 1
+            self.hedge_wins += hedge.get("winner") == "hedge"
+            if hedge.get("latency_saved_ms") is not None:
+                self.saved_sum += hedge["latency_saved_ms"]
+                self.saved_count += 1
+        if self.columns is not None:
+            success = not r.get("error")
+            timed = not is_replayed(r)
+            columns = self.columns
+            columns["index"].append(r["index"])
+            columns["success"].append(success)
+            columns["well_formed"].append(success and len(r.get("response", "").strip()) > 10)
+            columns["timed"].append(timed)
+            columns["latency_ms"].append(r["latency_ms"] if timed else 0.0)
+            columns["tokens"].append(r.get("tokens_used", 0) if success else 0.0)
+
+    def result(self, data: dict) -> ModelResult:
+        n = self.count
+        if n == 0:
+            return ModelResult(name=data["model"], role=data.get("role", "unknown"))
+
+        s = self.successful or 1 # avoid division by zero
+
+        return ModelResult(
+            name=data["model"],
+            role=data.get("role", "unknown"),
+            dataset_size=n,
+            # Task completion = % of queries that got a non-empty, non-error response
+            task_completion=round(self.successful / n, 3),
+            # Format compliance = % of responses that are valid (non-empty)
+            format_compliance=round(self.well_formed / s, 3),
+            avg_latency_ms=round(self.latency_sum / self.timed, 1) if self.timed else None,
+            avg_tokens=round(self.tokens_sum / s, 1),
+            cache_hits=self.cached,
+            dedup_saved_calls=self.deduplicated,
+            batch_queries=self.batched,
+            # Replayed results count at the price of the call they reuse: this is the model's unit cost
+            estimated_cost_per_1k=round(self.cost_sum / self.priced * 1000, 4) if self.priced else 0.0,
+            priced_queries=self.priced,
+            total_cost_usd=round(self.spent_sum, 6),
+            early_stop=data.get("run", {}).get("early_stop"),
+            budget_stop=data.get("run", {}).get("budget_stop"),
+            **warmup_fields(data.get("run", {}).get("warmup")),
+            **(latency_fields(self.sketch) if self.timed else UNKNOWN_LATENCY),
+            **self._streaming_fields(),
+            **self._hedge_fields(),
+        )
+
+    def _hedge_fields(self) -> dict[str, Any]:
+        if not self.hedged:
+            return {}
+        return {
+            "hedged_queries": self.hedged,
+            "hedge_rate": round(self.hedged / self.count, 4),
+            "hedge_wins": self.hedge_wins,
+            "avg_latency_saved_ms": round(self.saved_sum / self.saved_count, 1) if self.saved_count else 0.0,
+        }
+
+    def _streaming_fields(self) -> dict[str, Any]:
+        ttft = self.ttft_sketch
+        if ttft.count == 0:
+            return {}
+        return {
+            "streamed_queries": ttft.count,
+            "avg_ttft_ms": round(ttft.total / ttft.count, 1),
+            "p50_ttft_ms": round(ttft.quantile(0.50), 1),
+            "p95_ttft_ms": round(ttft.quantile(0.95), 1),
+            "avg_inter_token_ms": (
+                round(self.inter_token_sum / self.inter_token_count, 2) if self.inter_token_count else 0.0
+            ),
+            "avg_output_tokens_per_sec": (
+                round(self.throughput_sum / self.throughput_count, 1) if self.throughput_count else 0.0
+            ),
+        }
+
+def warmup_fields(warmup: dict | None) -> dict[str, Any]:
+    """Cold-start fields for ``ModelResult`` from a run summary's ``warmup`` entry."""
+    if not warmup:
+        return {}
+    return {
+        "warmup_requests": warmup["requests"],
+        "cold_start_latency_ms": float(warmup["cold_start_ms"]),
+        "avg_warmup_latency_ms": round(sum(warmup["latency_ms"]) / len(warmup["latency_ms"]), 1),
+    }
+
+def result_spend(r: dict) -> float:
+    """USD actually paid for a result: its own call unless it reuses another result, plus any hedge."""
+    own = 0.0 if r.get("cached") or "dedup_of" in r else r.get("cost_usd") or 0.0
+    return own + (r.get("hedge") or {}).get("extra_cost_usd", 0.0)
+
+def is_replayed(r: dict) -> bool:
+    """True when a result has no latency of its own (cache hit, de-duplicated copy or batch result)."""
+    return bool(r.get("cached")) or "dedup_of" in r or bool(r.get("batch"))
+
+def aggregate_scores(data: dict) -> ModelResult:
+    """Calculate aggregate metrics from raw per-query results."""
+    aggregator = ScoreAggregator()
+    for r in data.get("results", []):
+        aggregator.add(r)
+    return aggregator.result(data)
+
+def aggregate_result_file(path: Path) -> ModelResult:
+    """Stream a result file straight into aggregate metrics.
+
+    Produces the same numbers as ``aggregate_scores(load_result_file(path))``
+    without ever holding the full result list in memory.
+    """
+    aggregator = ScoreAggregator()
+    data = scan_result_file(path, aggregator.add)
+    return aggregator.result(data)
+
+def collect_result_file(path: Path) -> tuple[ModelResult, dict[str, array]]:
+    """Like ``aggregate_result_file``, also returning the per-query metric columns."""
+    aggregator = ScoreAggregator(collect=True)
+    data = scan_result_file(path, aggregator.add)
+    return aggregator.result(data), aggregator.columns
+
+def _aggregate_entry(path: Path, collect: bool) -> tuple[ModelResult, dict, dict[str, array] | None]:
+    """Aggregate one file into ``(ModelResult, latency sketch dict, columns)`` for ``AggregateCache``."""
+    aggregator = ScoreAggregator(collect=collect)
+    data = scan_result_file(path, aggregator.add)
+    return aggregator.result(data), aggregator.sketch.to_dict(), aggregator.columns
+
+class AggregateCache:
+    """Sidecar cache of per-file aggregates, stored next to the result files.
+
+    Entries are keyed by the result file's path and validated against its
+    size and modification time, so appending to, merging or rewriting a file
+    invalidates it. Each entry holds the ``ModelResult`` as computed before
+    threshold checks, the latency sketch its percentiles are read back from
+    and, once a ``--bootstrap`` run has needed them, the packed per-query
+    metric columns. A cache that cannot be written (e.g. a read-only results
+    directory) only warns once and stops storing; the comparison carries on.
+    """
+
+    FILE_NAME = ".aggregate-cache.sqlite"
+    VERSION = 7 # bump when aggregation changes so stale entries are ignored
+
+    def __init__(self, results_path: Path):
+        self._db = sqlite3.connect(results_path / self.FILE_NAME)
+        self._writable = True
+        try:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS aggregates ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                "version INTEGER NOT NULL, result TEXT NOT NULL, sketch TEXT NOT NULL, columns BLOB)"
+            )
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    def _write(self, statements: Callable[[], Any]) -> None:
+        if not self._writable:
+            return
+        try:
+            statements()
+        except sqlite3.Error as e:
+            self._writable = False
+            print(f"WARNING: Aggregate cache not updated ({e}); later runs will parse these files again",
+                  file=sys.stderr)
+
+    @staticmethod
+    def _fingerprint(path: Path) -> tuple[str, int, int]:
+        stat = path.stat()
+        return str(path.resolve()), stat.st_size, stat.st_mtime_ns
+
+    def get(self, path: Path, collect: bool = False) -> tuple[ModelResult, dict[str, array] | None] | None:
+        """Cached ``(ModelResult, columns)`` for an unchanged file, else None."""
+        key, size, mtime_ns = self._fingerprint(path)
+        try:
+            row = self._db.execute(
+                "SELECT result, sketch, columns FROM aggregates "
+                "WHERE path = ? AND size = ? AND mtime_ns = ? AND version = ?",
+                (key, size, mtime_ns, self.VERSION),
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or (collect and row[2] is None):
+            return None
+        try:
+            result = ModelResult(**json.loads(row[0]))
+        except TypeError:
+            return None # written by an incompatible ModelResult
+        # Percentiles come from the stored sketch rather than from re-reading the file's rows
+        sketch = LatencySketch.from_dict(json.loads(row[1]))
+        for name, value in (latency_fields(sketch) if sketch.count else UNKNOWN_LATENCY).items():
+            setattr(result, name, value)
+        return result, unpack_columns(row[2]) if collect else None
+
+    def put(self, path: Path, result: ModelResult, sketch: dict, columns: dict[str, array] | None) -> None:
+        key, size, mtime_ns = self._fingerprint(path)
+        self._write(lambda: self._db.execute(
+            "INSERT OR REPLACE INTO aggregates (path, size, mtime_ns, version, result, sketch, columns) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, size, mtime_ns, self.VERSION, json.dumps(asdict(result)), json.dumps(sketch),
+             pack_columns(columns) if columns is not None else None),
+        ))
+
+    def prune(self, keep: list[Path]) -> None:
+        """Drop entries for files that are no longer in the results directory."""
+        def delete_stale() -> None:
+            paths = {str(path.resolve()) for path in keep}
+            stale = [(row[0],) for row in self._db.execute("SELECT path FROM aggregates") if row[0] not in paths]
+            self._db.executemany("DELETE FROM aggregates WHERE path = ?", stale)
+
+        self._write(delete_stale)
+
+    def close(self) -> None:
+        self._write(self._db.commit)
+        self._db.close()
+
+def aggregate_result_files(
+    result_files: list[Path],
+    workers: int = 1,
+    collect: bool = False,
+    cache: AggregateCache | None = None,
+) -> list:
+    """Aggregate result files, optionally across a process pool.
+
+    Results come back in the order of ``result_files`` whatever the number of
+    workers, so reports are identical to a serial run. With ``collect``, each
+    entry is a ``(ModelResult, columns)`` pair from ``collect_result_file``.
+    Files unchanged since they were stored in ``cache`` are not re-read.
+    """
+    entries: list[Any] = [cache.get(path, collect) if cache else None for path in result_files]
+    misses = [path for path, entry in zip(result_files, entries) if entry is None]
+
+    aggregate = functools.partial(_aggregate_entry, collect=collect)
+    if workers <= 1 or len(misses) <= 1:
+        computed = [aggregate(path) for path in misses]
+    else:
+        workers = min(workers, len(misses))
+        chunksize = max(1, len(misses) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            computed = list(pool.map(aggregate, misses, chunksize=chunksize))
+
+    fresh = iter(zip(misses, computed))
+    for i, entry in enumerate(entries):
+        if entry is None:
+            path, (result, sketch, columns) = next(fresh)
+            if cache:
+                cache.put(path, result, sketch, columns)
+            entries[i] = (result, columns)
+    return entries if collect else [result for result, _ in entries]
+
+def compare_models(
+    results_dir: str,
+    thresholds: Thresholds,
+    workers: int = 1,
+    bootstrap: int = 0,
+    confidence: float = 0.95,
+    use_cache: bool = True,
+) -> dict[str, Any]:
+    """Load all result files and generate comparison report.
+
+    With ``workers`` > 1, files are parsed and aggregated in parallel. With
+    ``bootstrap`` > 0 resamples, each metric gets a confidence interval,
+    every pair of models gets a paired per-query comparison, and winners
+    that are not significantly better than another viable model are listed
+    under ``winner_ties``. With ``use_cache``, per-file aggregates are kept
+    in an ``AggregateCache`` in the results directory, so only new or changed
+    files are parsed. Judge scores from ``judge_result_files`` are attached,
+    and coherence, relevance and tool accuracy are gated once judged.
+    """
+    results_path = Path(results_dir)
+    if not results_path.exists():
+        print(f"ERROR: Results directory not found: {results_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    result_files = find_result_files(results_path)
+    if not result_files:
+        print(f"ERROR: No .json/.jsonl result files in {results_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    models: list[ModelResult] = []
+    alerts: list[str] = []
+
+    cache = None
+    if use_cache:
+        try:
+            cache = AggregateCache(results_path)
+        except (sqlite3.Error, OSError) as e:
+            print(f"WARNING: Aggregate cache unavailable ({e}); parsing every result file", file=sys.stderr)
+    try:
+        aggregated = aggregate_result_files(result_files, workers, collect=bootstrap > 0, cache=cache)
+        if cache:
+            cache.prune(result_files)
+    finally:
+        if cache:
+            cache.close()
+    statistics = None
+    if bootstrap > 0:
+        statistics = bootstrap_statistics(
+            {scores.name: columns for scores, columns in aggregated}, resamples=bootstrap, confidence=confidence,
+        )
+        aggregated = [scores for scores, _ in aggregated]
+        for scores in aggregated:
+            scores.confidence_intervals = statistics["intervals"].get(scores.name, {})
+
+    judgements = load_judgements(results_path)
+
+    for scores in aggregated:
+        scores.judge_scores = judgements.get(scores.name, {})
+        for metric in JUDGED_FIELDS:
+            if metric in scores.judge_scores:
+                setattr(scores, metric, scores.judge_scores[metric])
+
+        # Check thresholds
+        checks = [
+            ("task_completion", scores.task_completion, thresholds.task_completion, "min"),
+            ("format_compliance", scores.format_compliance, thresholds.format_compliance, "min"),
+        ]
+        if scores.avg_latency_ms is None:
+            alerts.append(f"{scores.name}: latency unknown (no timed results: all cached, de-duplicated "
+                          f"or batch); latency gates not checked")
+        else:
+            checks.append(("avg_latency_ms", scores.avg_latency_ms, thresholds.max_latency_ms, "max"))
+        checks += [
+            (metric, getattr(scores, metric), getattr(thresholds, metric), "min")
+            for metric in JUDGED_FIELDS if metric in scores.judge_scores
+        ]
+        if scores.priced_queries:
+            checks.append(("estimated_cost_per_1k", scores.estimated_cost_per_1k, thresholds.max_cost_per_1k, "max"))
+        for pct in ("p50", "p95", "p99"):
+            limit = getattr(thresholds, f"max_{pct}_latency_ms")
+            if limit is not None and scores.avg_latency_ms is not None:
+                checks.append((f"{pct}_latency_ms", getattr(scores, f"{pct}_latency_ms"), limit, "max"))
+        if scores.streamed_queries:
+            if thresholds.max_p95_ttft_ms is not None:
+                checks.append(("p95_ttft_ms", scores.p95_ttft_ms, thresholds.max_p95_ttft_ms, "max"))
+            if thresholds.min_output_tokens_per_sec is not None:
+                checks.append(("avg_output_tokens_per_sec", scores.avg_output_tokens_per_sec,
+                               thresholds.min_output_tokens_per_sec, "min"))
+
+        for metric, value, threshold, direction in checks:
+            if direction == "min" and value < threshold:
+                msg = f"{scores.name}: {metric} = {value:.3f} below threshold {threshold}"
+                alerts.append(msg)
+                scores.failures.append(msg)
+                scores.passed = False
+            elif direction == "max" and value > threshold:
+                msg = f"{scores.name}: {metric} = {value:.1f} exceeds threshold {threshold}"
+                alerts.append(msg)
+                scores.failures.append(msg)
+                scores.passed = False
+
+        if scores.early_stop:
+            stop = scores.early_stop
+            msg = (f"{scores.name}: stopped early after {stop['after_queries']}/"
+                   f"{stop.get('planned_queries', '?')} queries; {stop['metric']} upper bound "
+                   f"{stop['upper_bound']:.3f} below threshold {stop['threshold']} "
+                   f"at {stop['confidence']:.0%} confidence")
+            alerts.append(msg)
+            scores.failures.append(msg)
+            scores.passed = False
+
+        if scores.budget_stop:
+            stop = scores.budget_stop
+            msg = (f"{scores.name}: stopped by --max-spend ${stop['limit_usd']:.2f} after "
+                   f"{stop['after_queries']} queries; results are incomplete")
+            alerts.append(msg)
+            scores.failures.append(msg)
+            scores.passed = False
+
+        models.append(scores)
+
+    # Determine winners
+    winners = {}
+    if models:
+        viable = [m for m in models if m.passed] or models
+        winners["task_completion"] = max(viable, key=lambda m: m.task_completion).name
+        winners["format_compliance"] = max(viable, key=lambda m: m.format_compliance).name
+        timed = [m for m in viable if m.avg_latency_ms is not None]
+        if timed:
+            winners["latency"] = min(timed, key=lambda m: m.avg_latency_ms).name
+        winners["token_efficiency"] = min(viable, key=lambda m: m.avg_tokens or float("inf")).name
+
+    # Winners within bootstrap noise of another viable model
+    winner_ties = {}
+    if statistics and winners:
+        viable_names = {m.name for m in viable}
+        for label, winner in winners.items():
+            metric = WINNER_METRICS[label]
+            winner_ties[label] = [
+                pair["model_b"] if pair["model_a"] == winner else pair["model_a"]
+                for pair in statistics["pairwise"]
+                if winner in (pair["model_a"], pair["model_b"])
+                and {pair["model_a"], pair["model_b"]} <= viable_names
+                and not pair[f"{metric}_diff"]["significant"]
+            ]
+
+    now = datetime.now(timezone.utc)
+    report = {
+        # The random suffix keeps reports generated within the same second apart
+        "report_id": f"compare-{now.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}",
+        "timestamp": now.isoformat(),
+        "models_tested": len(models),
+        "models": [asdict(m) for m in models],
+        "winner_by_metric": winners,
+        "alerts": alerts,
+        "all_passed": all(m.passed for m in models),
+    }
+    if statistics:
+        report["winner_ties"] = winner_ties
+        report["statistics"] = {key: value for key, value in statistics.items() if key != "intervals"}
+
+    return report
+
+# ---------------------------------------------------------------------------
+# Bootstrap statistics (requires numpy)
+# ---------------------------------------------------------------------------
+
+# Report metric -> (numerator, denominator) columns; every metric is a ratio of sums
+BOOTSTRAP_METRICS = {
+    "task_completion": ("success", "present"),
+    "format_compliance": ("well_formed", "success"),
+    "avg_latency_ms": ("latency_ms", "timed"),
+    "avg_tokens": ("tokens", "success"),
+}
+
+# winner_by_metric label -> ModelResult metric
+WINNER_METRICS = {
+    "task_completion": "task_completion",
+    "format_compliance": "format_compliance",
+    "latency": "avg_latency_ms",
+    "token_efficiency": "avg_tokens",
+}
+
+def bootstrap_statistics(
+    columns: dict[str, dict[str, array]],
+    resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    batch_elements: int = 1 << 22,
+) -> dict[str, Any]:
+    """Bootstrap intervals per model and paired differences per model pair.
+
+    Uses the Poisson bootstrap: a resample weights every dataset index with
+    a Poisson(1) draw, and the same weights apply to every model, so pair
+    comparisons are joined on ``index`` for free. Each metric is a ratio of
+    two weighted column sums, so all models and pairs are stacked into one
+    matrix and each batch of resamples costs a single matrix product.
+    ``batch_elements`` bounds the size of the weight matrix per batch.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        print("ERROR: numpy required for --bootstrap. Install: pip install numpy", file=sys.stderr)
+        sys.exit(1)
+
+    data = {}
+    for name, cols in columns.items():
+        data[name] = {key: np.array(col) for key, col in cols.items()}
+        data[name]["present"] = np.ones(len(cols["index"]), dtype=np.int8)
+    size = 1 + max((int(d["index"].max()) for d in data.values() if len(d["index"])), default=-1)
+
+    def scatter(index: Any, values: Any) -> Any:
+        full = np.zeros(size, dtype=np.float32)
+        full[index] = values
+        return full
+
+    # Stack [numerator, denominator] column pairs for every model, then every pair
+    blocks: list[Any] = []
+    for d in data.values():
+        for numerator, denominator in BOOTSTRAP_METRICS.values():
+            blocks += [scatter(d["index"], d[numerator]), scatter(d["index"], d[denominator])]
+
+    pairs = []
+    for a, b in itertools.combinations(data, 2):
+        da, db = data[a], data[b]
+        common, ia, ib = np.intersect1d(da["index"], db["index"], return_indices=True)
+        for numerator, denominator in BOOTSTRAP_METRICS.values():
+            mask = da[denominator][ia] * db[denominator][ib]
+            diff = (da[numerator][ia].astype(np.float64) - db[numerator][ib]) * mask
+            blocks += [scatter(common, diff), scatter(common, mask)]
+
+        sa, sb = da["success"][ia], db["success"][ib]
+        a_wins, b_wins = int((sa > sb).sum()), int((sb > sa).sum())
+        both_timed = (da["timed"][ia] * db["timed"][ib]) > 0
+        la, lb = da["latency_ms"][ia][both_timed], db["latency_ms"][ib][both_timed]
+        pairs.append({
+            "model_a": a,
+            "model_b": b,
+            "queries": len(common),
+            # Share of queries only one model completed that model_a completed
+            "success_win_rate": round(a_wins / (a_wins + b_wins), 4) if a_wins + b_wins else None,
+            # Share of jointly timed queries where model_a was faster (ties count half)
+            "latency_win_rate": (
+                round(float(((la < lb).sum() + 0.5 * (la == lb).sum()) / len(la)), 4) if len(la) else None
+            ),
+        })
+
+    matrix = np.column_stack(blocks) if blocks else np.zeros((size, 0), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    # Poisson(1) weights through a 16-bit inverse-CDF lookup table: several times
+    # faster than Generator.poisson, with CDF error below 1/65536
+    cdf = np.cumsum([math.exp(-1) / math.factorial(k) for k in range(20)])
+    poisson_table = np.searchsorted(cdf, (np.arange(65536) + 0.5) / 65536).astype(np.float32)
+    chunk = max(1, batch_elements // max(size, 1))
+    estimates = np.empty((resamples, matrix.shape[1] // 2))
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN columns, e.g. no timed queries
+        for start in range(0, resamples, chunk):
+            stop = min(resamples, start + chunk)
+            weights = poisson_table[rng.integers(0, 65536, size=(stop - start, size), dtype=np.uint16)]
+            sums = weights @ matrix
+            estimates[start:stop] = sums[:, 0::2] / sums[:, 1::2]
+        totals = matrix.sum(axis=0, dtype=np.float64)
+        points = totals[0::2] / totals[1::2]
+        tail = (1 - confidence) / 2 * 100
+        lows, highs = np.nanpercentile(estimates, [tail, 100 - tail], axis=0)
+
+    def interval(k: int) -> dict[str, Any]:
+        if math.isnan(lows[k]):
+            return {"value": None, "low": None, "high": None}
+        return {"value": round(float(points[k]), 4), "low": round(float(lows[k]), 4), "high": round(float(highs[k]), 4)}
+
+    k = 0
+    intervals = {}
+    for name in data:
+        intervals[name] = {}
+        for metric in BOOTSTRAP_METRICS:
+            bounds = interval(k)
+            intervals[name][metric] = {"low": bounds["low"], "high": bounds["high"]}
+            k += 1
+    for pair in pairs:
+        for metric in BOOTSTRAP_METRICS:
+            diff = interval(k)
+            diff["significant"] = diff["low"] is not None and (diff["low"] > 0 or diff["high"] < 0)
+            pair[f"{metric}_diff"] = diff
+            k += 1
+
+    return {
+        "method": "poisson-bootstrap",
+        "resamples": resamples,
+        "confidence": confidence,
+        "intervals": intervals,
+        "pairwise": pairs,
+    }
+
+# ---------------------------------------------------------------------------
+# Shard merge
+# ---------------------------------------------------------------------------
+
+def merge_result_files(inputs: list[Path], output_dir: Path, run_summary: dict | None = None) -> list[Path]:
+    """Merge per-shard result files into one ``<model>.jsonl`` per model.
+
+    Inputs may be files or directories. Results are streamed straight into
+    the merged file, de-duplicated by ``index``. The shards' spend adds up,
+    the first warm-up is kept, and an early or spend-cap stop on any shard
+    carries over; extra ``run_summary`` fields are added last. A warning is
+    printed when the merged count does not match the full dataset size.
+    """
+    files: list[Path] = []
+    for path in inputs:
+        files.extend(find_result_files(path) if path.is_dir() else [path])
+
+    # Group shard files by model, reading only metadata on this pass
+    by_model: dict[str, list[tuple[Path, dict]]] = {}
+    for path in files:
+        meta = scan_result_file(path, lambda r: None)
+        if "model" not in meta:
+            print(f"WARNING: Skipping {path}: no model metadata", file=sys.stderr)
+            continue
+        by_model.setdefault(meta["model"], []).append((path, meta))
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for model_name, shards in sorted(by_model.items()):
+        first = shards[0][1]
+        changed = sorted({
+            label for _, meta in shards
+            for label in fingerprint_changes(first.get("fingerprint"), meta.get("fingerprint"))
+        })
+        if changed:
+            print(f"ERROR: Shards of {model_name} were run with a different {', '.join(changed)}; "
+                  f"not merged", file=sys.stderr)
+            continue
+        total = first.get("total_dataset_size", sum(meta.get("dataset_size", 0) for _, meta in shards))
+        output_file = output_dir / f"{model_name.replace('/', '-').replace(' ', '-')}.jsonl"
+        seen: set[int] = set()
+        duplicates = 0
+        runs = [meta.get("run", {}) for _, meta in shards]
+        carried = {
+            key: next(run[key] for run in runs if run.get(key))
+            for key in (*RUN_FIRST, "early_stop", "budget_stop") if any(run.get(key) for run in runs)
+        }
+        spent_usd = sum(run.get("spent_usd", 0) for run in runs)
+
+        with open(output_file, "w", encoding="utf-8") as out:
+            out.write(json.dumps({
+                "model": model_name,
+                "role": first.get("role", "unknown"),
+                "provider": first.get("provider", "azure"),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "dataset_size": total,
+                **({"fingerprint": first["fingerprint"]} if first.get("fingerprint") else {}),
+                "merged_from": [str(path) for path, _ in shards],
+            }) + "\n")
+
+            def append(r: dict) -> None:
+                nonlocal duplicates
+                if r["index"] in seen:
+                    duplicates += 1
+                    return
+                seen.add(r["index"])
+                out.write(json.dumps(r) + "\n")
+
+            for path, _ in shards:
+                scan_result_file(path, append)
+            if "budget_stop" in carried:
+                carried["budget_stop"] = {**carried["budget_stop"], "after_queries": len(seen)}
+
+            out.write(json.dumps({"run": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "merged_shards": len(shards),
+                "queries_merged": len(seen),
+                "duplicates_dropped": duplicates,
+                **({"spent_usd": round(spent_usd, 6)} if spent_usd else {}),
+                **carried,
+                **(run_summary or {}),
+            }}) + "\n")
+
+        status = "OK" if len(seen) == total else f"WARNING: expected {total}"
+        print(f" {model_name}: merged {len(shards)} shard(s), {len(seen)} queries "
+              f"({duplicates} duplicates dropped) -> {output_file} [{status}]")
+        written.append(output_file)
+    return written
+
+# ---------------------------------------------------------------------------
+# Reports
+# ---------------------------------------------------------------------------
+
+def generate_markdown_report(report: dict) -> str:
+    """Generate human-readable Markdown comparison report."""
+    lines = [
+        "# Model Comparison Report",
+        "",
+        f"**Generated**: {report['timestamp']} ",
+        f"**Report ID**: {report['report_id']} ",
+        f"**Models Tested**: {report['models_tested']}",
+        "",
+    ]
+
+    # Summary table
+    lines.append("## Results")
+    lines.append("")
+    lines.append("| Model | Role | Task Completion | Format Compliance | Avg Latency | Avg Tokens | Status |")
+    lines.append("|-------|------|---------------:|------------------:|------------:|-----------:|--------|")
+
+    for m in report["models"]:
+        status = "[PASS] PASS" if m["passed"] else "[FAIL] FAIL"
+        lines.append(
+            f"| {m['name']} | {m['role']} | {m['task_completion']:.3f} | "
+            f"{m['format_compliance']:.3f} | {format_ms(m['avg_latency_ms'])} | "
+            f"{m['avg_tokens']:.0f} | {status} |"
+        )
+
+    # Latency distribution
+    lines.append("")
+    lines.append("## Latency")
+    lines.append("")
+    lines.append("| Model | p50 | p90 | p95 | p99 | Max | Histogram |")
+    lines.append("|-------|----:|----:|----:|----:|----:|-----------|")
+    for m in report["models"]:
+        histogram = ", ".join(f"<={b['le_ms']}ms: {b['count']}" for b in m.get("latency_histogram", []))
+        lines.append(
+            f"| {m['name']} | {format_ms(m.get('p50_latency_ms', 0))} | {format_ms(m.get('p90_latency_ms', 0))} | "
+            f"{format_ms(m.get('p95_latency_ms', 0))} | {format_ms(m.get('p99_latency_ms', 0))} | "
+            f"{format_ms(m.get('max_latency_ms', 0))} | {histogram} |"
+        )
+
+    # Cold start (only for runs with --warmup)
+    warmed = [m for m in report["models"] if m.get("warmup_requests")]
+    if warmed:
+        lines.append("")
+        lines.append("## Cold Start vs Steady State")
+        lines.append("")
+        lines.append("| Model | Warm-up Requests | Cold Start | Warm-up Avg | Steady p50 | Steady p95 | Cold-Start Penalty |")
+        lines.append("|-------|-----------------:|-----------:|------------:|-----------:|-----------:|-------------------:|")
+        for m in warmed:
+            p50 = m.get("p50_latency_ms", 0)
+            penalty = "n/a" if p50 is None else f"{m['cold_start_latency_ms'] - p50:+.0f}ms"
+            lines.append(
+                f"| {m['name']} | {m['warmup_requests']} | {m['cold_start_latency_ms']:.0f}ms | "
+                f"{m['avg_warmup_latency_ms']:.0f}ms | {format_ms(p50)} | "
+                f"{format_ms(m.get('p95_latency_ms', 0))} | {penalty} |"
+            )
+
+    # Streaming (only for --stream runs)
+    streamed = [m for m in report["models"] if m.get("streamed_queries")]
+    if streamed:
+        lines.append("")
+        lines.append("## Streaming")
+        lines.append("")
+        lines.append("| Model | Avg TTFT | p50 TTFT | p95 TTFT | Inter-Token | Output Tokens/sec |")
+        lines.append("|-------|---------:|---------:|---------:|------------:|------------------:|")
+        for m in streamed:
+            lines.append(
+                f"| {m['name']} | {m['avg_ttft_ms']:.0f}ms | {m['p50_ttft_ms']:.0f}ms | "
+                f"{m['p95_ttft_ms']:.0f}ms | {m['avg_inter_token_ms']:.1f}ms | "
+                f"{m['avg_output_tokens_per_sec']:.1f} |"
+            )
+
+    # Hedging (only for --hedge runs)
+    hedged = [m for m in report["models"] if m.get("hedged_queries")]
+    if hedged:
+        lines.append("")
+        lines.append("## Hedging")
+        lines.append("")
+        lines.append("| Model | Hedged | Hedge Rate | Hedge Wins | Avg Latency Saved |")
+        lines.append("|-------|-------:|-----------:|-----------:|------------------:|")
+        for m in hedged:
+            lines.append(
+                f"| {m['name']} | {m['hedged_queries']} | {m['hedge_rate']:.1%} | "
+                f"{m['hedge_wins']} | {m['avg_latency_saved_ms']:.0f}ms |"
+            )
+
+    # De-duplication (only for --dedupe runs)
+    deduplicated = [m for m in report["models"] if m.get("dedup_saved_calls")]
+    if deduplicated:
+        lines.append("")
+        lines.append("## De-duplication")
+        lines.append("")
+        lines.append("| Model | Queries | Model Calls | Calls Saved |")
+        lines.append("|-------|--------:|------------:|------------:|")
+        for m in deduplicated:
+            lines.append(
+                f"| {m['name']} | {m['dataset_size']} | {m['dataset_size'] - m['dedup_saved_calls']} | "
+                f"{m['dedup_saved_calls']} ({m['dedup_saved_calls'] / m['dataset_size']:.1%}) |"
+            )
+
+    # Cost (only for models with a pricing entry)
+    priced = [m for m in report["models"] if m.get("priced_queries")]
+    if priced:
+        lines.append("")
+        lines.append("## Cost")
+        lines.append("")
+        lines.append("| Model | Priced Queries | Spent | Cost per 1k Queries |")
+        lines.append("|-------|---------------:|-----------:|--------------------:|")
+        for m in priced:
+            lines.append(
+                f"| {m['name']} | {m['priced_queries']} | ${m['total_cost_usd']:.4f} | "
+                f"${m['estimated_cost_per_1k']:.2f} |"
+            )
+
+    # LLM judge (only for results scored with --judge)
+    judged = [m for m in report["models"] if m.get("judge_scores")]
+    if judged:
+        metrics = sorted({metric for m in judged for metric in m["judge_scores"]})
+        lines.append("")
+        lines.append("## LLM Judge")
+        lines.append("")
+        lines.append("| Model | " + " | ".join(metrics) + " |")
+        lines.append("|-------|" + "|".join("-" * (len(metric) + 1) + ":" for metric in metrics) + "|")
+        for m in judged:
+            cells = [f"{m['judge_scores'][metric]:.3f}" if metric in m["judge_scores"] else "n/a" for metric in metrics]
+            lines.append(f"| {m['name']} | " + " | ".join(cells) + " |")
+
+    # Early stopping (only for --early-stop runs that stopped)
+    stopped = [m for m in report["models"] if m.get("early_stop")]
+    if stopped:
+        lines.append("")
+        lines.append("## Early Stopping")
+        lines.append("")
+        lines.append("| Model | Stopped After | Metric | Observed | Upper Bound | Threshold | Confidence |")
+        lines.append("|-------|--------------:|--------|---------:|------------:|----------:|-----------:|")
+        for m in stopped:
+            stop = m["early_stop"]
+            lines.append(
+                f"| {m['name']} | {stop['after_queries']}/{stop.get('planned_queries', '?')} | {stop['metric']} | "
+                f"{stop['observed']:.3f} | {stop['upper_bound']:.3f} | {stop['threshold']} | "
+                f"{stop['confidence']:.0%} |"
+            )
+
+    # Bootstrap statistics (only with --bootstrap)
+    statistics = report.get("statistics")
+    if statistics:
+        def fmt(ci: dict, digits: int) -> str:
+            if ci.get("low") is None:
+                return "n/a"
+            value = f"{ci['value']:+.{digits}f} " if "value" in ci else ""
+            return f"{value}[{ci['low']:.{digits}f}, {ci['high']:.{digits}f}]"
+
+        lines.append("")
+        lines.append(f"## Confidence Intervals ({statistics['confidence']:.0%}, "
+                     f"{statistics['resamples']} bootstrap resamples)")
+        lines.append("")
+        lines.append("| Model | Task Completion | Format Compliance | Avg Latency (ms) | Avg Tokens |")
+        lines.append("|-------|-----------------|-------------------|------------------|------------|")
+        for m in report["models"]:
+            ci = m.get("confidence_intervals", {})
+            lines.append(
+                f"| {m['name']} | {fmt(ci.get('task_completion', {}), 3)} | "
+                f"{fmt(ci.get('format_compliance', {}), 3)} | {fmt(ci.get('avg_latency_ms', {}), 0)} | "
+                f"{fmt(ci.get('avg_tokens', {}), 0)} |"
+            )
+
+        lines.append("")
+        lines.append("## Paired Comparison")
+        lines.append("")
+        lines.append("Differences are model A minus model B over queries both answered; * = interval excludes 0.")
+        lines.append("")
+        lines.append("| Model A | Model B | Queries | Task Completion | Avg Latency (ms) | Success Win Rate | Latency Win Rate |")
+        lines.append("|---------|---------|--------:|-----------------|------------------|-----------------:|-----------------:|")
+        for pair in statistics["pairwise"]:
+            completion, latency = pair["task_completion_diff"], pair["avg_latency_ms_diff"]
+            success_rate = "n/a" if pair["success_win_rate"] is None else f"{pair['success_win_rate']:.1%}"
+            latency_rate = "n/a" if pair["latency_win_rate"] is None else f"{pair['latency_win_rate']:.1%}"
+            lines.append(
+                f"| {pair['model_a']} | {pair['model_b']} | {pair['queries']} | "
+                f"{fmt(completion, 3)}{'*' if completion['significant'] else ''} | "
+                f"{fmt(latency, 0)}{'*' if latency['significant'] else ''} | {success_rate} | {latency_rate} |"
+            )
+
+    # Winners
+    if report.get("winner_by_metric"):
+        lines.append("")
+        lines.append("## Best By Metric")
+        lines.append("")
+        ties = report.get("winner_ties", {})
+        for metric, winner in report["winner_by_metric"].items():
+            tied = f" (not significantly better than {', '.join(ties[metric])})" if ties.get(metric) else ""
+            lines.append(f"- **{metric}**: {winner}{tied}")
+
+    # Alerts
+    if report.get("alerts"):
+        lines.append("")
+        lines.append("## Alerts")
+        lines.append("")
+        for alert in report["alerts"]:
+            lines.append(f"- [WARN] {alert}")
+
+    # Overall
+    lines.append("")
+    if report["all_passed"]:
+        lines.append("## Verdict: [PASS] All models meet minimum thresholds")
+    else:
+        failed = [m["name"] for m in report["models"] if not m["passed"]]
+        lines.append(f"## Verdict: [FAIL] {len(failed)} model(s) failed threshold checks")
+        for name in failed:
+            lines.append(f" - {name}")
+
+    lines.append("")
+    return "\n".join(lines)
+
+def save_reports(report: dict, output_dir: str) -> None:
+    """Save JSON and Markdown reports."""
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+
+    # JSON report
+    json_path = output / "comparison-report.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f" JSON report: {json_path}")
+
+    # Markdown report
+    md_path = output / "comparison-report.md"
+    md_content = generate_markdown_report(report)
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write(md_content)
+    print(f" Markdown report: {md_path}")
+
+def print_summary(report: dict) -> None:
+    """Print colored summary to terminal."""
+    print("\n" + "=" * 60)
+    print(" MODEL COMPARISON SUMMARY")
+    print("=" * 60)
+
+    for m in report["models"]:
+        status = "PASS" if m["passed"] else "FAIL"
+        print(f"\n [{status}] {m['name']} ({m['role']})")
+        print(f" Task Completion: {m['task_completion']:.3f}")
+        completion_ci = m.get("confidence_intervals", {}).get("task_completion", {})
+        if completion_ci.get("low") is not None:
+            print(f" Task Completion CI: [{completion_ci['low']:.3f}, {completion_ci['high']:.3f}]")
+        print(f" Format Compliance: {m['format_compliance']:.3f}")
+        print(f" Avg Latency: {format_ms(m['avg_latency_ms'])}")
+        if m["avg_latency_ms"] is not None:
+            print(f" Latency p50/p95/p99/max: {m.get('p50_latency_ms', 0):.0f}/{m.get('p95_latency_ms', 0):.0f}/"
+                  f"{m.get('p99_latency_ms', 0):.0f}/{m.get('max_latency_ms', 0):.0f}ms")
+        if m.get("warmup_requests"):
+            print(f" Cold Start: {m['cold_start_latency_ms']:.0f}ms, warm-up avg {m['avg_warmup_latency_ms']:.0f}ms "
+                  f"over {m['warmup_requests']} requests (excluded from latency)")
+        if m.get("streamed_queries"):
+            print(f" TTFT avg/p95: {m['avg_ttft_ms']:.0f}/{m['p95_ttft_ms']:.0f}ms "
+                  f"Output: {m['avg_output_tokens_per_sec']:.1f} tokens/sec")
+        if m.get("hedged_queries"):
+            print(f" Hedged: {m['hedged_queries']} ({m['hedge_rate']:.1%}), {m['hedge_wins']} won, "
+                  f"avg {m['avg_latency_saved_ms']:.0f}ms saved")
+        print(f" Avg Tokens: {m['avg_tokens']:.0f}")
+        if m.get("priced_queries"):
+            print(f" Cost per 1k Queries: ${m['estimated_cost_per_1k']:.2f} (${m['total_cost_usd']:.4f} spent)")
+        if m.get("budget_stop"):
+            print(f" Stopped by Spend Cap: after {m['budget_stop']['after_queries']} queries")
+        if m.get("cache_hits"):
+            print(f" Cache Hits: {m['cache_hits']} (excluded from latency)")
+        if m.get("dedup_saved_calls"):
+            print(f" Calls Saved by De-duplication: {m['dedup_saved_calls']} (excluded from latency)")
+        if m.get("batch_queries"):
+            print(f" Batch API Results: {m['batch_queries']} (no per-query latency)")
+        if m.get("early_stop"):
+            print(f" Stopped Early: after {m['early_stop']['after_queries']}/"
+                  f"{m['early_stop'].get('planned_queries', '?')} queries")
+        if m["failures"]:
+            for fail in m["failures"]:
+                print(f" [!] {fail}")
+
+    if report.get("alerts"):
+        print(f"\n ALERTS ({len(report['alerts'])})")
+        for alert in report["alerts"]:
+            print(f" - {alert}")
+
+    print("\n" + "=" * 60)
+    if report["all_passed"]:
+        print(" [PASS] All models meet minimum thresholds")
+    else:
+        print(" [FAIL] Some models failed threshold checks")
+    print("=" * 60 + "\n")
+
+# ---------------------------------------------------------------------------
+# Run warehouse
+# ---------------------------------------------------------------------------
+
+# ModelResult fields stored per run; also the metrics trend queries accept
+WAREHOUSE_METRICS = (
+    "task_completion", "format_compliance", "avg_latency_ms", "p50_latency_ms",
+    "p95_latency_ms", "p99_latency_ms", "avg_tokens", "estimated_cost_per_1k",
+)
+
+class RunWarehouse:
+    """Indexed SQLite history of comparison reports.
+
+    Each report becomes one ``runs`` row (with the full report JSON), one
+    ``model_scores`` row per model and its latency histogram buckets in
+    ``latency_buckets``. Every query walks the ``(model, run_id)`` index
+    backwards, so trend, percentile and rolling-baseline lookups touch only
+    the rows in the window and stay in the millisecond range over thousands
+    of runs.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id INTEGER PRIMARY KEY AUTOINCREMENT, report_id TEXT UNIQUE NOT NULL, "
+            "timestamp TEXT NOT NULL, all_passed INTEGER NOT NULL, report TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS model_scores ("
+            "run_id INTEGER NOT NULL REFERENCES runs(run_id), model TEXT NOT NULL, role TEXT NOT NULL, "
+            "dataset_size INTEGER NOT NULL, passed INTEGER NOT NULL, "
+            + ", ".join(f"{metric} REAL" for metric in WAREHOUSE_METRICS)
+            + ", PRIMARY KEY (run_id, model));"
+            "CREATE INDEX IF NOT EXISTS idx_scores_model ON model_scores(model, run_id);"
+            "CREATE TABLE IF NOT EXISTS latency_buckets ("
+            "run_id INTEGER NOT NULL, model TEXT NOT NULL, le_ms REAL NOT NULL, count INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_buckets_model ON latency_buckets(model, run_id);"
+        )
+
+    def ingest(self, report: dict) -> int | None:
+        """Store a comparison report. Returns its run id, or None if its report id is already stored."""
+        with self._db:
+            try:
+                cursor = self._db.execute(
+                    "INSERT INTO runs (report_id, timestamp, all_passed, report) VALUES (?, ?, ?, ?)",
+                    (report["report_id"], report["timestamp"], int(report["all_passed"]), json.dumps(report)),
+                )
+            except sqlite3.IntegrityError:
+                return None
+            run_id = cursor.lastrowid
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO model_scores (run_id, model, role, dataset_size, passed, "
+                f"{', '.join(WAREHOUSE_METRICS)}) VALUES ({', '.join('?' * (5 + len(WAREHOUSE_METRICS)))})",
+                [
+                    (run_id, m["name"], m["role"], m["dataset_size"], int(m["passed"]),
+                     *(m.get(metric) for metric in WAREHOUSE_METRICS))
+                    for m in report["models"]
+                ],
+            )
+            self._db.executemany(
+                "INSERT INTO latency_buckets (run_id, model, le_ms, count) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, m["name"], bucket["le_ms"], bucket["count"])
+                    for m in report["models"] for bucket in m.get("latency_histogram", [])
+                ],
+            )
+        return run_id
+
+    def trend(self, model: str, metric: str, limit: int = 20) -> list[tuple[int, str, float]]:
+        """``(run_id, timestamp, value)`` for the latest ``limit`` runs of ``model``, oldest first."""
+        if metric not in WAREHOUSE_METRICS:
+            raise ValueError(f"Unknown metric {metric!r}; choose from {', '.join(WAREHOUSE_METRICS)}")
+        rows = self._db.execute(
+            f"SELECT s.run_id, r.timestamp, s.{metric} FROM model_scores s JOIN runs r USING (run_id) "
+            f"WHERE s.model = ? AND s.{metric} IS NOT NULL ORDER BY s.run_id DESC LIMIT ?",
+            (model, limit),
+        ).fetchall()
+        return rows[::-1]
+
+    def percentile(self, model: str, metric: str, q: float, window: int = 20) -> float | None:
+        """``q``-quantile (0-1) of ``metric`` over the latest ``window`` runs."""
+        values = sorted(value for _, _, value in self.trend(model, metric, window))
+        if not values:
+            return None
+        position = q * (len(values) - 1)
+        lower = math.floor(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    def rolling_baseline(self, model: str, window: int = 10) -> dict[str, float]:
+        """Median of each stored metric over the latest ``window`` runs of ``model``."""
+        baseline = {}
+        for metric in WAREHOUSE_METRICS:
+            median = self.percentile(model, metric, 0.5, window)
+            if median is not None:
+                baseline[metric] = median
+        return baseline
+
+    def latency_quantile(self, model: str, q: float, window: int = 20) -> float | None:
+        """Latency ``q``-quantile (0-1) pooled over the latest ``window`` runs' histograms.
+
+        Resolution is one power-of-two histogram bucket; the bucket bound is returned.
+        """
+        rows = self._db.execute(
+            "SELECT le_ms, SUM(count) FROM latency_buckets WHERE model = ? AND run_id IN ("
+            "SELECT run_id FROM model_scores WHERE model = ? ORDER BY run_id DESC LIMIT ?) "
+            "GROUP BY le_ms ORDER BY le_ms",
+            (model, model, window),
+        ).fetchall()
+        total = sum(count for _, count in rows)
+        seen = 0
+        for le_ms, count in rows:
+            seen += count
+            if seen >= q * total:
+                return le_ms
+        return None
+
+    def close(self) -> None:
+        self._db.close()
+
+# ---------------------------------------------------------------------------
+# Regression check
+# ---------------------------------------------------------------------------
+
+def check_regression(
+    report: dict,
+    baseline_path: str | None,
+    max_regression_pct: float,
+    warehouse: RunWarehouse | None = None,
+    rolling_window: int = 0,
+) -> bool:
+    """Check if primary model regressed from baseline. Returns True if OK.
+
+    With a ``warehouse`` and ``rolling_window`` > 0, the baseline is the
+    median of the primary model's last ``rolling_window`` stored runs
+    instead of a baseline file.
+    """
+    # Find primary model in current results
+    primary = next((m for m in report["models"] if m["role"] == "primary"), None)
+    if not primary:
+        print(" No primary model found in results - skipping regression check")
+        return True
+
+    if warehouse and rolling_window > 0:
+        baseline_scores = warehouse.rolling_baseline(primary["name"], rolling_window)
+        if not baseline_scores:
+            print(f" No history for {primary['name']} in the warehouse - skipping regression check")
+            return True
+        runs = len(warehouse.trend(primary["name"], "task_completion", rolling_window))
+        print(f" Baseline: median of the last {runs} run(s) of {primary['name']}")
+        return _compare_to_baseline(primary, baseline_scores, max_regression_pct)
+
+    if not baseline_path:
+        # Try default location
+        candidates = [
+            "evaluation/baseline.json",
+            "baseline.json",
+            "evaluation/results/baseline.json",
+        ]
+        for candidate in candidates:
+            if Path(candidate).exists():
+                baseline_path = candidate
+                break
+
+    if not baseline_path or not Path(baseline_path).exists():
+        print(" No baseline found - skipping regression check")
+        return True
+
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    return _compare_to_baseline(primary, baseline.get("scores", baseline), max_regression_pct)
+
+def _compare_to_baseline(primary: dict, baseline_scores: dict, max_regression_pct: float) -> bool:
+    regression_found = False
+
+    for metric in ["task_completion", "format_compliance"]:
+        baseline_val = baseline_scores.get(metric, 0)
+        current_val = primary.get(metric, 0)
+        if baseline_val > 0:
+            drop_pct = ((baseline_val - current_val) / baseline_val) * 100
+            if drop_pct > max_regression_pct:
+                print(f" REGRESSION: {metric} dropped {drop_pct:.1f}% "
+                      f"(baseline: {baseline_val:.3f} -> current: {current_val:.3f})")
+                regression_found = True
+            else:
+                print(f" {metric}: {current_val:.3f} (baseline: {baseline_val:.3f}) - OK")
+
+    return not regression_found
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run multi-model evaluation comparison for AI agents",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+ # Run full comparison using config
+ python run-model-comparison.py --config config/models.yaml --dataset evaluation/core-regression.jsonl
+
+ # Compare from pre-existing result files
+ python run-model-comparison.py --results-dir evaluation/results/
+
+ # CI gate check
+ python run-model-comparison.py --results-dir evaluation/results/ --check-gates --fail-on-regression
+ """,
+    )
+
+    parser.add_argument("--config", default="config/models.yaml",
+                        help="Path to model matrix config (default: config/models.yaml)")
+    parser.add_argument("--dataset", default="evaluation/core-regression.jsonl",
+                        help="Path to evaluation dataset JSONL")
+    parser.add_argument("--results-dir", default="evaluation/results",
+                        help="Directory for per-model result files")
+    parser.add_argument("--output-dir", default="evaluation",
+                        help="Directory for comparison reports")
+    parser.add_argument("--system-prompt",
+                        help="System prompt for the agent (or path to .txt file)")
+    parser.add_argument("--check-gates", action="store_true",
+                        help="Check thresholds and exit with code 1 on failure")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit 1 if primary model regressed from baseline")
+    parser.add_argument("--baseline", default=None,
+                        help="Path to baseline scores JSON")
+    parser.add_argument("--warehouse", default=None,
+                        help="SQLite run warehouse; every comparison report is recorded in it")
+    parser.add_argument("--rolling-baseline", type=int, default=0,
+                        help="With --warehouse, compare against the median of the last N runs "
+                             "instead of --baseline (default: 0 = off)")
+    parser.add_argument("--skip-eval", action="store_true",
+                        help="Skip evaluation, only compare existing results")
+    parser.add_argument("--sample", default=None,
+                        help="Evaluate only this many dataset rows, or a percentage such as 1%%")
+    parser.add_argument("--sample-method", choices=SAMPLE_METHODS, default="random",
+                        help="random (default), stratified by tags, or the first N rows")
+    parser.add_argument("--sample-seed", type=int, default=0,
+                        help="Seed for --sample; keep it fixed to resume or share a queue (default: 0)")
+    parser.add_argument("--mode", choices=("interactive", "batch"), default="interactive",
+                        help="interactive chat calls (default) or one submission per model to the batch API")
+    parser.add_argument("--batch-dir", default=None,
+                        help="With --mode batch, use the file-based stand-in service rooted here")
+    parser.add_argument("--batch-poll-s", type=float, default=30.0,
+                        help="Seconds between batch status polls (default: 30)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Max in-flight requests per model (default: 1)")
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="Warm-up requests per model before timing starts: a fixed one-token prompt, "
+                             "excluded from results but charged to --max-spend (default: 0; use "
+                             "--concurrency + 1 to warm a connection per worker without HTTP/2)")
+    parser.add_argument("--adaptive-concurrency", action="store_true",
+                        help="Adjust in-flight requests per model with AIMD, capped at --concurrency; "
+                             "retries 429/5xx honouring Retry-After")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Fire a duplicate request for stragglers slower than the running p95")
+    parser.add_argument("--hedge-delay-ms", type=float, default=None,
+                        help="Fixed hedge delay instead of the running p95 (implies --hedge)")
+    parser.add_argument("--hedge-budget", type=float, default=0.05,
+                        help="Max hedged requests as a fraction of all requests (default: 0.05)")
+    parser.add_argument("--dedupe", type=int, nargs="?", const=1, default=0, metavar="K",
+                        help="Call the model at most K times (default 1) per unique query and copy "
+                             "the results to its duplicates")
+    parser.add_argument("--max-spend", type=float, default=None, metavar="USD",
+                        help="Stop scheduling model calls once this run has spent USD across all models "
+                             "(needs a pricing section in the config; per process with --queue)")
+    parser.add_argument("--serial-models", action="store_true",
+                        help="Evaluate models one after another instead of in parallel")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Discard existing .jsonl result files instead of resuming them")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="off",
+                        help="Response cache mode: read (use + fill), write (refresh), off (default)")
+    parser.add_argument("--cache-dir", default="evaluation/.cache",
+                        help="Directory for the response cache (default: evaluation/.cache)")
+    parser.add_argument("--cache-max-mb", type=float, default=512,
+                        help="Response cache size cap in MB, LRU-evicted (default: 512)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Use the streaming chat API and record time-to-first-token and tokens/sec")
+    parser.add_argument("--judge", action="store_true",
+                        help="Score responses against --rubrics-dir with an LLM judge before comparing")
+    parser.add_argument("--judge-model", default=None,
+                        help="Judge model name from the config, or a deployment name (default: the primary model)")
+    parser.add_argument("--rubrics-dir", default="evaluation/rubrics",
+                        help="One <metric>.md rubric per judged metric (default: evaluation/rubrics)")
+    parser.add_argument("--judge-rubric", action="append", default=None, metavar="METRIC",
+                        help="Also judge this report-only rubric (repeatable, or 'all'); "
+                             f"by default only the gated rubrics ({', '.join(JUDGED_FIELDS)}) are judged")
+    parser.add_argument("--judge-batch-size", type=int, default=8,
+                        help="(query, response) pairs scored per judge call (default: 8)")
+    parser.add_argument("--judge-concurrency", type=int, default=4,
+                        help="Judge calls in flight at once (default: 4)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes used to aggregate result files (default: 1)")
+    parser.add_argument("--no-aggregate-cache", action="store_true",
+                        help="Re-parse every result file instead of reusing cached aggregates")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="Bootstrap resamples for confidence intervals and paired comparisons "
+                             "(default: 0 = off; requires numpy)")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Confidence level for --bootstrap intervals (default: 0.95)")
+    parser.add_argument("--shard", default=None,
+                        help="Evaluate only shard i of N (1-based, e.g. 2/4), stratified by dataset tags")
+    parser.add_argument("--queue", default=None,
+                        help="SQLite work queue shared with --queue-worker processes; this process coordinates")
+    parser.add_argument("--queue-worker", action="store_true",
+                        help="Only pull work from --queue; the coordinator enqueues and merges results")
+    parser.add_argument("--lease-seconds", type=float, default=300.0,
+                        help="Seconds before an unfinished queue lease is handed to another worker (default: 300)")
+    parser.add_argument("--early-stop", action="store_true",
+                        help="Stop a model once it is statistically certain to fail the completion gates")
+    parser.add_argument("--early-stop-confidence", type=float, default=0.95,
+                        help="Confidence required before stopping a model early (default: 0.95)")
+    parser.add_argument("--early-stop-min-samples", type=int, default=50,
+                        help="Results collected before the first early-stop check (default: 50)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print per-phase wall/CPU time and peak memory and write comparison-timing.json")
+    parser.add_argument("--otel", choices=OTEL_EXPORTERS, default=None,
+                        help="Emit OpenTelemetry spans per phase, model and query to stdout or a file "
+                             "(requires opentelemetry-sdk)")
+    parser.add_argument("--otel-file", default=None,
+                        help="Span output for --otel file, one JSON span per line "
+                             "(default: <output-dir>/otel-spans.jsonl)")
+
+    return parser.parse_args()
+
+def parse_history_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="run-model-comparison.py history",
+        description="Query the run warehouse for metric trends and rolling baselines",
+    )
+    parser.add_argument("--warehouse", default="evaluation/history.sqlite",
+                        help="Run warehouse written by --warehouse (default: evaluation/history.sqlite)")
+    parser.add_argument("--model", required=True, help="Model name to report on")
+    parser.add_argument("--metric", default="task_completion", choices=WAREHOUSE_METRICS,
+                        help="Metric to trend (default: task_completion)")
+    parser.add_argument("--limit", type=int, default=20, help="Number of recent runs (default: 20)")
+    return parser.parse_args(argv)
+
+def history_main(argv: list[str]) -> int:
+    args = parse_history_args(argv)
+    if not Path(args.warehouse).exists():
+        print(f"ERROR: Warehouse not found: {args.warehouse}", file=sys.stderr)
+        return 1
+    warehouse = RunWarehouse(Path(args.warehouse))
+    try:
+        rows = warehouse.trend(args.model, args.metric, args.limit)
+        if not rows:
+            print(f"No runs of {args.model} in {args.warehouse}")
+            return 1
+        print(f"\n{args.metric} for {args.model} (last {len(rows)} runs)")
+        for run_id, timestamp, value in rows:
+            print(f" #{run_id:<6} {timestamp} {value:.3f}")
+        p10, p50, p90 = (warehouse.percentile(args.model, args.metric, q, args.limit) for q in (0.1, 0.5, 0.9))
+        print(f"\n p10/p50/p90: {p10:.3f}/{p50:.3f}/{p90:.3f}")
+        p95 = warehouse.latency_quantile(args.model, 0.95, args.limit)
+        if p95 is not None:
+            print(f" Pooled latency p95: <= {p95:.0f}ms")
+    finally:
+        warehouse.close()
+    return 0
+
+def parse_merge_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="run-model-comparison.py merge",
+        description="Merge per-shard result files into one result file per model",
+    )
+    parser.add_argument("inputs", nargs="+",
+                        help="Shard result files or directories containing them")
+    parser.add_argument("--output-dir", default="evaluation/results",
+                        help="Directory for the merged result files (default: evaluation/results)")
+    return parser.parse_args(argv)
+
+def merge_main(argv: list[str]) -> int:
+    args = parse_merge_args(argv)
+    inputs = [Path(p) for p in args.inputs]
+    missing = [str(p) for p in inputs if not p.exists()]
+    if missing:
+        print(f"ERROR: Not found: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    print("\nMerging shard results...")
+    return 0 if merge_result_files(inputs, Path(args.output_dir)) else 1
+
+def parse_loadtest_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="run-model-comparison.py loadtest",
+        description="Open-loop load test: replay dataset queries at fixed arrival rates and map saturation",
+    )
+    parser.add_argument("--config", default="config/models.yaml",
+                        help="Path to model matrix config (default: config/models.yaml)")
+    parser.add_argument("--dataset", default="evaluation/core-regression.jsonl",
+                        help="Queries to replay, cycled as often as the schedule needs")
+    parser.add_argument("--cache-dir", default="evaluation/.cache",
+                        help="Directory for the dataset index, shared with comparison runs "
+                             "(default: evaluation/.cache)")
+    parser.add_argument("--model", action="append",
+                        help="Only load-test this model (repeatable; default: every model in the config)")
+    parser.add_argument("--system-prompt",
+                        help="System prompt for the agent (or path to .txt file)")
+    parser.add_argument("--rates", default="1,2,4,8,16",
+                        help="Target requests/sec per step, comma-separated (default: 1,2,4,8,16)")
+    parser.add_argument("--step-s", type=float, default=30.0,
+                        help="Seconds each rate is held (default: 30)")
+    parser.add_argument("--arrival", choices=ARRIVAL_PATTERNS, default="poisson",
+                        help="constant spacing, poisson (default), or a linear ramp from the previous rate")
+    parser.add_argument("--max-in-flight", type=int, default=256,
+                        help="Outstanding requests before new arrivals are dropped (default: 256)")
+    parser.add_argument("--drain-s", type=float, default=30.0,
+                        help="Seconds to wait for outstanding requests after the last step (default: 30)")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming chat API")
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="Warm-up requests per model before the first step, excluded from the steps (default: 0)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for Poisson arrivals")
+    parser.add_argument("--output-dir", default="evaluation",
+                        help="Directory for loadtest-report.json/.md (default: evaluation)")
+    return parser.parse_args(argv)
+
+def loadtest_main(argv: list[str]) -> int:
+    args = parse_loadtest_args(argv)
+    try:
+        rates = parse_rates(args.rates)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    if args.step_s <= 0 or args.max_in_flight < 1 or args.warmup < 0:
+        print("ERROR: --step-s must be > 0, --max-in-flight >= 1 and --warmup >= 0", file=sys.stderr)
+        return 1
+    if not Path(args.config).exists() or not Path(args.dataset).exists():
+        print(f"ERROR: Need both --config ({args.config}) and --dataset ({args.dataset})", file=sys.stderr)
+        return 1
+    models = [m for m in load_models(load_config(args.config)) if not args.model or m.name in args.model]
+    dataset = load_dataset(args.dataset, index_dir=Path(args.cache_dir) / "datasets")
+    if not models or not dataset:
+        print("ERROR: No models or no queries to load-test", file=sys.stderr)
+        return 1
+
+    system_prompt = "You are a helpful assistant."
+    if args.system_prompt:
+        sp_path = Path(args.system_prompt)
+        system_prompt = sp_path.read_text(encoding="utf-8") if sp_path.exists() else args.system_prompt
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "dataset": args.dataset,
+        "arrival": args.arrival,
+        "step_seconds": args.step_s,
+        "rates": rates,
+        "max_in_flight": args.max_in_flight,
+        "models": [],
+    }
+    # One model at a time, so models sharing a deployment do not load each other
+    for model in models:
+        print(f"\nLoad testing {model.name}: {args.arrival} arrivals at {args.rates} req/s, {args.step_s:g}s per step")
+        steps, warmed = asyncio.run(run_load_test(
+            model, dataset, system_prompt, rates,
+            step_seconds=args.step_s,
+            arrival=args.arrival,
+            max_in_flight=args.max_in_flight,
+            drain_seconds=args.drain_s,
+            seed=args.seed,
+            stream=args.stream,
+            warmup=args.warmup,
+        ))
+        report["models"].append({
+            "name": model.name,
+            "role": model.role,
+            "deployment": model.deployment,
+            **({"warmup": warmed} if warmed else {}),
+            "sustainable_qps": sustainable_qps(steps),
+            "steps": [asdict(s) for s in steps],
+        })
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    markdown = generate_loadtest_markdown(report)
+    (output_dir / "loadtest-report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    (output_dir / "loadtest-report.md").write_text(markdown, encoding="utf-8")
+    print("\n" + markdown)
+    print(f" Saved: {output_dir / 'loadtest-report.json'}")
+    print(f" Saved: {output_dir / 'loadtest-report.md'}")
+    return 0
+
+def main() -> int:
+    if sys.argv[1:2] == ["merge"]:
+        return merge_main(sys.argv[2:])
+    if sys.argv[1:2] == ["history"]:
+        return history_main(sys.argv[2:])
+    if sys.argv[1:2] == ["loadtest"]:
+        return loadtest_main(sys.argv[2:])
+
+    args = parse_args()
+    shutdown_tracing = None
+    if args.otel:
+        otel_file = Path(args.otel_file) if args.otel_file else Path(args.output_dir) / "otel-spans.jsonl"
+        shutdown_tracing = configure_tracing(args.otel, otel_file)
+    profiler = PhaseProfiler()
+    try:
+        with trace_span("run-model-comparison"):
+            exit_code = run_comparison(args, profiler)
+    finally:
+        if shutdown_tracing:
+            shutdown_tracing()
+    if args.profile:
+        profiler.print_summary()
+        print(f" Saved: {profiler.save(args.output_dir)}")
+    return exit_code
+
+def run_comparison(args: argparse.Namespace, profiler: PhaseProfiler) -> int:
+    """Evaluate (unless skipped), compare and gate; each phase is timed by ``profiler``."""
+    exit_code = 0
+    if args.rolling_baseline and not args.warehouse:
+        print("ERROR: --rolling-baseline requires --warehouse", file=sys.stderr)
+        return 1
+
+    # Load config for thresholds
+    with profiler.phase("load_config"):
+        config = {}
+        config_path = Path(args.config)
+        if config_path.exists():
+            config = load_config(args.config)
+        thresholds = load_thresholds(config)
+
+    # Step 1: Run evaluations (unless --skip-eval or --results-dir only)
+    if not args.skip_eval and config.get("models") and Path(args.dataset).exists():
+        if args.concurrency < 1:
+            print("ERROR: --concurrency must be >= 1", file=sys.stderr)
+            return 1
+        shard = None
+        if args.shard:
+            try:
+                shard = parse_shard(args.shard)
+            except ValueError as e:
+                print(f"ERROR: {e}", file=sys.stderr)
+                return 1
+        if not 0 < args.early_stop_confidence < 1:
+            print("ERROR: --early-stop-confidence must be between 0 and 1", file=sys.stderr)
+            return 1
+        if args.queue_worker and not args.queue:
+            print("ERROR: --queue-worker requires --queue", file=sys.stderr)
+            return 1
+        if args.max_spend is not None and args.max_spend <= 0:
+            print("ERROR: --max-spend must be > 0", file=sys.stderr)
+            return 1
+        if args.warmup < 0:
+            print("ERROR: --warmup must be >= 0", file=sys.stderr)
+            return 1
+        if args.mode == "batch" and (args.shard or args.queue):
+            print("ERROR: --mode batch cannot be combined with --shard or --queue", file=sys.stderr)
+            return 1
+        if args.mode == "batch" and args.max_spend is not None:
+            print("ERROR: --max-spend cannot stop a submitted batch; use it with --mode interactive", file=sys.stderr)
+            return 1
+        if args.mode == "batch":
+            # Options that shape individual interactive requests, which a batch submission never sends
+            interactive_only = [
+                flag for flag, used in (
+                    ("--cache", args.cache != "off"),
+                    ("--dedupe", bool(args.dedupe)),
+                    ("--stream", args.stream),
+                    ("--hedge", args.hedge or args.hedge_delay_ms is not None),
+                    ("--adaptive-concurrency", args.adaptive_concurrency),
+                    ("--warmup", args.warmup > 0),
+                    ("--early-stop", args.early_stop),
+                ) if used
+            ]
+            if interactive_only:
+                print(f"ERROR: --mode batch cannot be combined with {', '.join(interactive_only)}; "
+                      f"use them with --mode interactive", file=sys.stderr)
+                return 1
+        if args.sample:
+            try:
+                parse_sample(args.sample, 1)
+            except ValueError as e:
+                print(f"ERROR: {e}", file=sys.stderr)
+                return 1
+        with profiler.phase("load_dataset"):
+            models = load_models(config)
+            dataset = load_dataset(
+                args.dataset,
+                index_dir=Path(args.cache_dir) / "datasets",
+                sample=args.sample,
+                sample_method=args.sample_method,
+                seed=args.sample_seed,
+            )
+
+        # Load system prompt
+        system_prompt = "You are a helpful assistant."
+        if args.system_prompt:
+            sp_path = Path(args.system_prompt)
+            if sp_path.exists():
+                system_prompt = sp_path.read_text(encoding="utf-8")
+            else:
+                system_prompt = args.system_prompt
+
+        cache = None
+        if args.cache != "off":
+            cache = ResponseCache(
+                Path(args.cache_dir) / "responses.sqlite",
+                mode=args.cache,
+                max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            )
+
+        queue = WorkQueue(Path(args.queue), lease_seconds=args.lease_seconds) if args.queue else None
+
+        print(f"\nRunning evaluation: {len(models)} models {len(dataset)} queries")
+        with profiler.phase("evaluate"):
+            if args.mode == "batch":
+                asyncio.run(run_batch_models(
+                    models=models,
+                    dataset=dataset,
+                    output_dir=Path(args.results_dir),
+                    client=FileBatchClient(Path(args.batch_dir)) if args.batch_dir else OpenAIBatchClient(),
+                    system_prompt=system_prompt,
+                    poll_seconds=args.batch_poll_s,
+                    fresh=args.fresh,
+                ))
+            else:
+                asyncio.run(run_all_models(
+                    models=models,
+                    dataset=dataset,
+                    output_dir=Path(args.results_dir),
+                    system_prompt=system_prompt,
+                    concurrency=args.concurrency,
+                    parallel_models=not args.serial_models,
+                    fresh=args.fresh,
+                    cache=cache,
+                    stream=args.stream,
+                    adaptive=args.adaptive_concurrency,
+                    hedge=(
+                        {"delay_ms": args.hedge_delay_ms, "budget": args.hedge_budget}
+                        if args.hedge or args.hedge_delay_ms is not None else None
+                    ),
+                    shard=shard,
+                    queue=queue,
+                    coordinate=not args.queue_worker,
+                    early_stop=(
+                        {"thresholds": thresholds, "confidence": args.early_stop_confidence,
+                         "min_samples": args.early_stop_min_samples}
+                        if args.early_stop else None
+                    ),
+                    dedupe=args.dedupe,
+                    budget=SpendBudget(args.max_spend) if args.max_spend is not None else None,
+                    warmup=args.warmup,
+                ))
+        if cache:
+            cache.close()
+        if queue:
+            queue.close()
+        if args.queue_worker:
+            # The coordinator merges and compares once the queue drains
+            return 0
+
+    # Step 1b: Score responses with an LLM judge (cached, so unchanged responses cost nothing)
+    results_path = Path(args.results_dir)
+    if args.judge and results_path.exists() and find_result_files(results_path):
+        rubrics = load_rubrics(Path(args.rubrics_dir)) if Path(args.rubrics_dir).is_dir() else []
+        if not rubrics:
+            print(f"ERROR: No rubric .md files in {args.rubrics_dir}", file=sys.stderr)
+            return 1
+        # Report-only rubrics cost judge calls without gating anything, so they are opt-in
+        requested = {name.replace("-", "_") for name in args.judge_rubric or []}
+        unknown = requested - {r.metric for r in rubrics} - {"all"}
+        if unknown:
+            print(f"ERROR: No rubric for --judge-rubric {', '.join(sorted(unknown))} in {args.rubrics_dir}",
+                  file=sys.stderr)
+            return 1
+        if "all" not in requested:
+            rubrics = [r for r in rubrics if r.metric in JUDGED_FIELDS or r.metric in requested]
+        if not rubrics:
+            print(f"ERROR: No gated rubric ({', '.join(JUDGED_FIELDS)}) in {args.rubrics_dir}; "
+                  f"name the ones to judge with --judge-rubric", file=sys.stderr)
+            return 1
+        if args.judge_batch_size < 1 or args.judge_concurrency < 1:
+            print("ERROR: --judge-batch-size and --judge-concurrency must be >= 1", file=sys.stderr)
+            return 1
+        configured = load_models(config) if config.get("models") else []
+        judge = next((m for m in configured if m.name == args.judge_model), None)
+        if judge is None and args.judge_model:
+            judge = ModelSpec(name=args.judge_model, deployment=args.judge_model, role="judge")
+        judge = judge or next((m for m in configured if m.role == "primary"), configured[0] if configured else None)
+        if judge is None:
+            print("ERROR: --judge needs --judge-model or a model in the config", file=sys.stderr)
+            return 1
+
+        print(f"\nJudging responses with {judge.name} against {len(rubrics)} rubric(s)")
+        judge_cache = ResponseCache(
+            Path(args.cache_dir) / "judgements.sqlite",
+            mode="read",
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        )
+        try:
+            with profiler.phase("judge"):
+                asyncio.run(judge_result_files(
+                    results_path, rubrics, judge, judge_cache,
+                    batch_size=args.judge_batch_size,
+                    concurrency=args.judge_concurrency,
+                ))
+        finally:
+            judge_cache.close()
+
+    # Step 2: Compare results
+    if results_path.exists() and find_result_files(results_path):
+        print("\nGenerating comparison report...")
+        with profiler.phase("compare"):
+            report = compare_models(
+                args.results_dir, thresholds, workers=args.workers,
+                bootstrap=args.bootstrap, confidence=args.confidence,
+                use_cache=not args.no_aggregate_cache,
+            )
+
+        # Save reports
+        with profiler.phase("write_reports"):
+            save_reports(report, args.output_dir)
+            print_summary(report)
+
+        # Gate check
+        if args.check_gates and not report["all_passed"]:
+            print("GATE CHECK FAILED: Not all models meet thresholds")
+            exit_code = 1
+
+        # Regression check (against history before this run is recorded)
+        with profiler.phase("regression_check"):
+            warehouse = RunWarehouse(Path(args.warehouse)) if args.warehouse else None
+            if args.fail_on_regression:
+                if not check_regression(report, args.baseline, thresholds.max_regression_pct,
+                                        warehouse=warehouse, rolling_window=args.rolling_baseline):
+                    print("REGRESSION CHECK FAILED: Primary model regressed from baseline")
+                    exit_code = 1
+
+            if warehouse:
+                run_id = warehouse.ingest(report)
+                warehouse.close()
+                if run_id is not None:
+                    print(f" Recorded run #{run_id} in {args.warehouse}")
+                else:
+                    print(f"WARNING: {args.warehouse} already holds report {report['report_id']}; "
+                          f"not recorded again", file=sys.stderr)
+    else:
+        print(f"\nNo results found in {args.results_dir}")
+        print("Run with a valid --config and --dataset to generate results,")
+        print("or provide --results-dir pointing to existing .json/.jsonl result files.")
+        exit_code = 1
+
+    return exit_code
 
 if __name__ == "__main__":
- sys.exit(main())
+    sys.exit(main())